@@ -1,21 +1,24 @@
 import os
+import hmac
 import json
+import uuid
 import asyncio
 from typing import Optional, List
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Request, Body
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from sqlalchemy import select, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
-from google.cloud import storage
 
 from db import SessionLocal, init_db, User, Message, Room, RoomMember, Inventory, GroceryItem, ShoppingList
 from auth import get_password_hash, verify_password, create_access_token, get_current_user_token
 from websocket_manager import ConnectionManager
-from llm import chat_completion, AVAILABLE_MODELS
+from llm_cache import get_llm_cache
+from chat_history import load_chat_history
+from llm import chat_completion, chat_completion_stream, AVAILABLE_MODELS, init_http_clients, close_http_clients, llm_stats
 
 # LLM modules
 from llm_modules.llm_utils import format_chat_history
@@ -25,40 +28,44 @@ from llm_modules.inventory_analyzer import analyze_inventory
 from llm_modules.menu_generator import generate_menu
 from llm_modules.procurement_planner import generate_restock_plan
 from llm_modules.chat_procurement_planner import generate_procurement_plan
-from vector.recommend_utils import get_relevant_grocery_items
+from vector.recommend_utils import get_relevant_grocery_items_many
+from vector.embedding_cache import get_embedding_cache
+from vector.vector_cache import peek_index, IndexNotReady
+from vector.scoring_pool import get_scoring_pool, ScoringOverloaded
+from vector.artifact_sync import sync_artifacts
+from vector.index_reloader import reload_index, reload_status, watch_index_files, start_index_loading, index_state
 
 load_dotenv()
 
 APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
 APP_PORT = int(os.getenv("APP_PORT", "8000"))
 GROCERY_CSV_PATH = os.getenv("GROCERY_CSV_PATH", "./GroceryDataset.csv")
+# Bot reply when catalog search is used before the index has loaded
+CATALOG_LOADING_NOTICE = "⏳ The product catalog is still loading, so store product matches are not included yet. Please try again in a moment."
+SCORING_BUSY_NOTICE = "⏳ Product search is busy right now, so store product matches are not included. Please try again in a moment."
+# Shared secret for /api/admin/* endpoints; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "").strip()
+# Stream plain @gro replies to the room as "message_delta" frames while they are generated
+STREAM_LLM_REPLIES = os.getenv("STREAM_LLM_REPLIES", "1") == "1"
 CSV_HEADERS = ["Sub Category", " Price ", "Rating", "Title"]
 
 # ========= Embeddings Initialization (Cloud Run + GCS Auto Download) =========
-LOCAL_EMBEDDINGS_PATH = "/tmp/embeddings.sqlite"
-EMBEDDINGS_BUCKET = "groceryshopperai-embeddings"
-EMBEDDINGS_BLOB = "embeddings.sqlite"
+# Artifacts land in /tmp (the only writable directory on Cloud Run), where
+# vector_cache looks first. ARTIFACT_SOURCE may point at a local directory instead
+# of the bucket (see vector/artifact_sync.py).
+EMBEDDINGS_DIR = "/tmp"
 
-def download_embeddings_if_needed():
+async def download_embeddings_if_needed():
     """
-    Checks if the embeddings database exists locally (in /tmp).
-    If not, downloads it from Google Cloud Storage.
+    Sync the embedding artifacts from the bucket into /tmp, off the event loop.
+    Files whose checksum already matches the bucket manifest are not downloaded.
     Required for Cloud Run which has an ephemeral filesystem.
     """
-    if os.path.exists(LOCAL_EMBEDDINGS_PATH):
-        print(f"[Startup] Found existing embeddings database at {LOCAL_EMBEDDINGS_PATH}")
-        return
-
-    print(f"[Startup] Downloading {EMBEDDINGS_BLOB} from bucket {EMBEDDINGS_BUCKET}...")
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(EMBEDDINGS_BUCKET)
-        blob = bucket.blob(EMBEDDINGS_BLOB)
-        blob.download_to_filename(LOCAL_EMBEDDINGS_PATH)
-        print(f"[Startup] Download complete: {LOCAL_EMBEDDINGS_PATH}")
+        await asyncio.to_thread(sync_artifacts, EMBEDDINGS_DIR)
     except Exception as e:
         print(f"[Startup] Failed to download embeddings: {e}")
-        # Depending on your logic, you might want to raise e here to stop the container
+        # Whatever is already on disk (if anything) is still served
 
 # ---------------------------------------------
 
@@ -114,23 +121,54 @@ async def get_db() -> AsyncSession:
         yield session
 
 # --------- Utilities ---------
-async def broadcast_message(session: AsyncSession, msg: Message, room_id: int):
-    """Broadcast a message to all WebSocket clients connected to a room"""
+async def broadcast_message(session: AsyncSession, msg: Message, room_id: int, stream_id: Optional[str] = None):
+    """
+    Broadcast a message to all WebSocket clients connected to a room.
+    stream_id links a streamed reply's final message to the deltas that preceded it.
+    """
     username = None
     if msg.user_id:
         u = await session.get(User, msg.user_id)
         username = u.username if u else "unknown"
+    message = {
+        "id": msg.id,
+        "username": username if not msg.is_bot else "LLM Bot",
+        "content": msg.content,
+        "is_bot": msg.is_bot,
+        "created_at": str(msg.created_at)
+    }
+    if stream_id:
+        message["stream_id"] = stream_id
     await manager.broadcast({
         "type": "message",
         "room_id": room_id,
-        "message": {
-            "id": msg.id,
-            "username": username if not msg.is_bot else "LLM Bot",
-            "content": msg.content,
-            "is_bot": msg.is_bot,
-            "created_at": str(msg.created_at)
-        }
+        "message": message
     }, room_id)
+
+async def stream_llm_reply(messages: list, model_name: str, room_id: int, stream_id: str) -> str:
+    """
+    Forward the reply to the room chunk by chunk as "message_delta" frames and
+    return the full text. An error mid-stream is appended to what was received.
+    """
+    parts = []
+    seq = 0
+    try:
+        async for delta in chat_completion_stream(messages, model_name=model_name):
+            parts.append(delta)
+            await manager.broadcast({
+                "type": "message_delta",
+                "room_id": room_id,
+                "stream_id": stream_id,
+                "seq": seq,
+                "delta": delta,
+                "username": "LLM Bot",
+                "is_bot": True,
+            }, room_id)
+            seq += 1
+    except Exception as e:
+        prefix = "\n\n" if parts else ""
+        parts.append(f"{prefix}(LLM error) {e}")
+    return "".join(parts)
     
 async def broadcast_ai_event(room_id: int, event_type: str, narrative: str, payload: dict):
     """
@@ -247,28 +285,19 @@ async def handle_inventory_command(content: str, room_id: int, user_id: int):
         await broadcast_message(session, bot_msg, room_id)
         
 # AI Commands: @gro analyze / menu / restock (inventory + catalog)   
-async def handle_gro_command(kind: str, room_id: int, user_id: int):
+async def handle_gro_command(kind: str, room_id: int, user_id: int, request_text: str = ""):
     """
     kind: "analyze", "menu", restock"
     Use inventory + grocery catalog (if needed), embeddings, and LLM modules.
+    request_text may narrow the catalog search, e.g. "best-rated under $10 in Produce".
     """
     async with SessionLocal() as session:
         # get user model
         user = await session.get(User, user_id)
         model_name = user.preferred_llm_model if user else "openai"
         
-        # Load chat history for this room
-        msgs_res = await session.execute(
-            select(Message)
-            .where(Message.room_id == room_id)
-            .order_by(Message.created_at)
-        )
-        msgs = msgs_res.scalars().all()
-        
-        chat_history = [
-            {"role": "assistant" if m.is_bot else "user", "content": m.content}
-            for m in msgs
-        ]
+        # Recent messages within a token budget, plus the room's rolling summary
+        chat_history = await load_chat_history(session, room_id, model_name=model_name)
         
         # Load inventory
         inv_res = await session.execute(
@@ -305,24 +334,43 @@ async def handle_gro_command(kind: str, room_id: int, user_id: int):
         else:
             search_targets = low_stock_items
         
-        grocery_items = []
-        for item in search_targets:
-            matches = await get_relevant_grocery_items(session, item["product_name"], limit=5)
-            for m in matches:
-                grocery_items.append({
+        # Price / rating / sub-category constraints are applied inside the vector search
+        index = peek_index()
+        columns = index.columns if index is not None else None
+        filters, rating_weight = columns.parse_request(request_text) if columns is not None else (None, 0.0)
+
+        # One batched lookup for every target instead of one round trip per item
+        try:
+            match_lists = await get_relevant_grocery_items_many(
+                session, [item["product_name"] for item in search_targets], limit=5,
+                filters=filters, rating_weight=rating_weight, with_scores=True,
+            )
+        except (IndexNotReady, ScoringOverloaded) as e:
+            # Degraded: answer from inventory alone and say so
+            match_lists = []
+            notice = SCORING_BUSY_NOTICE if isinstance(e, ScoringOverloaded) else CATALOG_LOADING_NOTICE
+            warming = Message(room_id=room_id, user_id=None, is_bot=True, content=notice)
+            session.add(warming)
+            await session.commit()
+            await session.refresh(warming)
+            await broadcast_message(session, warming, room_id)
+        # "for" and "relevance" let the prompt builder keep each target's best matches
+        # when it trims grocery_items to the token budget (see llm_modules/payload.py)
+        by_title = {}
+        for target, matches in zip(search_targets, match_lists):
+            for m, score in matches:
+                # remove duplicates by title, keeping the most relevant match
+                if m.title in by_title and by_title[m.title]["relevance"] >= score:
+                    continue
+                by_title[m.title] = {
                     "title": m.title,
                     "sub_category": m.sub_category,
-                    "price": float(m.price),
+                    "price": float(m.price) if m.price is not None else None,
                     "rating": m.rating_value or 0.0,
-                })
-
-        # remove duplicates by title
-        seen = set()
-        merged = []
-        for g in grocery_items:
-            if g["title"] not in seen:
-                seen.add(g["title"])
-                merged.append(g)
+                    "for": target["product_name"],
+                    "relevance": score,
+                }
+        merged = list(by_title.values())
         
         
         # Run AI Module
@@ -425,64 +473,67 @@ async def maybe_answer_with_llm(content: str, room_id: int, user_id: int):
     
     # ==== AI Commands ====
     if "@gro analyze" in content.lower():
-        await handle_gro_command("analyze", room_id, user_id)
+        await handle_gro_command("analyze", room_id, user_id, content)
         return
     
     if "@gro menu" in content.lower():
-        await handle_gro_command("menu", room_id, user_id)
+        await handle_gro_command("menu", room_id, user_id, content)
         return
     
     if "@gro restock" in content.lower():
-        await handle_gro_command("restock", room_id, user_id)
+        await handle_gro_command("restock", room_id, user_id, content)
         return
     
     if "@gro plan" in content.lower():
         async with SessionLocal() as session:
             user = await session.get(User, user_id)
             model_name = user.preferred_llm_model if user else "openai"
-            
-            msgs_res = await session.execute(
-                select(Message)
-                .where(Message.room_id == room_id)
-                .order_by(Message.created_at)
-            )
-            msgs = msgs_res.scalars().all()
-            chat_history = [
-                {"role": "assistant" if m.is_bot else "user", "content": m.content}
-                for m in msgs
-            ]
+            chat_history = await load_chat_history(session, room_id, model_name=model_name)
         
         # Generic List
         plan_result = await generate_procurement_plan(chat_history=chat_history, model_name=model_name)
         
         # RAG Enrichment: vector search for every keyword in list
         enriched_items = []
+        plan_items = plan_result.get("items", [])
+        names_to_match = [item.get("name") for item in plan_items if item.get("name")]
         async with SessionLocal() as session:
-            for item in plan_result.get("items", []):
-                raw_name = item.get("name")
-                
-                item["match_found"] = False
-                item["real_product"] = None
+            try:
+                match_lists = await get_relevant_grocery_items_many(session, names_to_match, limit=1)
+            except (IndexNotReady, ScoringOverloaded) as e:
+                # Degraded: the plan is still useful, just not matched to store products
+                match_lists = []
+                busy = isinstance(e, ScoringOverloaded)
+                notice = SCORING_BUSY_NOTICE if busy else CATALOG_LOADING_NOTICE
+                plan_result["catalog_status"] = "busy" if busy else "loading"
+                plan_result["narrative"] = f"{plan_result.get('narrative', '')}\n\n{notice}".strip()
+        matches_by_name = dict(zip(names_to_match, match_lists))
+
+        for item in plan_items:
+            raw_name = item.get("name")
+            
+            item["match_found"] = False
+            item["real_product"] = None
+            
+            if raw_name:
+                matches = matches_by_name.get(raw_name, [])
                 
-                if raw_name:
-                    matches = await get_relevant_grocery_items(session, raw_name, limit=1)
+                if matches:
+                    best_match = matches[0]
                     
-                    if matches:
-                        best_match = matches[0]
-                        
-                        item["match_found"] = True
-                        item["real_product"] = {
-                            "id": best_match.id,
-                            "title": best_match.title,
-                            "price": float(best_match.price),
-                            "sub_category": best_match.sub_category,
-                            "rating": best_match.rating_value or 0.0
-                        }
-                        print(f"Matched '{raw_name}' -> '{best_match.title}'")
-                    else:
-                        print(f"No match found for '{raw_name}'")
-                
-                enriched_items.append(item)
+                    item["match_found"] = True
+                    item["real_product"] = {
+                        "id": best_match.id,
+                        "title": best_match.title,
+                        "price": float(best_match.price) if best_match.price is not None else None,
+                        "sub_category": best_match.sub_category,
+                        "rating": best_match.rating_value or 0.0
+                    }
+                    print(f"Matched '{raw_name}' -> '{best_match.title}'")
+                else:
+                    print(f"No match found for '{raw_name}'")
+            
+            enriched_items.append(item)
         
         plan_result["items"] = enriched_items
                 
@@ -511,16 +562,21 @@ async def maybe_answer_with_llm(content: str, room_id: int, user_id: int):
         else:
             model_name = "gemini"
 
-    try:
-        reply_text = await chat_completion(
-            [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": llm_content},
-            ],
-            model_name=model_name,
-        )
-    except Exception as e:
-        reply_text = f"(LLM error) {e}"
+    llm_messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": llm_content},
+    ]
+    stream_id = None
+    if STREAM_LLM_REPLIES:
+        # Users see the first words after time-to-first-token; the message is stored once, complete
+        stream_id = uuid.uuid4().hex
+        reply_text = await stream_llm_reply(llm_messages, model_name, room_id, stream_id)
+    else:
+        try:
+            # Conversational replies should not repeat word for word
+            reply_text = await chat_completion(llm_messages, model_name=model_name, cache=False)
+        except Exception as e:
+            reply_text = f"(LLM error) {e}"
 
     # Create new session for this async task
     async with SessionLocal() as session:
@@ -533,21 +589,31 @@ async def maybe_answer_with_llm(content: str, room_id: int, user_id: int):
         session.add(bot_msg)
         await session.commit()
         await session.refresh(bot_msg)
-        await broadcast_message(session, bot_msg, room_id)
+        await broadcast_message(session, bot_msg, room_id, stream_id=stream_id)
     
 
 # --------- Routes ---------
 @app.on_event("startup")
 async def on_startup():
     try:
-        # Download the vector DB first
-        download_embeddings_if_needed()
-        
+        # Embedding index + attribute columns + BM25 index, as one snapshot.
+        # Downloaded and loaded in the background so the instance serves requests meanwhile (see /health/ready)
+        start_index_loading(prepare=download_embeddings_if_needed)
+        # Pick up new artifacts without a redeploy
+        asyncio.create_task(watch_index_files())
+        # Long-lived, keep-alive connections to the LLM providers
+        await init_http_clients()
+
         await init_db()
         print("DB initialized successfully")
     except Exception as e:
         print(f"Startup failed: {e}")
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    get_scoring_pool().shutdown()
+    await close_http_clients()
+
 @app.post("/api/signup")
 async def signup(payload: AuthPayload, session: AsyncSession = Depends(get_db)):
     """Create a new user"""
@@ -1118,6 +1184,56 @@ async def check_shopping_list_item(
     
     return {"ok": True, "checked": new_checked, "inventory_updated": new_checked}
 
+@app.get("/health/live")
+async def health_live():
+    """The process is up and the event loop responds"""
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Ready once the catalog index is loaded; 503 with state "loading" (or "failed") until then"""
+    state = index_state()
+    index = peek_index()
+    body = {
+        "status": state,
+        "index_version": index.version if index is not None else None,
+        "index_rows": len(index) if index is not None else None,
+        "load_seconds": index.load_seconds if index is not None else None,
+    }
+    if state != "ready":
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/api/vector/stats")
+async def get_vector_stats():
+    """Vector search runtime counters"""
+    return {
+        "index": peek_index().describe() if peek_index() is not None else None,
+        "embedding_cache": get_embedding_cache().stats(),
+        "reload": reload_status(),
+        "scoring_pool": get_scoring_pool().stats(),
+    }
+
+@app.get("/api/llm/stats")
+async def get_llm_stats():
+    """LLM provider call latency, connection pools and the response cache"""
+    return {"providers": llm_stats(), "response_cache": get_llm_cache().stats()}
+
+@app.post("/api/admin/reload-index")
+async def admin_reload_index(request: Request, force: bool = False):
+    """
+    Swap in a freshly loaded search index without a restart.
+    Requires the X-Admin-Token header to match ADMIN_TOKEN (disabled when unset).
+    """
+    token = request.headers.get("X-Admin-Token", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    try:
+        result = await reload_index(force=force, reason="admin")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed: {e}")
+    return {**result, **reload_status()}
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket, room_id: int):
     await manager.connect(websocket, room_id)
@@ -0,0 +1,203 @@
+"""
+Bounded chat history for the AI commands.
+
+Prompts used to carry every message of the room, AI_EVENT_JSON blobs included,
+so long-lived rooms got slower and more expensive with each message. Instead:
+
+- The newest messages are loaded, newest first, until CHAT_HISTORY_TOKEN_BUDGET
+  is spent (AI event payloads compacted to their type and narrative, single
+  messages capped at CHAT_HISTORY_MAX_MESSAGE_TOKENS).
+- Everything older is represented by a rolling per-room summary (room_summaries
+  table). When messages slide out of the window, only those are folded into the
+  previous summary with one LLM call; the summary is never rebuilt from scratch.
+  Folding takes some extra of the oldest window messages as well, so the next
+  few commands find nothing to fold.
+"""
+import os
+import json
+import asyncio
+from typing import List, Dict
+
+from sqlalchemy import select, desc
+
+from db import Message, RoomSummary
+from llm import chat_completion
+from llm_modules.llm_utils import estimate_tokens, format_chat_history
+
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "3000"))
+CHAT_HISTORY_MAX_MESSAGE_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_MESSAGE_TOKENS", "400"))
+# Rows read per window query; the token budget usually stops earlier
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "200"))
+# "compact": keep an AI event as its type + narrative; "exclude": drop it
+CHAT_HISTORY_AI_EVENTS = os.getenv("CHAT_HISTORY_AI_EVENTS", "compact").strip().lower()
+# Fraction of the budget also folded into the summary when folding is needed
+CHAT_SUMMARY_HYSTERESIS = float(os.getenv("CHAT_SUMMARY_HYSTERESIS", "0.5"))
+# Most message text (in tokens) sent to one summary update; older overflow is skipped
+CHAT_SUMMARY_INPUT_TOKENS = int(os.getenv("CHAT_SUMMARY_INPUT_TOKENS", "6000"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+
+AI_EVENT_PREFIX = "AI_EVENT_JSON:"
+_NARRATIVE_CHARS = 300
+
+# Serializes folds of one room within this worker process only (other workers
+# may fold the same room concurrently; the last write wins). Entries are dropped
+# once no command is using them.
+_room_locks: Dict[int, asyncio.Lock] = {}
+_room_lock_users: Dict[int, int] = {}
+
+
+def compact_content(content: str) -> str | None:
+    """Message text as it should appear in a prompt, or None to leave it out."""
+    content = content or ""
+    if content.startswith(AI_EVENT_PREFIX):
+        if CHAT_HISTORY_AI_EVENTS == "exclude":
+            return None
+        try:
+            event = json.loads(content[len(AI_EVENT_PREFIX):])
+        except ValueError:
+            return "[AI event]"
+        narrative = " ".join(str(event.get("narrative", "")).split())[:_NARRATIVE_CHARS]
+        return f"[AI event: {event.get('event_type', 'unknown')}] {narrative}".strip()
+    max_chars = CHAT_HISTORY_MAX_MESSAGE_TOKENS * 4
+    if len(content) > max_chars:
+        return content[:max_chars] + " …"
+    return content
+
+
+def _entry(m: Message) -> Dict[str, str] | None:
+    content = compact_content(m.content)
+    if content is None:
+        return None
+    return {"role": "assistant" if m.is_bot else "user", "content": content}
+
+
+async def _load_window(session, room_id: int, after_id: int, budget: int):
+    """
+    (window, overflow): the newest messages after `after_id` that fit in `budget`
+    tokens, oldest first, as (id, entry) pairs; and whether older unsummarized
+    messages remain beyond them.
+    """
+    rows = (await session.execute(
+        select(Message)
+        .where(Message.room_id == room_id, Message.id > after_id)
+        .order_by(desc(Message.id))
+        .limit(CHAT_HISTORY_MAX_MESSAGES)
+    )).scalars().all()
+
+    window, used = [], 0
+    for m in rows:
+        entry = _entry(m)
+        if entry is None:
+            continue
+        cost = estimate_tokens(entry["content"])
+        if used + cost > budget and window:
+            return window[::-1], True
+        window.append((m.id, entry))
+        used += cost
+    return window[::-1], len(rows) == CHAT_HISTORY_MAX_MESSAGES
+
+
+async def _load_gap(session, room_id: int, after_id: int, before_id: int):
+    """
+    Unsummarized messages between the summary and the window, oldest first,
+    capped in rows (CHAT_HISTORY_MAX_MESSAGES) and tokens (CHAT_SUMMARY_INPUT_TOKENS).
+    """
+    rows = (await session.execute(
+        select(Message)
+        .where(Message.room_id == room_id, Message.id > after_id, Message.id < before_id)
+        .order_by(desc(Message.id))
+        .limit(CHAT_HISTORY_MAX_MESSAGES)
+    )).scalars()
+    gap, used = [], 0
+    for m in rows:
+        entry = _entry(m)
+        if entry is None:
+            continue
+        used += estimate_tokens(entry["content"])
+        if used > CHAT_SUMMARY_INPUT_TOKENS:
+            break
+        gap.append((m.id, entry))
+    return gap[::-1]
+
+
+async def _fold_summary(previous: str, entries: List[Dict[str, str]], model_name: str) -> str:
+    system_prompt = (
+        "You maintain a running summary of a group chat about groceries, meals and events. "
+        "Update the summary with the new messages. Keep goals, decisions, who does what, "
+        "quantities, preferences and open questions; drop chit-chat. "
+        f"Reply with the updated summary only, under {CHAT_SUMMARY_MAX_TOKENS * 3 // 4} words."
+    )
+    user_prompt = (
+        f"Current summary:\n{previous or '(none yet)'}\n\n"
+        f"New messages:\n{format_chat_history(entries)}"
+    )
+    text = await chat_completion(
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+        model_name=model_name,
+    )
+    return (text or "").strip()
+
+
+async def load_chat_history(session, room_id: int, model_name: str = "openai",
+                            budget: int = CHAT_HISTORY_TOKEN_BUDGET) -> List[Dict[str, str]]:
+    """
+    Chat history for an AI prompt: the room summary (as a "system" entry, if any)
+    followed by the most recent messages within `budget` tokens.
+    Folds messages that left the window into the summary first when needed.
+    """
+    lock = _room_locks.setdefault(room_id, asyncio.Lock())
+    _room_lock_users[room_id] = _room_lock_users.get(room_id, 0) + 1
+    try:
+        async with lock:
+            window, summary = await _load_folded(session, room_id, model_name, budget)
+    finally:
+        _room_lock_users[room_id] -= 1
+        if not _room_lock_users[room_id]:
+            del _room_lock_users[room_id]
+            del _room_locks[room_id]
+
+    history = [{"role": "system", "content": summary}] if summary else []
+    history.extend(entry for _, entry in window)
+    return history
+
+
+async def _load_folded(session, room_id: int, model_name: str, budget: int):
+    """(window, summary) for load_chat_history, folding the gap first when needed."""
+    record = await session.get(RoomSummary, room_id)
+    summary = record.summary if record else ""
+    covered = record.last_message_id if record else 0
+
+    window, overflow = await _load_window(session, room_id, covered, budget)
+    gap = await _load_gap(session, room_id, covered, window[0][0]) if overflow and window else []
+    if gap:
+        # Fold the gap plus the oldest part of the window, then keep the rest
+        spill, spilled = 0, 0
+        for _, entry in window:
+            cost = estimate_tokens(entry["content"])
+            if spilled + cost > budget * CHAT_SUMMARY_HYSTERESIS or spill == len(window) - 1:
+                break
+            spilled += cost
+            spill += 1
+        to_fold = gap + window[:spill]
+        try:
+            summary = await _fold_summary(summary, [e for _, e in to_fold], model_name)
+            covered = to_fold[-1][0] if spill else window[0][0] - 1
+            window = window[spill:]
+            if record is None:
+                record = RoomSummary(room_id=room_id, summary=summary, last_message_id=covered)
+                session.add(record)
+            else:
+                record.summary = summary
+                record.last_message_id = covered
+            await session.commit()
+            print(f"[chat_history] Room {room_id}: folded {len(to_fold)} messages into the summary "
+                  f"(now covers up to #{covered})")
+        except Exception as e:
+            # The window alone is still a valid (if shorter) history
+            await session.rollback()
+            print(f"[chat_history] Room {room_id}: summary update failed: {e}")
+    return window, summary
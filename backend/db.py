@@ -62,6 +62,15 @@ class Message(Base):
     room = relationship("Room", back_populates="messages")
     user = relationship("User", back_populates="messages")
 
+class RoomSummary(Base):
+    """Rolling summary of a room's older messages, folded forward by chat_history.py"""
+    __tablename__ = "room_summaries"
+    room_id: Mapped[int] = mapped_column(ForeignKey("rooms.id", ondelete="CASCADE"), primary_key=True)
+    summary: Mapped[str] = mapped_column(Text())
+    # Every message with id <= last_message_id is covered by the summary
+    last_message_id: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class Inventory(Base):
     __tablename__ = "inventory"
 
@@ -1,9 +1,16 @@
 import os
+import json
+import time
+import asyncio
+import contextlib
+import importlib.util
 import httpx
 import google.generativeai as genai
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
+from llm_cache import get_llm_cache, cache_key, LLM_CACHE_ENABLED, LLM_CACHE_MAX_TEMPERATURE
+
 load_dotenv()
 
 # Supported models
@@ -24,29 +31,59 @@ if AVAILABLE_MODELS["gemini"]["api_key"]:
     gemini_api_key = AVAILABLE_MODELS["gemini"]["api_key"]
     genai.configure(api_key=gemini_api_key)
 
+# --- HTTP connection pool for provider APIs ---
+# One long-lived client per provider, so the sequential calls of an @gro command
+# reuse warm connections instead of each paying a TCP + TLS handshake.
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_WRITE_TIMEOUT = float(os.getenv("LLM_WRITE_TIMEOUT", "10"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))
+# Longest wait between bytes of a response, not for the whole completion
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+# HTTP/2 needs the h2 package (httpx[http2]); without it the pool stays on HTTP/1.1 keep-alive
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1" and importlib.util.find_spec("h2") is not None
+# Hard cap on one Gemini completion (the SDK call has no per-stage timeouts)
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", str(LLM_READ_TIMEOUT)))
+
 # Default model
 DEFAULT_MODEL = os.getenv("LLM_MODEL", "openai").strip().lower()
 
-async def chat_completion(messages, temperature: float = 0.2, max_tokens: int = 512, model_name: str = None) -> str:
+# Embedding model used for the grocery catalog and search queries
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large").strip()
+# Optional reduced width (e.g. 256, 512, 1024) for text-embedding-3 vectors; 0 = native width.
+# Must match the catalog store, which records its dimension in the header.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0") or 0)
+
+async def chat_completion(messages, temperature: float = 0.2, max_tokens: int = 512, model_name: str = None,
+                          cache: bool = True) -> str:
     """
     Supports multiple models: openai, gemini
+    Replies are served from the response cache (see llm_cache.py) when the same
+    request was answered within LLM_CACHE_TTL; pass cache=False for replies that should vary.
     """
     if model_name is None:
         model_name = DEFAULT_MODEL
     
     if model_name not in AVAILABLE_MODELS:
         raise ValueError(f"Model '{model_name}' not available. Choose from: {list(AVAILABLE_MODELS.keys())}")
-    
+
+    response_cache = get_llm_cache()
+    if not (cache and LLM_CACHE_ENABLED and temperature <= LLM_CACHE_MAX_TEMPERATURE):
+        response_cache.bypassed += 1
+        return await _chat_completion_uncached(messages, temperature, max_tokens, model_name)
+    key = cache_key(model_name, AVAILABLE_MODELS[model_name]["model"], messages, temperature, max_tokens)
+    return await response_cache.get_or_call(
+        key, lambda: _chat_completion_uncached(messages, temperature, max_tokens, model_name))
+
+
+async def _chat_completion_uncached(messages, temperature: float, max_tokens: int, model_name: str) -> str:
     config = AVAILABLE_MODELS[model_name]
     provider = model_name
 
     if provider == "openai":
         # OpenAI API endpoint
-        url = f"{config['api_base']}/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {config['api_key']}"
-        }
         payload = {
             "model": config["model"],
             "messages": messages,
@@ -55,63 +92,307 @@ async def chat_completion(messages, temperature: float = 0.2, max_tokens: int =
             "stream": False
         }
         
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            r = await client.post(url, headers=headers, json=payload)
-            r.raise_for_status()
-            data = r.json()
-            return data["choices"][0]["message"]["content"]
+        data = await _post_json("openai", "/chat/completions", payload)
+        return data["choices"][0]["message"]["content"]
 
     elif provider == "gemini":
         # Google Generative AI SDK (official)
-        model = genai.GenerativeModel(config["model"])
+        model = get_gemini_model(config["model"])
         
-        # Convert OpenAI-style messages to Gemini format
-        # Gemini expects [{"role": "user"/"model", "parts": [{"text": "..."}]}]
-        gemini_messages = []
-        for m in messages:
-            role = m.get("role", "user")
-            content_text = m.get("content", "")
-            # Convert role: "assistant" -> "model", others stay as "user"
-            gemini_role = "model" if role == "assistant" else "user"
-            gemini_messages.append({
-                "role": gemini_role,
-                "parts": [{"text": content_text}]
-            })
-        
-        # Use generate_content with permissive settings
-        response = model.generate_content(
-            gemini_messages,
-            generation_config=genai.types.GenerationConfig(
-                temperature=temperature,
-                max_output_tokens=max_tokens
+        gemini_messages = _to_gemini_messages(messages)
+
+        # Async API: a slow answer must not block the event loop (and every room's WebSocket)
+        with _track_call("gemini"):
+            response = await asyncio.wait_for(
+                model.generate_content_async(
+                    gemini_messages,
+                    generation_config=genai.types.GenerationConfig(
+                        temperature=temperature,
+                        max_output_tokens=max_tokens
+                    ),
+                    request_options={"timeout": GEMINI_TIMEOUT},
+                ),
+                GEMINI_TIMEOUT,
             )
-        )
         
-        # Handle blocked responses gracefully
-        try:
-            if response.text:
-                return response.text
-        except ValueError:
-            pass
-        
-        # If response was blocked, check candidates
-        if response.candidates and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'content') and candidate.content and hasattr(candidate.content, 'parts'):
-                if len(candidate.content.parts) > 0:
-                    return candidate.content.parts[0].text
-        
-        return "[Response was filtered by Gemini safety policies]"
+        return _gemini_response_text(response)
 
     else:
         # If reached here, unsupported provider
         raise ValueError(f"Unsupported provider: {provider}")
 
 
-async def get_embedding(text, model="text-embedding-3-large"):
-    client = AsyncOpenAI()
-    res = await client.embeddings.create(
+async def chat_completion_stream(messages, temperature: float = 0.2, max_tokens: int = 512, model_name: str = None):
+    """
+    Same as chat_completion, but yields the reply as text chunks while it is generated.
+    Callers can show the first words after time-to-first-token instead of the whole completion.
+    """
+    if model_name is None:
+        model_name = DEFAULT_MODEL
+    if model_name not in AVAILABLE_MODELS:
+        raise ValueError(f"Model '{model_name}' not available. Choose from: {list(AVAILABLE_MODELS.keys())}")
+    config = AVAILABLE_MODELS[model_name]
+
+    if model_name == "openai":
+        payload = {
+            "model": config["model"],
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        client = get_http_client("openai")
+        with _track_call("openai") as stats:
+            async with client.stream("POST", "/chat/completions", json=payload,
+                                     headers={"Authorization": f"Bearer {config['api_key']}"}) as r:
+                r.raise_for_status()
+                # Server-sent events: "data: {json}" lines, terminated by "data: [DONE]"
+                async for line in r.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or []
+                    delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                    if delta:
+                        _mark_first_token(stats)
+                        yield delta
+
+    elif model_name == "gemini":
+        model = get_gemini_model(config["model"])
+        with _track_call("gemini") as stats:
+            response = await asyncio.wait_for(
+                model.generate_content_async(
+                    _to_gemini_messages(messages),
+                    generation_config=genai.types.GenerationConfig(
+                        temperature=temperature,
+                        max_output_tokens=max_tokens
+                    ),
+                    request_options={"timeout": GEMINI_TIMEOUT},
+                    stream=True,
+                ),
+                GEMINI_TIMEOUT,
+            )
+            chunks = response.__aiter__()
+            produced = False
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), GEMINI_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Blocked chunk: no text parts
+                    text = ""
+                if text:
+                    produced = True
+                    _mark_first_token(stats)
+                    yield text
+            if not produced:
+                yield "[Response was filtered by Gemini safety policies]"
+
+    else:
+        raise ValueError(f"Unsupported provider: {model_name}")
+
+
+def _to_gemini_messages(messages):
+    """
+    Convert OpenAI-style messages to Gemini format:
+    [{"role": "user"/"model", "parts": [{"text": "..."}]}]
+    """
+    gemini_messages = []
+    for m in messages:
+        role = m.get("role", "user")
+        content_text = m.get("content", "")
+        # Convert role: "assistant" -> "model", others stay as "user"
+        gemini_role = "model" if role == "assistant" else "user"
+        gemini_messages.append({
+            "role": gemini_role,
+            "parts": [{"text": content_text}]
+        })
+    return gemini_messages
+
+
+def _gemini_response_text(response) -> str:
+    # Handle blocked responses gracefully
+    try:
+        if response.text:
+            return response.text
+    except ValueError:
+        pass
+
+    # If response was blocked, check candidates
+    if response.candidates and len(response.candidates) > 0:
+        candidate = response.candidates[0]
+        if hasattr(candidate, 'content') and candidate.content and hasattr(candidate.content, 'parts'):
+            if len(candidate.content.parts) > 0:
+                return candidate.content.parts[0].text
+
+    return "[Response was filtered by Gemini safety policies]"
+
+
+_http_clients = {}
+_call_stats = {}
+_gemini_models = {}
+
+
+def get_gemini_model(name: str):
+    """One GenerativeModel per model name (they are stateless and reusable)."""
+    model = _gemini_models.get(name)
+    if model is None:
+        model = _gemini_models[name] = genai.GenerativeModel(name)
+    return model
+
+
+@contextlib.contextmanager
+def _track_call(provider: str):
+    """Count one provider call and its latency in llm_stats()."""
+    stats = _call_stats.setdefault(provider, {
+        "requests": 0, "errors": 0, "timeouts": 0, "in_flight": 0, "seconds": 0.0,
+        "streams": 0, "first_token_seconds": 0.0,
+    })
+    stats["in_flight"] += 1
+    t0 = time.perf_counter()
+    call = {"stats": stats, "started": t0, "first_token": False}
+    try:
+        yield call
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        stats["timeouts"] += 1
+        stats["errors"] += 1
+        raise
+    except Exception:
+        stats["errors"] += 1
+        raise
+    finally:
+        stats["in_flight"] -= 1
+        stats["requests"] += 1
+        stats["seconds"] += time.perf_counter() - t0
+
+
+def _new_http_client(provider: str) -> httpx.AsyncClient:
+    config = AVAILABLE_MODELS[provider]
+    return httpx.AsyncClient(
+        base_url=config["api_base"],
+        http2=LLM_HTTP2,
+        limits=httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=LLM_CONNECT_TIMEOUT, read=LLM_READ_TIMEOUT,
+            write=LLM_WRITE_TIMEOUT, pool=LLM_POOL_TIMEOUT,
+        ),
+    )
+
+
+def get_http_client(provider: str = "openai") -> httpx.AsyncClient:
+    """The pooled client for a provider's REST API (created on first use if startup didn't)."""
+    client = _http_clients.get(provider)
+    if client is None or client.is_closed:
+        client = _http_clients[provider] = _new_http_client(provider)
+    return client
+
+
+async def init_http_clients():
+    """Create the provider clients at startup."""
+    for provider, config in AVAILABLE_MODELS.items():
+        if "api_base" in config:
+            get_http_client(provider)
+    print(f"[llm] HTTP pools ready for {list(_http_clients)} (http2={LLM_HTTP2}, "
+          f"max_connections={LLM_HTTP_MAX_CONNECTIONS})")
+
+
+async def close_http_clients():
+    """Close every pooled connection (shutdown)."""
+    global _openai_client
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+    for client in _http_clients.values():
+        await client.aclose()
+    _http_clients.clear()
+
+
+async def _post_json(provider: str, path: str, payload: dict) -> dict:
+    client = get_http_client(provider)
+    with _track_call(provider):
+        r = await client.post(path, json=payload,
+                              headers={"Authorization": f"Bearer {AVAILABLE_MODELS[provider]['api_key']}"})
+        r.raise_for_status()
+        return r.json()
+
+
+def _mark_first_token(call: dict):
+    """Record time-to-first-token for a streamed call (once)."""
+    if not call["first_token"]:
+        call["first_token"] = True
+        call["stats"]["streams"] += 1
+        call["stats"]["first_token_seconds"] += time.perf_counter() - call["started"]
+
+
+def llm_stats() -> dict:
+    """Per provider: call counters and latency, plus the state of its connection pool if it has one."""
+    out = {}
+    for provider, counters in _call_stats.items():
+        stats = dict(counters)
+        stats["avg_ms"] = round(1000 * stats.pop("seconds") / stats["requests"], 1) if stats["requests"] else None
+        first_token = stats.pop("first_token_seconds")
+        stats["avg_first_token_ms"] = round(1000 * first_token / stats["streams"], 1) if stats["streams"] else None
+        out[provider] = stats
+    for provider, client in _http_clients.items():
+        # httpcore keeps the pool on the transport; not public API, so best effort
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        out.setdefault(provider, {})["pool"] = {
+            "connections": len(connections),
+            "idle_connections": sum(1 for c in connections if c.is_idle()),
+            "http2_connections": sum(1 for c in connections if "HTTP/2" in c.info()),
+            "closed": client.is_closed,
+        }
+    if _gemini_models:
+        out.setdefault("gemini", {})["cached_models"] = sorted(_gemini_models)
+    return out
+
+
+_openai_client = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """One AsyncOpenAI client per process, sharing the pooled OpenAI connections."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(http_client=get_http_client("openai"))
+    return _openai_client
+
+
+def _dimension_kwargs(dimensions):
+    # text-embedding-3 models shorten server-side and return re-normalized vectors
+    return {"dimensions": dimensions} if dimensions else {}
+
+
+async def get_embedding(text, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS):
+    res = await get_openai_client().embeddings.create(
         model=model,
         input=text,
+        **_dimension_kwargs(dimensions),
+    )
+    return res.data[0].embedding
+
+
+async def get_embeddings(texts, model=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Embed many texts with a single embeddings request.
+    Returns one vector per input, in input order.
+    """
+    if not texts:
+        return []
+    res = await get_openai_client().embeddings.create(
+        model=model,
+        input=list(texts),
+        **_dimension_kwargs(dimensions),
     )
-    return res.data[0].embedding
\ No newline at end of file
+    # The API tags each result with its input index; don't rely on response order
+    return [d.embedding for d in sorted(res.data, key=lambda d: d.index)]
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""
+Response cache in front of llm.chat_completion.
+
+The llm_modules prompts are rebuilt from room state (inventory, history, items),
+so re-running "@gro analyze" on an unchanged room sends byte-for-byte the same
+request. Replies are cached by (provider, model, normalized messages,
+temperature, max_tokens):
+
+Tier 1 is an in-process LRU bounded by LLM_CACHE_SIZE entries.
+Tier 2 is a local SQLite file that survives restarts.
+Entries older than LLM_CACHE_TTL seconds are ignored and pruned, so a stale
+answer never outlives the TTL even when the prompt is identical.
+Identical requests that arrive while one is in flight wait for it instead of
+calling the provider again.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+# Set to an empty string to disable the persistent tier
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/tmp/llm_responses.sqlite")
+# Calls sampled hotter than this are meant to vary and are never cached
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.5"))
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS llm_responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Result handed to waiters when the caller making the shared call was cancelled
+_ABANDONED = object()
+
+
+def cache_key(provider: str, model: str, messages, temperature: float, max_tokens: int) -> str:
+    """sha256 of the request; whitespace runs in message contents do not change the key."""
+    normalized = [
+        {"role": m.get("role", "user"), "content": _WHITESPACE_RE.sub(" ", str(m.get("content", ""))).strip()}
+        for m in messages
+    ]
+    blob = json.dumps(
+        {"provider": provider, "model": model, "messages": normalized,
+         "temperature": round(float(temperature), 4), "max_tokens": int(max_tokens)},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, max_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL,
+                 path: str | None = LLM_CACHE_PATH):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path or None
+        self._lru: OrderedDict = OrderedDict()  # key -> (created_at, response)
+        self._lock = threading.Lock()  # LRU and counters only; never held during SQLite I/O
+        self._db_lock = threading.Lock()  # the SQLite connection
+        self._inflight = {}
+        self._conn = None  # opened on first use, on a worker thread (see _db)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    def _fresh(self, created_at: float) -> bool:
+        return time.time() - created_at < self.ttl
+
+    # ---- tier 1 ----
+    def _remember(self, key: str, created_at: float, response: str):
+        self._lru[key] = (created_at, response)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+            self.evictions += 1
+
+    # ---- tier 2 (call with self._db_lock held) ----
+    def _db(self):
+        """The SQLite connection, opened (and pruned of expired rows) on first use."""
+        if self._conn is None and self.path:
+            try:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.execute(CREATE_TABLE_SQL)
+                self._conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (time.time() - self.ttl,))
+                self._conn.commit()
+            except Exception as e:
+                print(f"[llm_cache] Persistent tier disabled ({self.path}): {e}")
+                self._conn = None
+                self.path = None
+        return self._conn
+
+    def _disk_get(self, key: str):
+        conn = self._db()
+        if conn is None:
+            return None
+        return conn.execute(
+            "SELECT created_at, response FROM llm_responses WHERE key = ?", (key,)
+        ).fetchone()
+
+    def _disk_put(self, key: str, created_at: float, response: str):
+        conn = self._db()
+        if conn is None:
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_responses (key, response, created_at) VALUES (?, ?, ?)",
+            (key, response, created_at),
+        )
+        conn.commit()
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                return None
+            if self._fresh(entry[0]):
+                self._lru.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+            del self._lru[key]
+            self.expired += 1
+            return None
+
+    def _get_disk(self, key: str):
+        with self._db_lock:
+            try:
+                row = self._disk_get(key)
+            except Exception as e:
+                print(f"[llm_cache] Persistent lookup failed: {e}")
+                row = None
+        with self._lock:
+            if row is not None and self._fresh(row[0]):
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[1]
+            self.misses += 1
+            return None
+
+    def _put_disk(self, key: str, created_at: float, response: str):
+        with self._db_lock:
+            try:
+                self._disk_put(key, created_at, response)
+            except Exception as e:
+                print(f"[llm_cache] Failed to persist response: {e}")
+
+    def get(self, key: str):
+        """The cached response for `key`, or None (missing or older than the TTL)."""
+        cached = self._get_memory(key)
+        return cached if cached is not None else self._get_disk(key)
+
+    def put(self, key: str, response: str):
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, response)
+        self._put_disk(key, created_at, response)
+
+    async def get_or_call(self, key: str, call):
+        """
+        The cached response for `key`, else `await call()` (stored if it succeeds).
+        Concurrent callers with the same key share one call; if the caller making
+        it is cancelled, the others go back to making their own.
+        The SQLite tier is read and written on a worker thread.
+        """
+        while True:
+            cached = self._get_memory(key)
+            if cached is None:
+                if self.path:
+                    cached = await asyncio.to_thread(self._get_disk, key)
+                else:
+                    cached = self._get_disk(key)
+            if cached is not None:
+                return cached
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            # Counted as a miss by _get_disk(); it is answered without a provider call
+            self.misses -= 1
+            response = await asyncio.shield(pending)
+            if response is not _ABANDONED:
+                self.shared_hits += 1
+                return response
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await call()
+        except asyncio.CancelledError:
+            # Only this caller was cancelled; waiters retry on their own
+            future.set_result(_ABANDONED)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved: there may be no other waiter
+            raise
+        else:
+            future.set_result(response)
+        finally:
+            self._inflight.pop(key, None)
+        if cacheable_response(response):
+            created_at = time.time()
+            with self._lock:
+                self._remember(key, created_at, response)
+            if self.path:
+                await asyncio.to_thread(self._put_disk, key, created_at, response)
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+        with self._db_lock:
+            conn = self._db()
+            if conn is not None:
+                conn.execute("DELETE FROM llm_responses")
+                conn.commit()
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits + self.shared_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": LLM_CACHE_ENABLED,
+            "size": len(self._lru),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "persistent_path": self.path,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "bypassed": self.bypassed,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+def cacheable_response(response) -> bool:
+    """Empty and safety-filtered replies are retried next time rather than cached."""
+    return bool(response) and not response.startswith("[Response was filtered")
+
+
+_cache = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = LLMResponseCache()
+    return _cache
@@ -1,16 +1,37 @@
 import json
 from typing import List, Dict, Any
 
-from llm_modules.llm_utils import (extract_goal, extract_json, format_chat_history,)
+from llm_modules.llm_utils import (extract_goal, extract_json, format_chat_history, run_pipeline, LLM_COMBINED_PROMPTS,)
 from llm import chat_completion
 
-async def generate_procurement_plan(chat_history: List[Dict[str, str]], model_name: str = "openai",) -> Dict[str, Any]:
+async def generate_procurement_plan(chat_history: List[Dict[str, str]], model_name: str = "openai",
+                                    combined: bool = LLM_COMBINED_PROMPTS,) -> Dict[str, Any]:
     """
     Chat-based procurement planner
     Generates a consolidated shopping list by analyzing user intent, resolving conflicts, and merging quantities.
+    combined=True (default) infers the goal within the plan call, so @gro plan is a single LLM round trip;
+    otherwise the goal is extracted first and passed in as a hint.
     """
-    
-    inferred_goal = await extract_goal(chat_history, model_name=model_name)
+    if combined:
+        inferred_goal = ""
+        data = await _request_procurement_plan(chat_history, None, model_name)
+    else:
+        steps = {
+            "goal": (lambda: extract_goal(chat_history, model_name=model_name), []),
+            "plan": (lambda goal: _request_procurement_plan(chat_history, goal, model_name), ["goal"]),
+        }
+        results = await run_pipeline(steps)
+        inferred_goal, data = results["goal"], results["plan"]
+
+    return {
+        "goal": data.get("goal", inferred_goal),
+        "summary": data.get("summary", "Shopping list generated."),
+        "narrative": data.get("narrative", "Here is your consolidated shopping plan."),
+        "items": data.get("items", []),
+    }
+
+
+async def _request_procurement_plan(chat_history: List[Dict[str, str]], inferred_goal: str | None, model_name: str,) -> Dict[str, Any]:
     chat_text = format_chat_history(chat_history)
     
     system_prompt = """
@@ -49,13 +70,10 @@ async def generate_procurement_plan(chat_history: List[Dict[str, str]], model_na
     """
 
     
-    user_content = json.dumps(
-        {
-            "inferred_goal": inferred_goal,
-            "chat_history_text": chat_text,
-        },
-        indent=2
-    )
+    request = {"chat_history_text": chat_text}
+    if inferred_goal is not None:
+        request = {"inferred_goal": inferred_goal, **request}
+    user_content = json.dumps(request, indent=2)
     
     raw = await chat_completion(
         [
@@ -66,10 +84,4 @@ async def generate_procurement_plan(chat_history: List[Dict[str, str]], model_na
     )
 
     data = extract_json(raw)
-    
-    return {
-        "goal": data.get("goal", inferred_goal),
-        "summary": data.get("summary", "Shopping list generated."),
-        "narrative": data.get("narrative", "Here is your consolidated shopping plan."),
-        "items": data.get("items", []),
-    }
\ No newline at end of file
+    return data if isinstance(data, dict) else {}
@@ -1,7 +1,7 @@
-import json
 from typing import List, Dict, Any
 
 from llm import chat_completion
+from llm_modules.payload import PromptPayload, TABLE_FORMAT_NOTE
 from llm_modules.llm_utils import format_chat_history, extract_json
 
 async def analyze_inventory(inventory_items, low_stock_items, healthy_items, grocery_items, chat_history: List[Dict[str, str]] | None = None, model_name: str = "openai") -> Dict[str, Any]:
@@ -36,18 +36,19 @@ async def analyze_inventory(inventory_items, low_stock_items, healthy_items, gro
     - Do NOT change the stock numbers.
     - JSON ONLY.
     """
+    system_prompt += "\n    " + TABLE_FORMAT_NOTE
     
-    user_payload = {
-        "inventory_items": inventory_items,
-        "low_stock": low_stock_items,
-        "healthy": healthy_items,
-        "grocery_items": grocery_items,
-        "chat_history": chat_text
-    }
+    payload = PromptPayload("analyze")
+    payload.add("low_stock", low_stock_items)
+    payload.add("healthy", healthy_items)
+    # Normally the union of the two lists above, so usually omitted entirely
+    payload.add("inventory_items", inventory_items, dedupe_against=("low_stock", "healthy"))
+    payload.add("chat_history", chat_text)
+    payload.add_ranked("grocery_items", grocery_items)
     
     raw = await chat_completion([
         {"role": "system", "content": system_prompt},
-        {"role": "user", "content": json.dumps(user_payload, indent=2)},
+        {"role": "user", "content": payload.build()},
     ], model_name=model_name)
     
     parsed = extract_json(raw)
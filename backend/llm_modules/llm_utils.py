@@ -1,13 +1,27 @@
+import os
 import json
 import re
-from typing import List, Dict, Any
+import asyncio
+from typing import List, Dict, Any, Callable, Awaitable, Tuple
 
 from llm import chat_completion
 
+# One prompt that infers the goal (and assignments) together with the result, instead
+# of separate extraction calls first; set to 0 for the multi-call pipelines
+LLM_COMBINED_PROMPTS = os.getenv("LLM_COMBINED_PROMPTS", "1") == "1"
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (~4 characters per token for English text and JSON).
+    Good enough for budgeting prompts; not an exact tokenizer.
+    """
+    return (len(text) + 3) // 4 if text else 0
+
 def format_chat_history(chat_history: List[Dict[str, str]]) -> str:
     lines = []
     for m in chat_history:
-        role = "User" if m["role"] == "user" else "Assistant"
+        # "system" entries carry the rolling summary of older messages (see chat_history.py)
+        role = {"user": "User", "system": "Earlier conversation summary"}.get(m["role"], "Assistant")
         content = m["content"].replace("\n", " ")
         lines.append(f"[{role}] {content}")
     return "\n".join(lines)
@@ -166,4 +180,39 @@ async def extract_assigned_members(chat_history: List[Dict[str, str]], members:
 
 def get_available_members(members: List[str], assigned: List[str]) -> List[str]:
     # Return members who are not yet assigned.
-    return [m for m in members if m not in assigned]
\ No newline at end of file
+    return [m for m in members if m not in assigned]
+
+
+async def run_pipeline(steps: Dict[str, Tuple[Callable[..., Awaitable[Any]], List[str]]], **known) -> Dict[str, Any]:
+    """
+    Run named async steps as a dependency graph and return every result by name.
+    steps: {name: (fn, [dependency names])}; fn is called with the dependency results
+    as keyword arguments once they are available. Steps that do not depend on each
+    other run concurrently. Names passed in `known` are already resolved and their
+    steps are skipped. If one step fails, the others are cancelled.
+    """
+    results = dict(known)
+    tasks = {}
+
+    def schedule(name):
+        if name not in tasks:
+            fn, deps = steps[name]
+
+            async def run():
+                kwargs = {}
+                for dep in deps:
+                    kwargs[dep] = results[dep] if dep in results else await schedule(dep)
+                return await fn(**kwargs)
+
+            tasks[name] = asyncio.ensure_future(run())
+        return tasks[name]
+
+    names = [name for name in steps if name not in results]
+    try:
+        values = await asyncio.gather(*(schedule(name) for name in names))
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    results.update(zip(names, values))
+    return results
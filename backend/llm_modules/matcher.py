@@ -8,6 +8,8 @@ from llm_modules.llm_utils import (
     extract_goal,
     extract_assigned_members,
     get_available_members,
+    run_pipeline,
+    LLM_COMBINED_PROMPTS,
 )
 
 
@@ -15,15 +17,57 @@ async def suggest_invites(
     members: List[str],
     chat_history: List[Dict[str, str]],
     goal: str | None = None,
-    model_name: str = "openai"
+    model_name: str = "openai",
+    combined: bool = LLM_COMBINED_PROMPTS,
 ) -> Dict[str, Any]:
+    """
+    Suggest who else to invite.
+    combined=True: one call infers the goal and assignments along with the suggestions.
+    Otherwise goal and assignments are extracted concurrently, then the suggestions requested.
+    """
+    if combined:
+        data = await _request_suggestions(members, chat_history, goal, None, model_name)
+        assigned = [m for m in data.get("assigned", []) if m in members]
+        available = get_available_members(members, assigned)
+    else:
+        steps = {
+            "goal": (lambda: extract_goal(chat_history, model_name=model_name), []),
+            "assigned": (lambda: extract_assigned_members(chat_history, members, model_name=model_name), []),
+            "suggestion": (
+                lambda goal, assigned: _request_suggestions(members, chat_history, goal, assigned, model_name),
+                ["goal", "assigned"],
+            ),
+        }
+        results = await run_pipeline(steps, **({"goal": goal} if goal else {}))
+        data = results["suggestion"]
+        available = get_available_members(members, results["assigned"])
 
-    if not goal:
-        goal = await extract_goal(chat_history, model_name=model_name)
+    suggested_invites = [
+        m for m in data.get("suggested_invites", []) if m in available
+    ]
 
-    assigned = await extract_assigned_members(chat_history, members, model_name=model_name)
-    available = get_available_members(members, assigned)
+    missing_roles = data.get("missing_roles", [])
 
+    narrative = data.get("narrative", "Here are some suggestions to help your group planning.")
+
+    return {
+        "suggested_invites": suggested_invites,
+        "missing_roles": missing_roles,
+        "narrative": narrative,
+    }
+
+
+async def _request_suggestions(
+    members: List[str],
+    chat_history: List[Dict[str, str]],
+    goal: str | None,
+    assigned: List[str] | None,
+    model_name: str,
+) -> Dict[str, Any]:
+    """
+    The suggestion call. assigned=None asks the model to work out the goal (if not
+    given) and the assigned members itself, and to return them in the JSON.
+    """
     system_prompt = """
     You are an AI assistant helping a group plan an event.
 
@@ -47,7 +91,26 @@ async def suggest_invites(
 
     chat_text = format_chat_history(chat_history)
 
-    user_prompt = f"""
+    if assigned is None:
+        system_prompt += """
+    ALSO INFER (this request has no separate goal or assignment step):
+    - Add "goal": the group's main event goal from the chat history ("" if none is clear).
+    - Add "assigned": the names from the member list that have clearly been given tasks.
+    - Available members are those not in "assigned".
+    """
+        user_prompt = f"""
+    Goal: {goal or '(infer from the chat history)'}
+
+    All members: {', '.join(members)}
+
+    Chat history:
+    {chat_text}
+
+    Generate the JSON suggestion now, including "goal" and "assigned".
+    """
+    else:
+        available = get_available_members(members, assigned)
+        user_prompt = f"""
     Goal: {goal}
 
     All members: {', '.join(members)}
@@ -69,17 +132,4 @@ async def suggest_invites(
     )
 
     data = extract_json(raw)
-
-    suggested_invites = [
-        m for m in data.get("suggested_invites", []) if m in available
-    ]
-
-    missing_roles = data.get("missing_roles", [])
-
-    narrative = data.get("narrative", "Here are some suggestions to help your group planning.")
-
-    return {
-        "suggested_invites": suggested_invites,
-        "missing_roles": missing_roles,
-        "narrative": narrative,
-    }
+    return data if isinstance(data, dict) else {}
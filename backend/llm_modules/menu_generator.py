@@ -1,7 +1,7 @@
-import json
 from typing import List, Dict, Any
 
 from llm import chat_completion
+from llm_modules.payload import PromptPayload, TABLE_FORMAT_NOTE
 from llm_modules.llm_utils import extract_json, format_chat_history
 
 
@@ -57,18 +57,18 @@ async def generate_menu(inventory_items, grocery_items, chat_history: List[Dict[
     - Do NOT hallucinate products. Only use products present in "grocery_items" for the suggested_suppliers_needed field.
     - If a missing ingredient is simple (like "Salt" or "Water") and not in the list, just ignore it in supplier list.
     """
+    system_prompt += "\n    " + TABLE_FORMAT_NOTE
     
-    user_payload = {
-        "inventory_items": inventory_items,
-        "grocery_items": grocery_items,
-        "chat_history": chat_text
-    }
+    payload = PromptPayload("menu")
+    payload.add("inventory_items", inventory_items)
+    payload.add("chat_history", chat_text)
+    payload.add_ranked("grocery_items", grocery_items)
     
     
     raw = await chat_completion(
         [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": json.dumps(user_payload, indent=2)},
+            {"role": "user", "content": payload.build()},
         ],
         model_name=model_name,
     )
@@ -0,0 +1,149 @@
+"""
+Compact, token-budgeted user payloads for the inventory / menu / restock prompts.
+
+- Compact JSON: no indentation or spaces after separators, floats rounded.
+- Lists of records with the same keys are sent as {"columns": [...], "rows": [[...]]},
+  so the keys are written once instead of once per record (TABLE_FORMAT_NOTE
+  explains the encoding to the model).
+- Overlapping lists are deduplicated: a list can be added "minus" lists already
+  in the payload (analyze sends low_stock + healthy, not inventory_items again).
+- The ranked list (grocery_items) is trimmed to fit PROMPT_PAYLOAD_TOKEN_BUDGET,
+  taking every target's best match first, then every target's second, and so on.
+"""
+import os
+import json
+from typing import Any, Dict, Iterable, List
+
+from llm_modules.llm_utils import estimate_tokens
+
+PROMPT_PAYLOAD_TOKEN_BUDGET = int(os.getenv("PROMPT_PAYLOAD_TOKEN_BUDGET", "2500"))
+# Encode uniform record lists as columns + rows
+PROMPT_PAYLOAD_TABLES = os.getenv("PROMPT_PAYLOAD_TABLES", "1") == "1"
+
+TABLE_FORMAT_NOTE = (
+    'Lists of records may be given as {"columns": [...], "rows": [[...], ...]}; '
+    "each row holds the values of one record in column order."
+)
+
+
+def compact_json(obj: Any) -> str:
+    return json.dumps(_round_floats(obj), separators=(",", ":"), ensure_ascii=False)
+
+
+def _round_floats(obj):
+    if isinstance(obj, float):
+        return round(obj, 2)
+    if isinstance(obj, dict):
+        return {k: _round_floats(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_round_floats(v) for v in obj]
+    return obj
+
+
+def _encode(value):
+    """A list of dicts sharing the same keys becomes a columns/rows table."""
+    if (PROMPT_PAYLOAD_TABLES and isinstance(value, list) and len(value) > 1
+            and all(isinstance(v, dict) for v in value)):
+        columns = list(value[0].keys())
+        if all(list(v.keys()) == columns for v in value):
+            return {"columns": columns, "rows": [[v[c] for c in columns] for v in value]}
+    return value
+
+
+def _record_key(record) -> str:
+    return compact_json(record) if not isinstance(record, dict) else compact_json(sorted(record.items()))
+
+
+class PromptPayload:
+    """
+    Collects the fields of one prompt and renders them as a compact JSON string
+    within a token budget:
+
+        payload = PromptPayload("restock")
+        payload.add("low_stock", low_stock_items)
+        payload.add_ranked("grocery_items", grocery_items)
+        content = payload.build()
+    """
+
+    def __init__(self, name: str, budget: int = PROMPT_PAYLOAD_TOKEN_BUDGET):
+        self.name = name
+        self.budget = budget
+        self.fields: Dict[str, Any] = {}
+        self._ranked = None
+        self.tokens = 0
+        self.ranked_kept = 0
+        self.ranked_total = 0
+
+    def add(self, name: str, value, dedupe_against: Iterable[str] = ()):
+        """
+        Add a field. With dedupe_against, records already present in those
+        (previously added) lists are left out; the field is omitted if nothing remains.
+        """
+        if dedupe_against and isinstance(value, list):
+            seen = {_record_key(r) for other in dedupe_against for r in self.fields.get(other, [])}
+            value = [r for r in value if _record_key(r) not in seen]
+            if not value:
+                return self
+        if value in (None, "", [], {}):
+            return self
+        self.fields[name] = value
+        return self
+
+    def add_ranked(self, name: str, items: List[dict], score_key: str = "relevance", group_key: str = "for"):
+        """
+        Add the list that is trimmed to fit the budget. Items are ranked within
+        their `group_key` group by `score_key` (higher is better). The score is
+        not sent; the group key is, so the model can tell what each item matched.
+        """
+        self._ranked = (name, list(items), score_key, group_key)
+        return self
+
+    def _ranked_order(self):
+        name, items, score_key, group_key = self._ranked
+        groups: Dict[Any, List[dict]] = {}
+        for item in items:
+            groups.setdefault(item.get(group_key), []).append(item)
+        for group in groups.values():
+            group.sort(key=lambda item: item.get(score_key, 0.0), reverse=True)
+        # Round-robin over groups: every target's best match before any second-best
+        order = []
+        depth = 0
+        while len(order) < len(items):
+            for group in groups.values():
+                if depth < len(group):
+                    order.append(group[depth])
+            depth += 1
+        return [{k: v for k, v in item.items() if k != score_key} for item in order]
+
+    def build(self) -> str:
+        encoded = {name: _encode(value) for name, value in self.fields.items()}
+        text = compact_json(encoded)
+        if self._ranked is None:
+            self.tokens = estimate_tokens(text)
+            return text
+
+        name = self._ranked[0]
+        ranked = self._ranked_order()
+        self.ranked_total = len(ranked)
+        remaining = self.budget - estimate_tokens(text)
+        kept = []
+        for item in ranked:
+            cost = estimate_tokens(compact_json(list(item.values()))) + 1
+            if cost > remaining:
+                break
+            kept.append(item)
+            remaining -= cost
+        # The per-item estimate ignores encoding overhead; drop from the tail until it really fits
+        while True:
+            if kept:
+                encoded[name] = _encode(kept)
+            else:
+                encoded.pop(name, None)
+            text = compact_json(encoded)
+            self.tokens = estimate_tokens(text)
+            if self.tokens <= self.budget or not kept:
+                break
+            kept.pop()
+        self.ranked_kept = len(kept)
+        print(f"[payload] {self.name}: ~{self.tokens} tokens, {name} {self.ranked_kept}/{self.ranked_total} kept")
+        return text
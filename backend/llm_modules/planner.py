@@ -6,6 +6,8 @@ from llm_modules.llm_utils import (
     format_chat_history,
     extract_json,
     extract_goal,
+    run_pipeline,
+    LLM_COMBINED_PROMPTS,
 )
 
 
@@ -13,17 +15,65 @@ async def generate_group_plan(
     chat_history: List[Dict[str, str]],
     goal: str | None = None,
     members: List[str] | None = None,
-    model_name: str = "openai"
+    model_name: str = "openai",
+    combined: bool = LLM_COMBINED_PROMPTS,
 ) -> Dict[str, Any]:
     """
     Generate a structured group plan based on chat context.
+    combined=True lets the plan call infer the goal (returned as "event")
+    instead of extracting it with a separate call first.
     """
+    members = members or []
+    if goal or combined:
+        data = await _request_plan(chat_history, goal, members, model_name)
+    else:
+        steps = {
+            "goal": (lambda: extract_goal(chat_history, model_name=model_name), []),
+            "plan": (lambda goal: _request_plan(chat_history, goal, members, model_name), ["goal"]),
+        }
+        results = await run_pipeline(steps)
+        goal, data = results["goal"], results["plan"]
 
-    if not goal:
-        goal = await extract_goal(chat_history, model_name=model_name)
+    # Fallback + normalization
+    event = data.get("event", goal or "")
+    summary = data.get("summary", "Here is your group plan.")
+    items = data.get("items", [])
+    timeline = data.get("timeline", [])
+    narrative = data.get("narrative", "Here is your plan!")
 
-    members = members or []
+    # Normalize timeline
+    if not isinstance(timeline, list):
+        timeline = [str(timeline)]
+
+    # Normalize assigned_to
+    fixed_items = []
+    for item in items:
+        assigned = item.get("assigned_to", "Unassigned")
+        if assigned not in members:
+            assigned = "Unassigned"
+        fixed_items.append(
+            {
+                "name": item.get("name", ""),
+                "assigned_to": assigned
+            }
+        )
 
+    return {
+        "event": event,
+        "summary": summary,
+        "items": fixed_items,
+        "timeline": timeline,
+        "narrative": narrative
+    }
+
+
+async def _request_plan(
+    chat_history: List[Dict[str, str]],
+    goal: str | None,
+    members: List[str],
+    model_name: str,
+) -> Dict[str, Any]:
+    """The plan call; without a goal the model infers it from the chat into "event"."""
     system_prompt = """
     You are an AI assistant generating a structured group plan.
 
@@ -57,7 +107,7 @@ async def generate_group_plan(
     members_list = ", ".join(members) if members else "None"
 
     user_prompt = f"""
-    Goal: {goal}
+    Goal: {goal or '(infer from the chat history and use it as "event")'}
     Members: {members_list}
 
     Chat history:
@@ -75,35 +125,4 @@ async def generate_group_plan(
     )
 
     data = extract_json(raw)
-
-    # Fallback + normalization
-    event = data.get("event", goal or "")
-    summary = data.get("summary", "Here is your group plan.")
-    items = data.get("items", [])
-    timeline = data.get("timeline", [])
-    narrative = data.get("narrative", "Here is your plan!")
-
-    # Normalize timeline
-    if not isinstance(timeline, list):
-        timeline = [str(timeline)]
-
-    # Normalize assigned_to
-    fixed_items = []
-    for item in items:
-        assigned = item.get("assigned_to", "Unassigned")
-        if assigned not in members:
-            assigned = "Unassigned"
-        fixed_items.append(
-            {
-                "name": item.get("name", ""),
-                "assigned_to": assigned
-            }
-        )
-
-    return {
-        "event": event,
-        "summary": summary,
-        "items": fixed_items,
-        "timeline": timeline,
-        "narrative": narrative
-    }
+    return data if isinstance(data, dict) else {}
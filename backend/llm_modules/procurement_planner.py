@@ -1,7 +1,7 @@
-import json
 from typing import List, Dict, Any
 
 from llm import chat_completion
+from llm_modules.payload import PromptPayload, TABLE_FORMAT_NOTE
 from llm_modules.llm_utils import extract_json
 
 
@@ -46,17 +46,17 @@ async def generate_restock_plan(low_stock_items, grocery_items, model_name:str =
     - If no clear match is found in grocery_items, you may estimate, but note it.
     - JSON ONLY.
     """
+    system_prompt += "\n    " + TABLE_FORMAT_NOTE
     
     
-    user_payload = {
-        "low_stock": low_stock_items,
-        "grocery_items": grocery_items
-    }
+    payload = PromptPayload("restock")
+    payload.add("low_stock", low_stock_items)
+    payload.add_ranked("grocery_items", grocery_items)
     
     raw = await chat_completion(
         [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": json.dumps(user_payload, indent=2)}
+            {"role": "user", "content": payload.build()}
         ], 
         model_name=model_name,
     )
@@ -69,5 +69,6 @@ async def generate_restock_plan(low_stock_items, grocery_items, model_name:str =
         "summary": parsed.get("summary", "Generated restock plan."),
         "narrative": parsed.get("narrative", "Here is your restock summary."),
         "items": parsed.get("items", []),
-        "low_stock": parsed.get("low_stock", low_stock_items),
+        # The model may echo the columns/rows encoding; only a plain list replaces the input
+        "low_stock": parsed["low_stock"] if isinstance(parsed.get("low_stock"), list) else low_stock_items,
     }
\ No newline at end of file
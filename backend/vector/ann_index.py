@@ -0,0 +1,183 @@
+"""
+IVF (inverted file) approximate nearest-neighbour index for the grocery catalog.
+
+Offline, spherical k-means (pure numpy) splits the normalized catalog into
+`n_lists` clusters. At query time only the `nprobe` clusters whose centroids
+are closest to the query are scored exactly, so per-query cost is roughly
+nprobe / n_lists of a full scan. Larger nprobe = better recall, more latency.
+
+The index is a small .npz sidecar next to the embedding store; it holds
+centroids and a permutation of row numbers grouped by cluster, and never a
+second copy of the vectors.
+
+Usage (run from backend/):
+    python -m vector.ann_index build [--store embeddings.bin] [--lists 1024]
+"""
+import os
+import zlib
+import time
+import argparse
+
+import numpy as np
+
+from vector.shared_files import load_npz_mmap
+
+# Default number of clusters probed per query; overridable per call
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# Below this many rows exact search is cheap enough that the ANN index is skipped
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "20000"))
+
+
+def ann_path_for(store_path: str) -> str:
+    """embeddings.bin -> embeddings.ivf.npz (same directory)"""
+    return os.path.splitext(store_path)[0] + ".ivf.npz"
+
+
+def ids_fingerprint(ids: np.ndarray) -> int:
+    """Cheap fingerprint tying an index file to the exact row order it was built for."""
+    return zlib.crc32(np.ascontiguousarray(ids, dtype="<i8").tobytes())
+
+
+def default_n_lists(rows: int) -> int:
+    return max(1, min(rows, int(4 * np.sqrt(rows))))
+
+
+def kmeans(matrix: np.ndarray, n_lists: int, iters: int = 20, sample: int | None = None, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means on unit vectors (dot product = cosine).
+    Trains on a random sample (default 64 points per list) and returns
+    normalized (n_lists, dim) float32 centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n = matrix.shape[0]
+    sample = min(n, sample or 64 * n_lists)
+    train = np.asarray(matrix[np.sort(rng.choice(n, size=sample, replace=False))], dtype=np.float32)
+
+    centroids = train[rng.choice(sample, size=n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(train, centroids)
+        counts = np.bincount(assign, minlength=n_lists)
+        # Per-cluster sums via sort + reduceat (np.add.at is far slower)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        present = counts > 0
+        sums[present] = np.add.reduceat(train[order], starts[present], axis=0)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters from random training points
+            sums[empty] = train[rng.choice(sample, size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, block: int = 16384) -> np.ndarray:
+    out = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], block):
+        scores = np.asarray(matrix[start:start + block], dtype=np.float32) @ centroids.T
+        out[start:start + block] = np.argmax(scores, axis=1)
+    return out
+
+
+class IVFIndex:
+    """
+    centroids: (n_lists, dim) unit vectors
+    offsets:   (n_lists + 1,) list j owns rows order[offsets[j]:offsets[j+1]]
+    order:     (count,) catalog row numbers grouped by list
+    """
+
+    def __init__(self, centroids, offsets, order, fingerprint: int):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+        self.order = np.ascontiguousarray(order, dtype=np.int64)
+        self.fingerprint = int(fingerprint)
+
+    @property
+    def n_lists(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, ids: np.ndarray, n_lists: int | None = None, iters: int = 20, seed: int = 0):
+        n_lists = n_lists or default_n_lists(matrix.shape[0])
+        centroids = kmeans(matrix, n_lists, iters=iters, seed=seed)
+        assign = _assign(matrix, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=offsets[1:])
+        return cls(centroids, offsets, order, ids_fingerprint(ids))
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, offsets=self.offsets, order=self.order,
+                 fingerprint=np.int64(self.fingerprint))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        # Mapped rather than copied, so every worker process shares one copy of the lists
+        data = load_npz_mmap(path)
+        return cls(data["centroids"], data["offsets"], data["order"], int(data["fingerprint"]))
+
+    def matches(self, ids: np.ndarray, dim: int) -> bool:
+        return (
+            self.order.shape[0] == ids.shape[0]
+            and self.centroids.shape[1] == dim
+            and self.fingerprint == ids_fingerprint(ids)
+        )
+
+    def candidates(self, q: np.ndarray, nprobe: int) -> np.ndarray:
+        """Catalog row numbers in the nprobe lists closest to the (normalized) query."""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        centroid_scores = self.centroids @ q
+        if nprobe < self.n_lists:
+            lists = np.argpartition(centroid_scores, self.n_lists - nprobe)[self.n_lists - nprobe:]
+        else:
+            lists = np.arange(self.n_lists)
+        offsets = self.offsets
+        return np.concatenate([self.order[offsets[j]:offsets[j + 1]] for j in lists])
+
+    def search(self, matrix: np.ndarray, q: np.ndarray, top_k: int, nprobe: int = IVF_NPROBE):
+        """
+        Approximate top-k for one normalized query.
+        Returns (row_numbers, scores) best first; may hold fewer than top_k rows
+        if the probed lists are small.
+        """
+        rows = self.candidates(q, nprobe)
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        rows.sort()  # ascending gather is friendlier to the page cache for mmapped matrices
+        scores = matrix[rows] @ q
+        k = min(top_k, rows.size)
+        if k < rows.size:
+            top = np.argpartition(scores, rows.size - k)[rows.size - k:]
+        else:
+            top = np.arange(rows.size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return rows[top], scores[top]
+
+
+def main():
+    from vector.embedding_store import open_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Build the IVF index for an embedding store")
+    build.add_argument("--store", default=os.path.join(os.path.dirname(__file__), "embeddings.bin"))
+    build.add_argument("--lists", type=int, default=None, help="Number of clusters (default: 4*sqrt(rows))")
+    build.add_argument("--iters", type=int, default=20)
+    build.add_argument("--out", default=None, help="Defaults to <store>.ivf.npz")
+    args = parser.parse_args()
+
+    header, ids, matrix = open_store(args.store)
+    out = args.out or ann_path_for(args.store)
+    print(f"Building IVF index over {header.count} vectors (dim={header.dim}) ...")
+    t0 = time.perf_counter()
+    index = IVFIndex.build(matrix, ids, n_lists=args.lists, iters=args.iters)
+    index.save(out)
+    print(f"Wrote {out}: {index.n_lists} lists in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Verified download of the search artifacts (embedding store, IVF sidecar, SQLite
+fallback) from the bucket into the container's local disk.
+
+The bucket holds gzip-compressed objects plus a manifest written last:
+
+    embeddings.manifest.json
+    {
+      "version": "20250101T120000Z",
+      "files": {
+        "embeddings.bin": {"object": "embeddings.bin.gz", "encoding": "gzip",
+                           "sha256": "<of the uncompressed file>", "size": ..., "compressed_size": ...},
+        ...
+      }
+    }
+
+For each file a local copy whose sha256 matches the manifest is kept as is
+(the hash is cached in a `<file>.sha256` stamp keyed by size + mtime, so a
+restart does not re-read gigabytes). Otherwise the object is fetched in
+parallel byte ranges, decompressed and hashed in one streaming pass, and moved
+into place atomically, so a running server never maps a partial file.
+Buckets without a manifest fall back to the old behaviour: plain objects,
+downloaded only when missing.
+
+ARTIFACT_SOURCE is "gs://<bucket>" or a local directory with the same layout
+(handy for tests and offline development).
+
+Usage (run from backend/):
+    python -m vector.artifact_sync publish --src-dir vector --dest gs://groceryshopperai-embeddings
+    python -m vector.artifact_sync fetch --source ./bucket_copy --dest-dir /tmp
+"""
+import os
+import json
+import gzip
+import time
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from vector.shared_files import file_lock, lock_path_for
+
+ARTIFACT_SOURCE = os.getenv("ARTIFACT_SOURCE", "gs://groceryshopperai-embeddings").strip()
+MANIFEST_NAME = "embeddings.manifest.json"
+# Parallel ranged reads per object, and the size of each range
+DOWNLOAD_WORKERS = int(os.getenv("ARTIFACT_DOWNLOAD_WORKERS", "8"))
+RANGE_BYTES = int(os.getenv("ARTIFACT_RANGE_MB", "32")) * 1024 * 1024
+
+# Files the server can use, in order of preference for the embeddings themselves
+STORE_FILE = "embeddings.bin"
+SQLITE_FILE = "embeddings.sqlite"
+ANN_FILE = "embeddings.ivf.npz"
+ARTIFACT_FILES = (STORE_FILE, ANN_FILE, SQLITE_FILE)
+
+_HASH_BLOCK = 4 * 1024 * 1024
+
+
+class LocalDirSource:
+    """A directory laid out like the bucket."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.root, name))
+
+    def size(self, name: str) -> int:
+        return os.path.getsize(os.path.join(self.root, name))
+
+    def read_range(self, name: str, start: int, end: int) -> bytes:
+        """Bytes [start, end) of an object."""
+        with open(os.path.join(self.root, name), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def read_text(self, name: str) -> str:
+        with open(os.path.join(self.root, name), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def upload(self, local_path: str, name: str):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = os.path.join(self.root, name + ".tmp")
+        shutil.copyfile(local_path, tmp)
+        os.replace(tmp, os.path.join(self.root, name))
+
+    def __str__(self):
+        return self.root
+
+
+class GCSSource:
+    """A Google Cloud Storage bucket."""
+
+    def __init__(self, bucket_name: str):
+        from google.cloud import storage
+
+        self.bucket_name = bucket_name
+        self.bucket = storage.Client().bucket(bucket_name)
+
+    def exists(self, name: str) -> bool:
+        return self.bucket.blob(name).exists()
+
+    def size(self, name: str) -> int:
+        blob = self.bucket.get_blob(name)
+        if blob is None:
+            raise FileNotFoundError(f"gs://{self.bucket_name}/{name}")
+        return blob.size
+
+    def read_range(self, name: str, start: int, end: int) -> bytes:
+        # GCS ranges are inclusive at both ends
+        return self.bucket.blob(name).download_as_bytes(start=start, end=end - 1)
+
+    def read_text(self, name: str) -> str:
+        return self.bucket.blob(name).download_as_text()
+
+    def upload(self, local_path: str, name: str):
+        # Stored as an opaque gzip file (no Content-Encoding) so ranged reads return raw bytes
+        content_type = "application/gzip" if name.endswith(".gz") else None
+        self.bucket.blob(name).upload_from_filename(local_path, content_type=content_type)
+
+    def __str__(self):
+        return f"gs://{self.bucket_name}"
+
+
+def open_source(spec: str = ARTIFACT_SOURCE):
+    if spec.startswith("gs://"):
+        return GCSSource(spec[len("gs://"):].strip("/"))
+    return LocalDirSource(spec)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stamp_path(path: str) -> str:
+    return path + ".sha256"
+
+
+def cached_sha256(path: str) -> str:
+    """sha256 of a local file, reusing the stamp written at download time while size and mtime match."""
+    st = os.stat(path)
+    try:
+        with open(_stamp_path(path), "r", encoding="utf-8") as f:
+            stamp = json.load(f)
+        if stamp["size"] == st.st_size and stamp["mtime_ns"] == st.st_mtime_ns:
+            return stamp["sha256"]
+    except (OSError, ValueError, KeyError):
+        pass
+    digest = file_sha256(path)
+    _write_stamp(path, digest)
+    return digest
+
+
+def _write_stamp(path: str, digest: str):
+    st = os.stat(path)
+    with open(_stamp_path(path), "w", encoding="utf-8") as f:
+        json.dump({"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}, f)
+
+
+def _download_ranges(source, name: str, dest: str, workers: int = DOWNLOAD_WORKERS):
+    """Fetch an object into `dest` as parallel byte ranges written at their offsets."""
+    size = source.size(name)
+    ranges = [(start, min(start + RANGE_BYTES, size)) for start in range(0, size, RANGE_BYTES)]
+    with open(dest, "wb") as f:
+        f.truncate(size)
+    fd = os.open(dest, os.O_WRONLY)
+    try:
+        def fetch(span):
+            start, end = span
+            data = source.read_range(name, start, end)
+            if len(data) != end - start:
+                raise IOError(f"Short read for {name} [{start}, {end}): got {len(data)} bytes")
+            os.pwrite(fd, data, start)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            list(pool.map(fetch, ranges))
+    finally:
+        os.close(fd)
+    return size
+
+
+def _decompress_and_hash(src: str, dest: str, encoding: str) -> str:
+    digest = hashlib.sha256()
+    opener = gzip.open if encoding == "gzip" else open
+    with opener(src, "rb") as fin, open(dest, "wb") as fout:
+        for block in iter(lambda: fin.read(_HASH_BLOCK), b""):
+            digest.update(block)
+            fout.write(block)
+    return digest.hexdigest()
+
+
+def fetch_file(source, name: str, entry: dict, dest_path: str) -> bool:
+    """
+    Make `dest_path` hold the manifest's version of `name`.
+    Returns True if it was downloaded, False if the local copy already matched.
+    """
+    if os.path.exists(dest_path) and os.path.getsize(dest_path) == entry["size"]:
+        if cached_sha256(dest_path) == entry["sha256"]:
+            print(f"[artifact_sync] {dest_path} is up to date")
+            return False
+        print(f"[artifact_sync] {dest_path} differs from the manifest; re-downloading")
+
+    t0 = time.perf_counter()
+    part_path = dest_path + ".part"
+    tmp_path = dest_path + ".tmp"
+    try:
+        transferred = _download_ranges(source, entry["object"], part_path)
+        digest = _decompress_and_hash(part_path, tmp_path, entry.get("encoding", "identity"))
+        if digest != entry["sha256"] or os.path.getsize(tmp_path) != entry["size"]:
+            raise IOError(f"Checksum mismatch for {name}: got {digest}, manifest says {entry['sha256']}")
+        os.replace(tmp_path, dest_path)
+        _write_stamp(dest_path, digest)
+    finally:
+        for path in (part_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    elapsed = time.perf_counter() - t0
+    print(f"[artifact_sync] Downloaded {name}: {transferred / 1e6:.1f} MB transferred, "
+          f"{entry['size'] / 1e6:.1f} MB on disk, verified, {elapsed:.1f}s")
+    return True
+
+
+def _legacy_fetch(source, dest_dir: str):
+    """Buckets without a manifest: plain objects, fetched only if missing locally."""
+    print(f"[artifact_sync] No {MANIFEST_NAME} in {source}; files are not verified")
+    for name in (STORE_FILE, SQLITE_FILE):
+        path = os.path.join(dest_dir, name)
+        if os.path.exists(path):
+            print(f"[artifact_sync] Found existing embeddings at {path}")
+            break
+        if source.exists(name):
+            _download_ranges(source, name, path + ".part")
+            os.replace(path + ".part", path)
+            print(f"[artifact_sync] Download complete: {path}")
+            break
+        print(f"[artifact_sync] {name} not found in {source}")
+    ann_path = os.path.join(dest_dir, ANN_FILE)
+    if not os.path.exists(ann_path) and source.exists(ANN_FILE):
+        _download_ranges(source, ANN_FILE, ann_path + ".part")
+        os.replace(ann_path + ".part", ann_path)
+
+
+def sync_artifacts(dest_dir: str, source_spec: str = ARTIFACT_SOURCE) -> dict:
+    """
+    Bring dest_dir in line with the bucket manifest (blocking; run it in a thread).
+    The SQLite fallback is only fetched when the manifest has no binary store.
+    Returns {"version": ..., "downloaded": [...], "unchanged": [...]}.
+    """
+    source = open_source(source_spec)
+    # Worker processes start together; the first one downloads, the rest then
+    # find every file unchanged
+    with file_lock(lock_path_for(os.path.join(dest_dir, MANIFEST_NAME))):
+        return _sync_locked(source, dest_dir)
+
+
+def _sync_locked(source, dest_dir: str) -> dict:
+    if not source.exists(MANIFEST_NAME):
+        _legacy_fetch(source, dest_dir)
+        return {"version": None, "downloaded": [], "unchanged": []}
+
+    manifest = json.loads(source.read_text(MANIFEST_NAME))
+    files = manifest.get("files", {})
+    wanted = [name for name in ARTIFACT_FILES if name in files]
+    if STORE_FILE in files and SQLITE_FILE in wanted:
+        wanted.remove(SQLITE_FILE)
+
+    result = {"version": manifest.get("version"), "downloaded": [], "unchanged": []}
+    for name in wanted:
+        changed = fetch_file(source, name, files[name], os.path.join(dest_dir, name))
+        result["downloaded" if changed else "unchanged"].append(name)
+    print(f"[artifact_sync] Artifacts at manifest version {result['version']}: "
+          f"{len(result['downloaded'])} downloaded, {len(result['unchanged'])} unchanged")
+    return result
+
+
+def publish_artifacts(src_dir: str, dest_spec: str, version: str | None = None) -> dict:
+    """Compress, hash and upload every artifact present in src_dir, then the manifest."""
+    dest = open_source(dest_spec)
+    version = version or time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    files = {}
+    for name in ARTIFACT_FILES:
+        path = os.path.join(src_dir, name)
+        if not os.path.exists(path):
+            continue
+        gz_path = path + ".gz"
+        with open(path, "rb") as fin, gzip.open(gz_path, "wb", compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, _HASH_BLOCK)
+        files[name] = {
+            "object": name + ".gz",
+            "encoding": "gzip",
+            "sha256": file_sha256(path),
+            "size": os.path.getsize(path),
+            "compressed_size": os.path.getsize(gz_path),
+        }
+        print(f"[artifact_sync] Uploading {name} ({files[name]['size'] / 1e6:.1f} MB -> "
+              f"{files[name]['compressed_size'] / 1e6:.1f} MB gzip)")
+        dest.upload(gz_path, name + ".gz")
+        os.remove(gz_path)
+
+    manifest = {"version": version, "files": files}
+    manifest_path = os.path.join(src_dir, MANIFEST_NAME)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    # Last, so readers never see a manifest that points at objects not yet uploaded
+    dest.upload(manifest_path, MANIFEST_NAME)
+    print(f"[artifact_sync] Published manifest version {version} to {dest}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    publish = sub.add_parser("publish", help="Upload compressed artifacts and a manifest")
+    publish.add_argument("--src-dir", default=os.path.dirname(__file__))
+    publish.add_argument("--dest", default=ARTIFACT_SOURCE, help="gs://bucket or a directory")
+    publish.add_argument("--version", default=None)
+
+    fetch = sub.add_parser("fetch", help="Download and verify artifacts")
+    fetch.add_argument("--source", default=ARTIFACT_SOURCE, help="gs://bucket or a directory")
+    fetch.add_argument("--dest-dir", default="/tmp")
+
+    args = parser.parse_args()
+    if args.command == "publish":
+        publish_artifacts(args.src_dir, args.dest, args.version)
+    else:
+        sync_artifacts(args.dest_dir, args.source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,560 @@
+"""
+Vector search benchmarks on synthetic catalogs.
+
+Usage (run from backend/):
+    python -m vector.benchmark topk [--rows 10000 100000 1000000] [--dim 256]
+    python -m vector.benchmark ann  [--rows 200000] [--nprobe 1 4 16 64]
+    python -m vector.benchmark quant [--rows 200000] [--kinds int8 float16]
+    python -m vector.benchmark dims [--rows 50000] [--dims 256 512 1024] [--store embeddings.bin]
+    python -m vector.benchmark looplag [--rows 200000] [--concurrency 8] [--threads 0 4]
+    python -m vector.benchmark suite [--rows 10000 100000] [--dims 256] [--json results.json] [--baseline old.json]
+
+No OpenAI key or embeddings.sqlite is needed. Catalogs are clustered random
+unit vectors (real product embeddings cluster by category, which is what IVF
+exploits; uniformly random vectors would be a pessimistic worst case).
+A full 3072-dim catalog at 1M rows needs ~12 GB of RAM; latency scales linearly
+with dim, so the defaults benchmark a narrower matrix.
+
+topk: exact matrix+argpartition latency; the legacy per-item Python loop is
+      timed too (up to --legacy-max-rows) for comparison.
+ann:  IVF recall@k and latency against the exact engine for several nprobe values.
+quant: memory saved and recall@k lost by int8/float16 first-pass scoring, with
+      and without the exact float32 re-rank.
+dims: match quality (recall@k vs the full-width ranking), latency and memory of
+      truncated + re-normalized vectors. Synthetic vectors get a decaying
+      per-dimension spectrum to mimic text-embedding-3's Matryoshka training;
+      pass --store to measure a real catalog (queries are perturbed catalog rows).
+looplag: event-loop responsiveness while concurrent searches run, with scoring
+      inline on the loop (--threads 0) and on the scoring pool: a 1 ms ticker
+      measures how late the loop wakes up (what WebSocket broadcasts feel).
+suite: the serving pipeline end to end on synthetic catalogs (titles +
+      sub-categories embedded with the local provider, so no network): store
+      load time, resident memory, p50/p95/p99 latency of search_many (vector and
+      hybrid) and of get_relevant_grocery_items_many, batch throughput, and
+      recall@k of the configured engine (IVF / quantized) against the exact scan.
+      --json writes machine-readable results; --baseline compares against a
+      previous run and exits non-zero on a regression beyond --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+
+import numpy as np
+
+from vector.vector_cache import EmbeddingIndex
+from vector.vector_search import top_k_similar, top_k_similar_many
+from vector.ann_index import IVFIndex
+from vector.quantization import QuantizedMatrix
+from vector.embedding_store import open_store, truncate_rows, write_store
+
+
+def make_catalog(rows: int, dim: int, seed: int = 0, clusters: int = 0) -> EmbeddingIndex:
+    """
+    Random unit-vector catalog, generated in chunks to keep peak memory near the
+    final matrix size. With clusters > 0, rows are noisy copies of that many centers.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32) if clusters else None
+    matrix = np.empty((rows, dim), dtype=np.float32)
+    chunk = 50_000
+    for start in range(0, rows, chunk):
+        stop = min(start + chunk, rows)
+        block = rng.standard_normal((stop - start, dim), dtype=np.float32)
+        if centers is not None:
+            block *= 0.6
+            block += centers[rng.integers(0, clusters, size=stop - start)]
+        matrix[start:stop] = block
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= norms
+    return EmbeddingIndex(np.arange(1, rows + 1, dtype=np.int64), matrix, normalized=True)
+
+
+def make_queries(count: int, dim: int, seed: int = 1, catalog: EmbeddingIndex | None = None) -> np.ndarray:
+    """Random queries, or perturbed catalog rows (realistic: queries land near products)."""
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((count, dim), dtype=np.float32)
+    if catalog is None:
+        return noise
+    rows = rng.integers(0, len(catalog), size=count)
+    return np.asarray(catalog.matrix[rows]) + 0.05 * noise
+
+
+def legacy_search(index: EmbeddingIndex, q_emb: np.ndarray, top_k: int):
+    """The previous implementation: per-item cosine in Python plus a full sort."""
+    scored = []
+    for gid, vector in zip(index.ids, index.matrix):
+        na, nb = np.linalg.norm(q_emb), np.linalg.norm(vector)
+        score = 0.0 if na == 0 or nb == 0 else float(np.dot(q_emb, vector) / (na * nb))
+        scored.append((gid, score))
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return scored[:top_k]
+
+
+def time_queries(fn, queries) -> np.ndarray:
+    latencies = np.empty(len(queries))
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        fn(q)
+        latencies[i] = time.perf_counter() - t0
+    return latencies * 1000.0
+
+
+def fmt_ms(latencies_ms: np.ndarray) -> str:
+    return f"p50={np.percentile(latencies_ms, 50):8.3f} ms  p95={np.percentile(latencies_ms, 95):8.3f} ms"
+
+
+def recall_at_k(approx, exact) -> float:
+    """Mean fraction of the exact top-k ids that the approximate result also returned."""
+    hits = total = 0
+    for a, e in zip(approx, exact):
+        truth = {gid for gid, _ in e}
+        hits += len(truth & {gid for gid, _ in a})
+        total += len(truth)
+    return hits / total if total else 1.0
+
+
+def bench_topk(args):
+    queries = make_queries(args.queries, args.dim)
+    print(f"dim={args.dim} top_k={args.top_k} queries={args.queries}")
+
+    for rows in args.rows:
+        index = make_catalog(rows, args.dim)
+        top_k_similar(index, queries[0], args.top_k)  # warm-up
+
+        lat = time_queries(lambda q: top_k_similar(index, q, args.top_k), queries)
+        print(f"rows={rows:>9,}  matrix+argpartition  {fmt_ms(lat)}")
+
+        if rows <= args.legacy_max_rows:
+            legacy_queries = queries[: max(1, min(len(queries), 5))]
+            lat = time_queries(lambda q: legacy_search(index, q, args.top_k), legacy_queries)
+            print(f"rows={rows:>9,}  legacy python loop   {fmt_ms(lat)}")
+
+        del index
+
+
+def bench_ann(args):
+    print(f"dim={args.dim} top_k={args.top_k} queries={args.queries}")
+    for rows in args.rows:
+        index = make_catalog(rows, args.dim, clusters=args.clusters)
+        queries = make_queries(args.queries, args.dim, catalog=index)
+
+        t0 = time.perf_counter()
+        ann = IVFIndex.build(index.matrix, index.ids, n_lists=args.lists)
+        print(f"rows={rows:>9,}  IVF build: {ann.n_lists} lists in {time.perf_counter() - t0:.1f}s")
+
+        exact = top_k_similar_many(index, queries, args.top_k, exact=True)
+        lat = time_queries(lambda q: top_k_similar(index, q, args.top_k, exact=True), queries)
+        print(f"rows={rows:>9,}  exact               recall@{args.top_k}=1.000  {fmt_ms(lat)}")
+
+        index.ann = ann
+        for nprobe in args.nprobe:
+            approx = [top_k_similar(index, q, args.top_k, nprobe=nprobe) for q in queries]
+            lat = time_queries(lambda q: top_k_similar(index, q, args.top_k, nprobe=nprobe), queries)
+            print(f"rows={rows:>9,}  ivf nprobe={nprobe:<5}  recall@{args.top_k}={recall_at_k(approx, exact):.3f}  {fmt_ms(lat)}")
+
+        del index, ann
+
+
+def bench_quant(args):
+    print(f"dim={args.dim} top_k={args.top_k} queries={args.queries}")
+    for rows in args.rows:
+        index = make_catalog(rows, args.dim, clusters=args.clusters)
+        queries = make_queries(args.queries, args.dim, catalog=index)
+        exact = top_k_similar_many(index, queries, args.top_k, exact=True)
+        lat = time_queries(lambda q: top_k_similar(index, q, args.top_k, exact=True), queries)
+        full = index.matrix.nbytes
+        print(f"rows={rows:>9,}  float32   {full / 1e6:8.1f} MB            recall@{args.top_k}=1.000  {fmt_ms(lat)}")
+
+        for kind in args.kinds:
+            index.quantized = QuantizedMatrix.build(index.matrix, index.ids, kind)
+            saved = 100 * (1 - index.quantized.nbytes / full)
+
+            # Compact scores only, no re-rank: shows the raw quantization error
+            approx_scores = index.quantized.scores(queries)
+            no_rerank = [
+                [(int(index.ids[i]), 0.0) for i in np.argsort(-row)[:args.top_k]] for row in approx_scores
+            ]
+            reranked = top_k_similar_many(index, queries, args.top_k)
+            lat = time_queries(lambda q: top_k_similar(index, q, args.top_k), queries)
+            print(f"rows={rows:>9,}  {kind:<8}  {index.quantized.nbytes / 1e6:8.1f} MB ({saved:3.0f}% saved)  "
+                  f"recall@{args.top_k}={recall_at_k(no_rerank, exact):.3f} raw / "
+                  f"{recall_at_k(reranked, exact):.3f} re-ranked  {fmt_ms(lat)}")
+        del index
+
+
+def bench_dims(args):
+    if args.store:
+        _, ids, matrix = open_store(args.store)
+        index = EmbeddingIndex(ids, matrix, normalized=True)
+    else:
+        full_dim = 3072
+        index = make_catalog(args.rows[0], full_dim, clusters=args.clusters)
+        # Leading components carry most of the signal, as in Matryoshka-trained embeddings
+        index.matrix *= (1.0 + np.arange(full_dim, dtype=np.float32) / 64.0) ** -1
+        index.matrix /= np.linalg.norm(index.matrix, axis=1, keepdims=True)
+    queries = make_queries(args.queries, index.dim, catalog=index)
+    print(f"rows={len(index):,} full_dim={index.dim} top_k={args.top_k} queries={args.queries}")
+
+    exact = top_k_similar_many(index, queries, args.top_k, exact=True)
+    lat = time_queries(lambda q: top_k_similar(index, q, args.top_k, exact=True), queries)
+    print(f"dims={index.dim:>5}  {4 * len(index) * index.dim / 1e6:8.1f} MB  recall@{args.top_k}=1.000  {fmt_ms(lat)}")
+
+    for dims in args.dims:
+        if dims >= index.dim:
+            continue
+        small = EmbeddingIndex(index.ids, truncate_rows(np.asarray(index.matrix), dims), normalized=True)
+        small_queries = truncate_rows(queries, dims)
+        approx = top_k_similar_many(small, small_queries, args.top_k, exact=True)
+        lat = time_queries(lambda q: top_k_similar(small, q, args.top_k, exact=True), small_queries)
+        print(f"dims={dims:>5}  {small.matrix.nbytes / 1e6:8.1f} MB  "
+              f"recall@{args.top_k}={recall_at_k(approx, exact):.3f}  {fmt_ms(lat)}")
+        del small
+
+
+_ADJECTIVES = ["organic", "fresh", "frozen", "whole", "low-fat", "gluten-free", "smoked", "roasted",
+               "sweet", "spicy", "unsalted", "wild", "baby", "large", "mini", "classic"]
+_NOUNS = ["apples", "bananas", "milk", "yogurt", "cheddar", "bread", "bagels", "chicken", "salmon",
+          "rice", "pasta", "beans", "coffee", "tea", "almonds", "spinach", "tomatoes", "eggs", "butter",
+          "granola", "tortillas", "honey", "olive oil", "peanut butter", "ice cream", "chips", "salsa"]
+_BRANDS = ["Acme", "Green Valley", "Sunrise", "Harbor", "Maple Farms", "Blue Ridge", "Golden Field", "Northstar"]
+_SUB_CATEGORIES = ["Produce", "Dairy", "Bakery", "Meat & Seafood", "Pantry", "Beverages", "Snacks",
+                   "Frozen", "Breakfast", "Deli"]
+
+
+def make_text_catalog(rows: int, seed: int = 0):
+    """Synthetic (ids, titles, sub_categories, prices, ratings) shaped like grocery_items."""
+    rng = np.random.default_rng(seed)
+    adj = rng.integers(0, len(_ADJECTIVES), rows)
+    noun = rng.integers(0, len(_NOUNS), rows)
+    brand = rng.integers(0, len(_BRANDS), rows)
+    size = rng.integers(1, 64, rows)
+    titles = [
+        f"{_BRANDS[b]} {_ADJECTIVES[a]} {_NOUNS[n]} {s} oz"
+        for a, n, b, s in zip(adj.tolist(), noun.tolist(), brand.tolist(), size.tolist())
+    ]
+    sub_categories = [_SUB_CATEGORIES[n % len(_SUB_CATEGORIES)] for n in noun.tolist()]
+    prices = np.round(rng.uniform(0.5, 40.0, rows), 2)
+    ratings = np.where(rng.random(rows) < 0.1, np.nan, np.round(rng.uniform(1.0, 5.0, rows), 1))
+    return np.arange(1, rows + 1, dtype=np.int64), titles, sub_categories, prices, ratings
+
+
+def make_text_queries(titles, count: int, seed: int = 1):
+    """Shopping-list style queries: catalog titles with the brand and size dropped."""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(titles), count)
+    queries = []
+    for i in picks.tolist():
+        words = titles[i].split()
+        queries.append(" ".join(w for w in words[1:-2] if w not in _BRANDS))
+    return queries
+
+
+def rss_mb() -> float:
+    """Current resident set size (Linux /proc), else the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def percentiles(latencies_ms) -> dict:
+    lat = np.asarray(latencies_ms)
+    return {f"p{p}_ms": round(float(np.percentile(lat, p)), 4) for p in (50, 95, 99)}
+
+
+async def _time_async(fn, items) -> np.ndarray:
+    latencies = np.empty(len(items))
+    for i, item in enumerate(items):
+        t0 = time.perf_counter()
+        await fn(item)
+        latencies[i] = time.perf_counter() - t0
+    return latencies * 1000.0
+
+
+async def _suite_case(rows: int, dim: int, args, workdir: str) -> dict:
+    from vector import vector_cache
+    from vector.catalog_columns import CatalogColumns
+    from vector.lexical_index import LexicalIndex
+    from vector.embedding_provider import HashingEmbeddingProvider, set_embedding_provider
+    from vector.vector_search import search_many
+    from vector.recommend_utils import get_relevant_grocery_items_many
+    from vector.ann_index import ANN_MIN_ROWS, ann_path_for
+    from types import SimpleNamespace
+
+    provider = HashingEmbeddingProvider(dim=dim)
+    set_embedding_provider(provider)
+    result = {"rows": rows, "dim": dim, "top_k": args.top_k, "provider": provider.model_name}
+
+    # Build the artifacts the server would download
+    ids, titles, sub_categories, prices, ratings = make_text_catalog(rows)
+    t0 = time.perf_counter()
+    matrix = np.concatenate([
+        provider.embed_sync([f"{t} | {c}" for t, c in zip(titles[i:i + 20000], sub_categories[i:i + 20000])])
+        for i in range(0, rows, 20000)
+    ])
+    result["embed_catalog_s"] = round(time.perf_counter() - t0, 3)
+    store_path = os.path.join(workdir, f"bench-{rows}-{dim}.bin")
+    write_store(store_path, ids, matrix, model=provider.model_name)
+    del matrix
+    if rows >= ANN_MIN_ROWS:
+        _, store_ids, store_matrix = open_store(store_path)
+        t0 = time.perf_counter()
+        IVFIndex.build(store_matrix, store_ids).save(ann_path_for(store_path))
+        result["ivf_build_s"] = round(time.perf_counter() - t0, 3)
+        del store_ids, store_matrix
+
+    # Startup: map the store the way the server does, then page it in with a first query
+    rss_before = rss_mb()
+    vector_cache.EMBED_STORE_PATH = store_path
+    t0 = time.perf_counter()
+    index = vector_cache.build_index()
+    result["load_s"] = round(time.perf_counter() - t0, 4)
+    catalog_rows = [
+        SimpleNamespace(id=int(i), title=t, sub_category=c, price=float(p),
+                        rating_value=None if np.isnan(r) else float(r), rating_count=10)
+        for i, t, c, p, r in zip(ids.tolist(), titles, sub_categories, prices.tolist(), ratings.tolist())
+    ]
+    index.columns = CatalogColumns.build(index.ids, catalog_rows)
+    index.lexical = LexicalIndex.build(ids, titles, sub_categories)
+    vector_cache.swap_index(index)
+    del catalog_rows
+    result["load_with_metadata_s"] = round(time.perf_counter() - t0, 4)
+
+    queries = make_text_queries(titles, args.queries)
+    t0 = time.perf_counter()
+    await search_many(queries[:1], args.top_k, mode="vector", exact=True, index=index)
+    result["first_query_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
+    result["rss_mb"] = round(rss_mb(), 1)
+    result["rss_delta_mb"] = round(rss_mb() - rss_before, 1)
+
+    for mode in ("vector", "hybrid"):
+        lat = await _time_async(lambda q: search_many([q], args.top_k, mode=mode, index=index), queries)
+        result[f"search_{mode}"] = percentiles(lat)
+
+    names_per_command = 10
+    commands = [queries[i:i + names_per_command] for i in range(0, len(queries), names_per_command)]
+    lat = await _time_async(lambda names: get_relevant_grocery_items_many(None, names, limit=5), commands)
+    result["relevant_items_per_command"] = {"names": names_per_command, **percentiles(lat)}
+
+    batch = (queries * (args.batch // max(len(queries), 1) + 1))[:args.batch]
+    t0 = time.perf_counter()
+    await search_many(batch, args.top_k, mode="vector", index=index)
+    result["batch_throughput_qps"] = round(len(batch) / (time.perf_counter() - t0), 1)
+
+    # Recall of the configured engine (IVF and/or quantized first pass) vs the exact scan
+    q_embs = provider.embed_sync(queries)
+    exact = top_k_similar_many(index, q_embs, args.top_k, exact=True)
+    approx = top_k_similar_many(index, q_embs, args.top_k)
+    result["engine"] = {
+        "ann_lists": index.ann.n_lists if index.ann is not None else None,
+        "quantization": index.quantized.kind if index.quantized is not None else None,
+    }
+    result["recall_at_k"] = round(recall_at_k(approx, exact), 4)
+
+    if rows <= args.sqlite_max_rows:
+        result["legacy_sqlite_load_s"] = _time_sqlite_load(index, workdir)
+
+    del index, exact, approx
+    return result
+
+
+def _time_sqlite_load(index: EmbeddingIndex, workdir: str) -> float:
+    """Load time of the JSON-TEXT SQLite format the store replaced, for comparison."""
+    import sqlite3
+    from vector import vector_cache
+
+    path = os.path.join(workdir, "bench.sqlite")
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE grocery_item_embeddings (grocery_item_id INTEGER PRIMARY KEY, embedding TEXT NOT NULL)")
+    conn.executemany(
+        "INSERT INTO grocery_item_embeddings VALUES (?, ?)",
+        ((int(gid), json.dumps(vec.tolist())) for gid, vec in zip(index.ids, np.asarray(index.matrix))),
+    )
+    conn.commit()
+    conn.close()
+    t0 = time.perf_counter()
+    vector_cache._load_from_sqlite(path)
+    elapsed = round(time.perf_counter() - t0, 3)
+    os.remove(path)
+    return elapsed
+
+
+def _print_case(r: dict):
+    print(f"rows={r['rows']:,} dim={r['dim']}  load={r['load_s'] * 1000:.1f} ms "
+          f"(+metadata {r['load_with_metadata_s'] * 1000:.0f} ms)  first query={r['first_query_ms']:.1f} ms  "
+          f"rss={r['rss_mb']:.0f} MB (+{r['rss_delta_mb']:.0f})")
+    for key in ("search_vector", "search_hybrid", "relevant_items_per_command"):
+        p = r[key]
+        print(f"    {key:<28} p50={p['p50_ms']:8.3f}  p95={p['p95_ms']:8.3f}  p99={p['p99_ms']:8.3f} ms")
+    print(f"    batch throughput {r['batch_throughput_qps']:,.0f} q/s   recall@{r['top_k']}={r['recall_at_k']:.3f} "
+          f"(ann_lists={r['engine']['ann_lists']}, quantization={r['engine']['quantization']})")
+    if "legacy_sqlite_load_s" in r:
+        print(f"    legacy JSON SQLite load {r['legacy_sqlite_load_s']:.2f} s")
+
+
+def compare_to_baseline(results, baseline, tolerance: float, min_delta_ms: float = 0.5):
+    """
+    Regressions of p95 latency, load time and recall vs a previous run. A latency
+    counts only if it is both `tolerance` slower and `min_delta_ms` slower, so
+    sub-millisecond jitter does not fail the run.
+    """
+    previous = {(r["rows"], r["dim"]): r for r in baseline.get("results", [])}
+    problems = []
+    for r in results:
+        old = previous.get((r["rows"], r["dim"]))
+        if old is None:
+            continue
+        label = f"rows={r['rows']} dim={r['dim']}"
+        for key in ("search_vector", "search_hybrid", "relevant_items_per_command"):
+            new_p95, old_p95 = r[key]["p95_ms"], old[key]["p95_ms"]
+            if new_p95 > old_p95 * (1 + tolerance) and new_p95 - old_p95 > min_delta_ms:
+                problems.append(f"{label} {key} p95 {old_p95:.3f} -> {new_p95:.3f} ms")
+        if r["load_s"] > old["load_s"] * (1 + tolerance) and r["load_s"] - old["load_s"] > 0.01:
+            problems.append(f"{label} load {old['load_s']:.3f} -> {r['load_s']:.3f} s")
+        if r["recall_at_k"] < old["recall_at_k"] - 0.01:
+            problems.append(f"{label} recall@k {old['recall_at_k']:.3f} -> {r['recall_at_k']:.3f}")
+    return problems
+
+
+def bench_suite(args):
+    results = []
+
+    async def run():
+        with tempfile.TemporaryDirectory() as workdir:
+            for dim in args.dims:
+                for rows in args.rows:
+                    results.append(await _suite_case(rows, dim, args, workdir))
+                    _print_case(results[-1])
+
+    asyncio.run(run())
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "queries": args.queries,
+            "batch": args.batch,
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare_to_baseline(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+def bench_looplag(args):
+    from vector.embedding_provider import HashingEmbeddingProvider, set_embedding_provider
+    from vector.vector_search import search_many
+    from vector.scoring_pool import ScoringPool, set_scoring_pool
+
+    set_embedding_provider(HashingEmbeddingProvider(dim=args.dim))
+    index = make_catalog(args.rows[0], args.dim, clusters=args.clusters)
+    queries = [f"query {i}" for i in range(args.queries)]
+    print(f"rows={len(index):,} dim={args.dim} concurrency={args.concurrency} queries={args.queries} (exact scan)")
+
+    async def ticker(stop, lags):
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append((time.perf_counter() - t0 - 0.001) * 1000.0)
+
+    async def worker(todo):
+        while todo:
+            q = todo.pop()
+            await search_many([q], args.top_k, mode="vector", exact=True, index=index)
+
+    async def run():
+        stop, lags = asyncio.Event(), []
+        tick = asyncio.create_task(ticker(stop, lags))
+        todo = list(queries)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(todo) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        await tick
+        return np.asarray(lags), elapsed
+
+    for threads in args.threads:
+        set_scoring_pool(ScoringPool(threads=threads))
+        lags, elapsed = asyncio.run(run())
+        label = "inline" if threads == 0 else f"{threads} threads"
+        print(f"{label:<11} loop lag p50={np.percentile(lags, 50):7.2f} ms  p99={np.percentile(lags, 99):7.2f} ms  "
+              f"max={lags.max():7.2f} ms   {len(queries) / elapsed:8.1f} q/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    topk = sub.add_parser("topk", help="Exact engine latency vs catalog size")
+    topk.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    topk.add_argument("--legacy-max-rows", type=int, default=100_000)
+
+    ann = sub.add_parser("ann", help="IVF recall@k vs latency against exact search")
+    ann.add_argument("--rows", type=int, nargs="+", default=[200_000])
+    ann.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    ann.add_argument("--lists", type=int, default=None)
+    ann.add_argument("--clusters", type=int, default=500)
+
+    quant = sub.add_parser("quant", help="Quantized first pass: memory saved vs recall lost")
+    quant.add_argument("--rows", type=int, nargs="+", default=[200_000])
+    quant.add_argument("--kinds", nargs="+", choices=["int8", "float16"], default=["int8", "float16"])
+    quant.add_argument("--clusters", type=int, default=500)
+
+    dims = sub.add_parser("dims", help="Truncated embedding width: quality vs cost")
+    dims.add_argument("--rows", type=int, nargs=1, default=[50_000])
+    dims.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024])
+    dims.add_argument("--clusters", type=int, default=500)
+    dims.add_argument("--store", default=None, help="Benchmark a real embedding store instead of synthetic data")
+
+    looplag = sub.add_parser("looplag", help="Event-loop lag under concurrent searches, inline vs scoring pool")
+    looplag.add_argument("--rows", type=int, nargs=1, default=[200_000])
+    looplag.add_argument("--concurrency", type=int, default=8)
+    looplag.add_argument("--threads", type=int, nargs="+", default=[0, 4])
+    looplag.add_argument("--clusters", type=int, default=0)
+
+    suite = sub.add_parser("suite", help="End-to-end serving benchmarks with JSON output")
+    suite.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    suite.add_argument("--dims", type=int, nargs="+", default=[256])
+    suite.add_argument("--batch", type=int, default=256, help="Queries per search_many call for throughput")
+    suite.add_argument("--sqlite-max-rows", type=int, default=20_000,
+                       help="Also time the legacy JSON SQLite load up to this many rows")
+    suite.add_argument("--json", default=None, help="Write results to this file")
+    suite.add_argument("--baseline", default=None, help="Previous --json output to compare against")
+    suite.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before failing")
+    suite.add_argument("--min-delta-ms", type=float, default=0.5, help="Ignore latency changes smaller than this")
+
+    for p in (topk, ann, quant, dims, looplag, suite):
+        p.add_argument("--dim", type=int, default=256)
+        p.add_argument("--top-k", type=int, default=10)
+        p.add_argument("--queries", type=int, default=50)
+
+    args = parser.parse_args()
+    {"topk": bench_topk, "ann": bench_ann, "quant": bench_quant, "dims": bench_dims,
+     "looplag": bench_looplag, "suite": bench_suite}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
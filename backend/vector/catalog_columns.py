@@ -0,0 +1,237 @@
+"""
+Catalog attributes as numpy columns aligned row-for-row with the embedding matrix.
+
+price, rating_value, rating_count and a sub_category code live next to the
+vectors, so price caps, minimum ratings, sub-category sets and rating-weighted
+ranking are applied as vectorized masks/weights before top-k selection rather
+than by fetching extra rows and trimming them in Python.
+
+The columns (plus titles) also serve as the read-only catalog cache: search
+results are hydrated into CatalogItem records straight from them, with no
+database query. They are built with each index snapshot, so ids and attributes
+always describe the same catalog version as the vectors.
+"""
+import re
+import time
+from dataclasses import dataclass, replace
+
+import numpy as np
+from sqlalchemy import select
+
+from db import GroceryItem
+
+# Multiplier exponent used when a request asks for "best-rated" items
+BEST_RATED_WEIGHT = 1.0
+# Score multiplier for sub-categories a request only mentions (e.g. "meat lovers")
+SUB_CATEGORY_BOOST = 1.2
+
+_PRICE_CAP_RE = re.compile(r"(?:under|below|less than|cheaper than|<=?)\s*\$\s*(\d+(?:\.\d+)?)|(?:under|below)\s*(\d+(?:\.\d+)?)\s*(?:dollars|usd)")
+_MIN_STARS_RE = re.compile(r"(\d(?:\.\d+)?)\s*\+?\s*stars?")
+_BEST_RATED_RE = re.compile(r"\b(?:best|top|highest)[- ]rated\b")
+# Prefix of a sub-category name that makes it a filter: "in produce", "category: produce"
+_EXPLICIT_CATEGORY_RE = r"(?:\bin|\bfrom|\bcategory\s*:?)\s*(?:the\s+)?"
+
+
+@dataclass(slots=True)
+class CatalogItem:
+    """Read-only grocery item with the GroceryItem attributes the search callers use."""
+    id: int
+    title: str
+    sub_category: str
+    price: float | None
+    rating_value: float | None
+    rating_count: int | None
+
+
+@dataclass
+class SearchFilters:
+    max_price: float | None = None
+    min_rating: float | None = None
+    min_rating_count: int | None = None
+    sub_categories: frozenset | None = None  # sub_category names
+    boost_sub_categories: frozenset | None = None  # ranked higher, not filtered
+
+    def is_empty(self) -> bool:
+        return (
+            self.max_price is None
+            and self.min_rating is None
+            and self.min_rating_count is None
+            and not self.sub_categories
+            and not self.boost_sub_categories
+        )
+
+
+class CatalogColumns:
+    def __init__(self, ids, price, rating_value, rating_count, sub_category_code, sub_category_names, titles=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.titles = titles                        # list of str, None = row unknown
+        self.price = price                          # float64, NaN = unknown
+        self.rating_value = rating_value            # float64, NaN = unrated
+        self.rating_count = rating_count            # int32, 0 = unrated
+        self.sub_category_code = sub_category_code  # int32, -1 = unknown
+        self.sub_category_names = sub_category_names
+        self._code_of = {name: code for code, name in enumerate(sub_category_names)}
+        # id -> row lookup for ids coming from outside the matrix (e.g. lexical hits)
+        self._sort = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._sort]
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    @classmethod
+    def build(cls, index_ids, rows):
+        """
+        rows: iterable with .id, .title, .sub_category, .price, .rating_value, .rating_count.
+        Columns follow `index_ids` order; ids missing from `rows` get unknown values.
+        """
+        index_ids = np.asarray(index_ids, dtype=np.int64)
+        n = index_ids.shape[0]
+        titles = [None] * n
+        # float64 so cached prices / ratings round-trip the database values exactly
+        price = np.full(n, np.nan, dtype=np.float64)
+        rating_value = np.full(n, np.nan, dtype=np.float64)
+        rating_count = np.zeros(n, dtype=np.int32)
+        sub_category_code = np.full(n, -1, dtype=np.int32)
+
+        rows = list(rows)
+        names = sorted({r.sub_category for r in rows if r.sub_category})
+        code_of = {name: code for code, name in enumerate(names)}
+
+        order = np.argsort(index_ids, kind="stable")
+        sorted_ids = index_ids[order]
+        for r in rows:
+            pos = np.searchsorted(sorted_ids, r.id)
+            if pos >= n or sorted_ids[pos] != r.id:
+                continue
+            i = order[pos]
+            titles[i] = r.title
+            if r.price is not None:
+                price[i] = float(r.price)
+            if r.rating_value is not None:
+                rating_value[i] = r.rating_value
+            rating_count[i] = r.rating_count or 0
+            sub_category_code[i] = code_of.get(r.sub_category, -1)
+        return cls(index_ids, price, rating_value, rating_count, sub_category_code, names, titles)
+
+    def rows_of(self, gids) -> np.ndarray:
+        """Matrix row per grocery item id (-1 if unknown)."""
+        gids = np.asarray(gids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(gids.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_ids, gids), len(self) - 1)
+        return np.where(self._sorted_ids[pos] == gids, self._sort[pos], -1)
+
+    def items(self, gids) -> dict:
+        """{id: CatalogItem} for the ids this catalog knows; unknown ids are left out."""
+        gids = list(gids)
+        found = {}
+        if not gids or self.titles is None:
+            return found
+        for gid, row in zip(gids, self.rows_of(gids).tolist()):
+            if row < 0 or self.titles[row] is None:
+                continue
+            code = int(self.sub_category_code[row])
+            price = float(self.price[row])
+            rating = float(self.rating_value[row])
+            found[gid] = CatalogItem(
+                id=int(gid),
+                title=self.titles[row],
+                sub_category=self.sub_category_names[code] if code >= 0 else None,
+                price=None if np.isnan(price) else price,  # NULL price in the database
+                rating_value=None if np.isnan(rating) else rating,
+                rating_count=int(self.rating_count[row]),
+            )
+        return found
+
+    def mask(self, filters: SearchFilters | None) -> np.ndarray | None:
+        """Boolean row mask for `filters`, or None when nothing is filtered."""
+        if filters is None or filters.is_empty():
+            return None
+        if replace(filters, boost_sub_categories=None).is_empty():
+            return None  # only boosts, which rank rather than filter
+        keep = np.ones(len(self), dtype=bool)
+        if filters.max_price is not None:
+            keep &= self.price <= filters.max_price  # NaN (unknown price) never passes
+        if filters.min_rating is not None:
+            keep &= self.rating_value >= filters.min_rating
+        if filters.min_rating_count is not None:
+            keep &= self.rating_count >= filters.min_rating_count
+        if filters.sub_categories:
+            codes = [self._code_of[name] for name in filters.sub_categories if name in self._code_of]
+            keep &= np.isin(self.sub_category_code, codes)
+        return keep
+
+    def rating_weights(self, rating_weight: float) -> np.ndarray | None:
+        """
+        Per-row multiplier (rating / 5) ** rating_weight for similarity x rating ranking.
+        Unrated items get the catalog's mean rating so they are not zeroed out.
+        """
+        if not rating_weight:
+            return None
+        ratings = self.rating_value
+        mean = float(np.nanmean(ratings)) if np.isfinite(ratings).any() else 2.5
+        ratings = np.where(np.isnan(ratings), mean, ratings)
+        return (np.clip(ratings, 0.0, 5.0) / 5.0) ** rating_weight
+
+    def row_weights(self, filters: SearchFilters | None, rating_weight: float) -> np.ndarray | None:
+        """
+        rating_weights times SUB_CATEGORY_BOOST for the boosted sub-categories; None if
+        neither applies. The weights are applied sign-aware (see vector_search._adjust).
+        """
+        weights = self.rating_weights(rating_weight)
+        boosted = filters.boost_sub_categories if filters is not None else None
+        codes = [self._code_of[name] for name in boosted or () if name in self._code_of]
+        if not codes:
+            return weights
+        boost = np.where(np.isin(self.sub_category_code, codes), SUB_CATEGORY_BOOST, 1.0).astype(np.float32)
+        return boost if weights is None else weights * boost
+
+    def parse_request(self, text: str):
+        """
+        Pull filters out of a chat command, e.g. "best-rated under $10 in Produce".
+        Returns (SearchFilters or None, rating_weight); sub-categories are matched
+        against the catalog's own names. Only one introduced explicitly ("in Produce",
+        "category: Produce") filters; a name merely mentioned ("for meat lovers")
+        is boosted instead.
+        """
+        text = (text or "").lower()
+        filters = SearchFilters()
+        price = _PRICE_CAP_RE.search(text)
+        if price:
+            filters.max_price = float(price.group(1) or price.group(2))
+        stars = _MIN_STARS_RE.search(text)
+        if stars:
+            filters.min_rating = float(stars.group(1))
+        explicit, mentioned = set(), set()
+        for name in self.sub_category_names:
+            pattern = rf"\b{re.escape(name.lower())}(?!\w)"
+            if re.search(_EXPLICIT_CATEGORY_RE + pattern, text):
+                explicit.add(name)
+            elif re.search(pattern, text):
+                mentioned.add(name)
+        filters.sub_categories = frozenset(explicit) or None
+        filters.boost_sub_categories = frozenset(mentioned) or None
+        rating_weight = BEST_RATED_WEIGHT if _BEST_RATED_RE.search(text) else 0.0
+        return (None if filters.is_empty() else filters), rating_weight
+
+    def describe(self) -> dict:
+        return {"rows": len(self), "sub_categories": len(self.sub_category_names)}
+
+
+async def load_catalog_columns(session, index_ids) -> CatalogColumns:
+    """Fetch the catalog columns from grocery_items, aligned to `index_ids`."""
+    t0 = time.perf_counter()
+    res = await session.execute(
+        select(
+            GroceryItem.id,
+            GroceryItem.title,
+            GroceryItem.sub_category,
+            GroceryItem.price,
+            GroceryItem.rating_value,
+            GroceryItem.rating_count,
+        )
+    )
+    columns = CatalogColumns.build(index_ids, res.all())
+    print(f"[catalog_columns] Aligned {len(columns)} rows, {len(columns.sub_category_names)} sub-categories "
+          f"in {time.perf_counter() - t0:.2f}s")
+    return columns
@@ -0,0 +1,207 @@
+"""
+Two-tier cache for query embeddings.
+
+Tier 1 is an in-process LRU bounded by QUERY_EMBEDDING_CACHE_SIZE entries.
+Tier 2 is a local SQLite file (float32 BLOBs) that survives restarts.
+Keys are (model, normalized text), so "Olive oil" and " olive  OIL" share one entry;
+a miss is embedded from the first spelling seen (original casing, like the catalog
+texts) and that vector then serves every spelling.
+"""
+import os
+import re
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+# Set to an empty string to disable the persistent tier
+QUERY_EMBEDDING_CACHE_PATH = os.getenv("QUERY_EMBEDDING_CACHE_PATH", "/tmp/query_embeddings.sqlite")
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS query_embeddings (
+    model TEXT NOT NULL,
+    text TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    PRIMARY KEY (model, text)
+);
+"""
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", (text or "").strip()).lower()
+
+
+class EmbeddingCache:
+    def __init__(self, max_size: int = QUERY_EMBEDDING_CACHE_SIZE, path: str | None = QUERY_EMBEDDING_CACHE_PATH):
+        self.max_size = max_size
+        self.path = path or None
+        self._lru: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()  # LRU and counters only; never held during SQLite I/O
+        self._db_lock = threading.Lock()  # the SQLite connection
+        self._conn = None  # opened on first use, on a worker thread in get_many (see _db)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---- tier 1 ----
+    def _remember(self, key, vector: np.ndarray):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+            self.evictions += 1
+
+    # ---- tier 2 (call with self._db_lock held) ----
+    def _db(self):
+        """The SQLite connection, opened on first use."""
+        if self._conn is None and self.path:
+            try:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.execute(CREATE_TABLE_SQL)
+                self._conn.commit()
+            except Exception as e:
+                print(f"[embedding_cache] Persistent tier disabled ({self.path}): {e}")
+                self._conn = None
+                self.path = None
+        return self._conn
+
+    def _disk_get(self, model: str, texts):
+        conn = self._db()
+        if conn is None or not texts:
+            return {}
+        found = {}
+        texts = list(texts)
+        # Stay under SQLite's default bound-parameter limit
+        for start in range(0, len(texts), 500):
+            chunk = texts[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT text, embedding FROM query_embeddings WHERE model = ? AND text IN ({placeholders})",
+                [model, *chunk],
+            ).fetchall()
+            for text, blob in rows:
+                found[text] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _disk_put(self, model: str, items):
+        conn = self._db()
+        if conn is None or not items:
+            return
+        conn.executemany(
+            "INSERT OR REPLACE INTO query_embeddings (model, text, embedding) VALUES (?, ?, ?)",
+            [(model, text, np.asarray(vec, dtype=np.float32).tobytes()) for text, vec in items],
+        )
+        conn.commit()
+
+    def _lookup_memory(self, keys, model: str):
+        found = {}
+        with self._lock:
+            for key in keys:
+                vec = self._lru.get((model, key))
+                if vec is not None:
+                    self._lru.move_to_end((model, key))
+                    found[key] = vec
+                    self.memory_hits += 1
+        return found
+
+    def _lookup_disk(self, keys, model: str):
+        with self._db_lock:
+            found = self._disk_get(model, keys)
+        with self._lock:
+            for key, vec in found.items():
+                self._remember((model, key), vec)
+            self.disk_hits += len(found)
+        return found
+
+    def _finish_lookup(self, keys, found):
+        missing = [k for k in keys if k not in found]
+        with self._lock:
+            self.misses += len(missing)
+        return found, missing
+
+    def lookup(self, texts, model: str):
+        """
+        Return ({normalized_text: vector} for every cached text, [normalized texts still missing]).
+        Counters are updated per distinct normalized text.
+        """
+        keys = list(dict.fromkeys(normalize_text(t) for t in texts))
+        found = self._lookup_memory(keys, model)
+        remaining = [k for k in keys if k not in found]
+        if remaining:
+            found.update(self._lookup_disk(remaining, model))
+        return self._finish_lookup(keys, found)
+
+    def _store_memory(self, model: str, items):
+        with self._lock:
+            for text, vec in items:
+                self._remember((model, text), vec)
+
+    def _store_disk(self, model: str, items):
+        with self._db_lock:
+            try:
+                self._disk_put(model, items)
+            except Exception as e:
+                print(f"[embedding_cache] Failed to persist embeddings: {e}")
+
+    def store(self, model: str, items):
+        """items: iterable of (normalized_text, vector)"""
+        items = [(text, np.asarray(vec, dtype=np.float32)) for text, vec in items]
+        self._store_memory(model, items)
+        self._store_disk(model, items)
+
+    async def get_many(self, texts, model: str, fetch):
+        """
+        Embeddings for `texts` (input order) as a (len(texts), dim) float32 matrix.
+        Only cache misses are sent to `fetch(list_of_texts, model=model)`, in one call,
+        as the first spelling seen of each. The SQLite tier is read and written
+        on a worker thread.
+        """
+        texts = list(texts)
+        originals = {}
+        for t in texts:
+            originals.setdefault(normalize_text(t), t)
+        keys = list(originals)
+
+        found = self._lookup_memory(keys, model)
+        remaining = [k for k in keys if k not in found]
+        if remaining and self.path:
+            found.update(await asyncio.to_thread(self._lookup_disk, remaining, model))
+        found, missing = self._finish_lookup(keys, found)
+
+        if missing:
+            fetched = await fetch([originals[k] for k in missing], model=model)
+            new_items = [(k, np.asarray(vec, dtype=np.float32)) for k, vec in zip(missing, fetched)]
+            self._store_memory(model, new_items)
+            if self.path:
+                await asyncio.to_thread(self._store_disk, model, new_items)
+            found.update(new_items)
+        return np.array([found[normalize_text(t)] for t in texts], dtype=np.float32)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._lru),
+            "max_size": self.max_size,
+            "persistent_path": self.path,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+_cache = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
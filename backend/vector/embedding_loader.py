@@ -1,136 +1,207 @@
 import os
 import sqlite3
 import json
+import time
 import asyncio
+import hashlib
+import argparse
 from sqlalchemy import select
 from tqdm.asyncio import tqdm  # Recommended for progress visualization
 
 # Import your existing modules
 from db import SessionLocal, GroceryItem
-from llm import get_embedding
+from llm import EMBEDDING_DIMENSIONS
+from vector.embedding_store import convert_sqlite_to_store, open_store
+from vector.ann_index import IVFIndex, ANN_MIN_ROWS, ann_path_for
+from vector.embedding_provider import get_embedding_provider
 
 # --- Configuration ---
 # Save the sqlite file in the same directory as this script
 EMBED_DB_PATH = os.path.join(os.path.dirname(__file__), "embeddings.sqlite")
+# Binary memory-mapped copy that the server actually loads (see vector/embedding_store.py)
+EMBED_STORE_PATH = os.path.join(os.path.dirname(__file__), "embeddings.bin")
 
-# Batch size for SQLite inserts (improves disk I/O performance)
-BATCH_SIZE = 50 
+# Inputs per embeddings request (the API accepts up to 2048; titles are short)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
 
-# Limit concurrent API calls to OpenAI to avoid Rate Limit errors (429)
-CONCURRENCY_LIMIT = 10 
+# Embeddings requests in flight at once; keeps us under the rate limit (429)
+CONCURRENCY_LIMIT = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
+# Attempts per batch before it is left for the next run
+MAX_ATTEMPTS = 4
 
 # SQL to create the local embeddings table
 CREATE_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS grocery_item_embeddings (
     grocery_item_id INTEGER PRIMARY KEY,
-    embedding TEXT NOT NULL
+    embedding TEXT NOT NULL,
+    text_hash TEXT
 );
 """
 
-async def process_item(semaphore, item):
+
+
+def embedding_text(title, sub_category) -> str:
+    """Text embedded per item: title and sub_category for richer semantic search context."""
+    return f"{title} | {sub_category}"
+
+
+def text_hash(text: str) -> str:
+    # Vectors from different providers / models / widths are not comparable, so they are part of the hash
+    key = get_embedding_provider().cache_key
+    return hashlib.sha256(f"{key}\n{text}".encode("utf-8")).hexdigest()
+
+
+def open_embeddings_db(path: str = EMBED_DB_PATH) -> sqlite3.Connection:
+    """Open the embeddings table, adding the text_hash column to databases built before it existed."""
+    conn = sqlite3.connect(path)
+    conn.execute(CREATE_TABLE_SQL)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(grocery_item_embeddings)")}
+    if "text_hash" not in columns:
+        conn.execute("ALTER TABLE grocery_item_embeddings ADD COLUMN text_hash TEXT")
+    conn.commit()
+    return conn
+
+
+async def embed_batch(semaphore, batch):
     """
-    Worker function to process a single grocery item.
-    1. Acquires a semaphore slot.
-    2. Calls OpenAI API to get the embedding.
-    3. Returns the result tuple for insertion.
+    Embed one batch of (id, text, hash) with a single request, retrying with backoff.
+    Returns [(id, embedding_json, hash), ...], or [] if every attempt failed.
     """
     async with semaphore:
-        try:
-            # Combine title and sub_category for richer semantic search context
-            text_to_embed = f"{item.title} | {item.sub_category}"
-            
-            # Call the LLM module (calls OpenAI text-embedding-3-large)
-            emb = await get_embedding(text_to_embed)
-            
-            # Basic validation
-            if not emb or not isinstance(emb, list):
-                print(f"⚠️ Warning: No embedding returned for item ID {item.id} ({item.title})")
-                return None
-            
-            # Return tuple: (id, json_string_embedding, title_for_logging)
-            return (item.id, json.dumps(emb), item.title)
-            
-        except Exception as e:
-            print(f"❌ Error embedding item ID {item.id} ({item.title}): {e}")
-            return None
-
-async def generate_and_store_embeddings():
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                vectors = await get_embedding_provider().embed([text for _, text, _ in batch])
+                return [(gid, json.dumps(vec.tolist()), digest) for (gid, _, digest), vec in zip(batch, vectors)]
+            except Exception as e:
+                if attempt == MAX_ATTEMPTS:
+                    print(f"❌ Giving up on a batch of {len(batch)} items (first id {batch[0][0]}): {e}")
+                    return []
+                delay = 2 ** attempt
+                print(f"⚠️ Embedding batch failed ({e}); retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+
+def plan_changes(items, existing, full: bool = False, adopt_legacy: bool = False):
+    """
+    Diff the catalog against the stored hashes.
+    items: [(id, title, sub_category)]; existing: {id: text_hash or None}.
+    Returns (to_embed [(id, text, hash)], to_delete [id], adopted [(hash, id)]).
+    Rows written before hashes were recorded (hash NULL) may be stale, so they
+    are re-embedded once; with adopt_legacy they are only stamped with the
+    current hash (for stores known to match the catalog).
+    """
+    to_embed, adopted = [], []
+    for gid, title, sub_category in items:
+        text = embedding_text(title, sub_category)
+        digest = text_hash(text)
+        stored = existing.get(gid, "")
+        if full or gid not in existing:
+            to_embed.append((gid, text, digest))
+        elif stored is None and adopt_legacy:
+            adopted.append((digest, gid))
+        elif stored != digest:
+            to_embed.append((gid, text, digest))
+    catalog_ids = {gid for gid, _, _ in items}
+    to_delete = [gid for gid in existing if gid not in catalog_ids]
+    return to_embed, to_delete, adopted
+
+
+async def generate_and_store_embeddings(full: bool = False, dry_run: bool = False, adopt_legacy: bool = False):
+    """
+    Incrementally sync embeddings.sqlite with grocery_items:
+    new or changed items (by text hash) are embedded in batches of EMBED_BATCH_SIZE,
+    vectors of deleted items are removed, and unchanged rows are left alone.
+    """
     print(f"🚀 Starting embedding generation logic...")
     print(f"📂 Target Database: {EMBED_DB_PATH}")
+    print(f"🧠 Embedding provider: {get_embedding_provider().name} ({get_embedding_provider().model_name})")
+    t0 = time.perf_counter()
 
     # 1. Initialize SQLite Database
-    conn = sqlite3.connect(EMBED_DB_PATH)
-    conn.execute(CREATE_TABLE_SQL)
-    conn.commit()
+    conn = open_embeddings_db()
 
-    # 2. Check for existing embeddings to allow resuming if interrupted
-    existing_ids = set(
-        row[0] for row in conn.execute("SELECT grocery_item_id FROM grocery_item_embeddings")
-    )
-    print(f"📋 Found {len(existing_ids)} existing vectors in SQLite. These will be skipped.")
+    # 2. Hashes of what is already embedded
+    existing = dict(conn.execute("SELECT grocery_item_id, text_hash FROM grocery_item_embeddings"))
+    print(f"📋 Found {len(existing)} existing vectors in SQLite.")
 
     # 3. Load Source Data from MySQL (Cloud SQL)
     print("📥 Fetching grocery items from MySQL...")
     async with SessionLocal() as session:
-        res = await session.execute(select(GroceryItem))
-        all_items = res.scalars().all()
+        res = await session.execute(select(GroceryItem.id, GroceryItem.title, GroceryItem.sub_category))
+        items = [tuple(row) for row in res.all()]
 
-    # Filter out items that are already processed
-    items_to_process = [g for g in all_items if g.id not in existing_ids]
-    print(f"⚡ Total items to process: {len(items_to_process)}")
+    to_embed, to_delete, adopted = plan_changes(items, existing, full=full, adopt_legacy=adopt_legacy)
+    print(f"⚡ {len(items)} catalog items: {len(to_embed)} to embed, {len(to_delete)} to delete, "
+          f"{len(adopted)} legacy rows to hash, {len(items) - len(to_embed) - len(adopted)} unchanged")
 
-    if not items_to_process:
-        print("✅ All items are already embedded. Nothing to do.")
+    if dry_run:
         conn.close()
         return
 
-    # 4. Prepare Concurrency Tools
+    # 4. Apply cheap changes first
+    if to_delete:
+        conn.executemany("DELETE FROM grocery_item_embeddings WHERE grocery_item_id = ?", [(gid,) for gid in to_delete])
+    if adopted:
+        conn.executemany("UPDATE grocery_item_embeddings SET text_hash = ? WHERE grocery_item_id = ?", adopted)
+    conn.commit()
+
+    # 5. Embed in batches; each finished batch is written immediately so an interrupted run resumes
     semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
-    tasks = []
-
-    # Create async tasks for all items
-    for item in items_to_process:
-        task = process_item(semaphore, item)
-        tasks.append(task)
-
-    # 5. Execute Tasks and Batch Write to SQLite
-    pending_inserts = []
-    
-    # process tasks as they complete
-    for f in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Generating Embeddings"):
-        result = await f
-        
-        if result:
-            pending_inserts.append(result)
-
-        # Write to DB when batch size is reached
-        if len(pending_inserts) >= BATCH_SIZE:
-            # Prepare data for executemany: [(id, embedding_json), ...]
-            data_to_insert = [(r[0], r[1]) for r in pending_inserts]
-            
+    batches = [to_embed[i:i + EMBED_BATCH_SIZE] for i in range(0, len(to_embed), EMBED_BATCH_SIZE)]
+    tasks = [embed_batch(semaphore, batch) for batch in batches]
+    embedded = 0
+    for f in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Embedding batches"):
+        rows = await f
+        if rows:
             conn.executemany(
-                "INSERT INTO grocery_item_embeddings (grocery_item_id, embedding) VALUES (?, ?)",
-                data_to_insert
+                "INSERT OR REPLACE INTO grocery_item_embeddings (grocery_item_id, embedding, text_hash) VALUES (?, ?, ?)",
+                rows,
             )
             conn.commit()
-            pending_inserts = [] # Clear the buffer
-
-    # 6. Insert any remaining items in the buffer
-    if pending_inserts:
-        data_to_insert = [(r[0], r[1]) for r in pending_inserts]
-        conn.executemany(
-            "INSERT INTO grocery_item_embeddings (grocery_item_id, embedding) VALUES (?, ?)",
-            data_to_insert
-        )
-        conn.commit()
-
-    # 7. Final Cleanup
+            embedded += len(rows)
+
+    # 6. Final Cleanup
     conn.close()
-    print("🎉 Embedding generation complete!")
+    print(f"🎉 Embedded {embedded}/{len(to_embed)} items in {len(batches)} requests, "
+          f"deleted {len(to_delete)} ({time.perf_counter() - t0:.1f}s)")
+    if embedded < len(to_embed):
+        print("⚠️ Some batches failed; re-run to embed the remaining items.")
+
+    if embedded or to_delete or full or not os.path.exists(EMBED_STORE_PATH):
+        export_binary_store()
+    else:
+        print("✅ Store is up to date. Nothing to export.")
+
+def export_binary_store():
+    """Rebuild the memory-mapped store from the SQLite table (the resumable source of truth)."""
+    print(f"📦 Exporting binary store to {EMBED_STORE_PATH} ...")
+    provider = get_embedding_provider()
+    # Only OpenAI vectors are truncated on export; other providers already emit their final width
+    dims = EMBEDDING_DIMENSIONS if provider.name == "openai" else 0
+    header = convert_sqlite_to_store(EMBED_DB_PATH, EMBED_STORE_PATH, model=provider.model_name, dims=dims)
+    print(f"   {header.count} vectors, dim={header.dim}, {header.file_size / 1e6:.1f} MB")
+
+    # The ANN index is tied to the store's exact row order, so rebuild it together
+    ann_path = ann_path_for(EMBED_STORE_PATH)
+    if header.count >= ANN_MIN_ROWS:
+        print(f"🧭 Building IVF index {ann_path} ...")
+        _, ids, matrix = open_store(EMBED_STORE_PATH)
+        IVFIndex.build(matrix, ids).save(ann_path)
+    elif os.path.exists(ann_path):
+        os.remove(ann_path)
+
     print("-" * 50)
-    print(f"👉 Next Step: Upload the generated file to GCS so Cloud Run can access it:")
-    print(f"   gsutil cp {EMBED_DB_PATH} gs://groceryshopperai-embeddings/embeddings.sqlite")
+    print(f"👉 Next Step: Publish the files (gzip + sha256 manifest) so Cloud Run can download them:")
+    print(f"   python -m vector.artifact_sync publish --src-dir {os.path.dirname(EMBED_STORE_PATH)}")
     print("-" * 50)
 
 if __name__ == "__main__":
-    asyncio.run(generate_and_store_embeddings())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sync grocery item embeddings with the catalog")
+    parser.add_argument("--full", action="store_true", help="Re-embed every item, ignoring stored hashes")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--adopt-legacy", action="store_true",
+                        help="Stamp rows without a stored hash as current instead of re-embedding them "
+                             "(only if no item changed since they were embedded)")
+    args = parser.parse_args()
+    asyncio.run(generate_and_store_embeddings(full=args.full, dry_run=args.dry_run, adopt_legacy=args.adopt_legacy))
\ No newline at end of file
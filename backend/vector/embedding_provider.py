@@ -0,0 +1,161 @@
+"""
+Embedding providers for the catalog builder and for query time.
+
+EMBEDDING_PROVIDER selects one:
+- "openai" (default): text-embedding-3 via llm.get_embeddings, at EMBEDDING_DIMENSIONS
+- "local":  deterministic hashed character n-grams + sparse random projection,
+            pure numpy, no network. Meant for benchmarks, load tests and offline
+            development; a catalog embedded with it must also be queried with it.
+
+Vectors from different providers live in different spaces, so the provider's
+`model_name` is written into the store header and its `cache_key` keys the
+query embedding cache. During an outage of a remote provider search degrades
+to BM25 (see vector_search), not to another embedding space.
+"""
+import os
+import re
+import abc
+import zlib
+
+import numpy as np
+
+from llm import get_embeddings, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").strip().lower()
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "256"))
+LOCAL_EMBEDDING_SEED = int(os.getenv("LOCAL_EMBEDDING_SEED", "0"))
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+class EmbeddingProvider(abc.ABC):
+    """Interface: embed a batch of texts into a (len(texts), dim) float32 array."""
+
+    name = "base"
+    model_name = ""
+    # Output width, or None when it is whatever the remote model returns
+    dim = None
+    # Remote providers are worth caching; local ones are cheaper to recompute
+    remote = True
+
+    @property
+    def cache_key(self) -> str:
+        return self.model_name
+
+    @abc.abstractmethod
+    async def embed(self, texts) -> np.ndarray:
+        """(len(texts), dim) float32 embeddings, one row per text."""
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.model_name = model
+        self.dimensions = dimensions
+        self.dim = dimensions or None
+
+    @property
+    def cache_key(self) -> str:
+        # Vectors of different widths must never be mixed
+        return f"{self.model_name}@{self.dimensions}" if self.dimensions else self.model_name
+
+    async def embed(self, texts) -> np.ndarray:
+        vectors = await get_embeddings(list(texts), model=self.model_name, dimensions=self.dimensions)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer: spreads hash bits so each projection slot is independent."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Character n-grams (and whole words) of the lower-cased text are hashed with
+    crc32, and each feature is added with a random sign to `nnz` coordinates
+    derived from its hash, i.e. a sparse random projection of the bag of n-grams
+    that never materializes the projection matrix. Rows are L2-normalized.
+    Deterministic for a given (dim, seed, n-gram range), across processes.
+    Similar spellings land close together, which is enough for product titles;
+    it has no notion of synonyms.
+    """
+
+    name = "local"
+    remote = False
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM, seed: int = LOCAL_EMBEDDING_SEED,
+                 ngram_range=(3, 5), nnz: int = 4):
+        self.dim = dim
+        self.seed = seed
+        self.ngram_range = ngram_range
+        self.nnz = nnz
+        self.model_name = f"local-hash-v1-d{dim}-s{seed}"
+
+    def features(self, text: str):
+        """crc32 hashes of the text's word and character n-gram features."""
+        text = (text or "").lower()
+        hashes = [zlib.crc32(b"w:" + word.encode("utf-8")) for word in _WORD_RE.findall(text)]
+        padded = f" {' '.join(text.split())} ".encode("utf-8")
+        lo, hi = self.ngram_range
+        for n in range(lo, hi + 1):
+            hashes.extend(zlib.crc32(padded[i:i + n]) for i in range(len(padded) - n + 1))
+        return hashes
+
+    def embed_sync(self, texts) -> np.ndarray:
+        texts = list(texts)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        feats, rows = [], []
+        for row, text in enumerate(texts):
+            hashes = self.features(text)
+            feats.extend(hashes)
+            rows.extend([row] * len(hashes))
+        if not feats:
+            return out
+
+        h = np.asarray(feats, dtype=np.uint64) + np.uint64(self.seed * 0x9E3779B97F4A7C15 & _MASK64)
+        base = np.asarray(rows, dtype=np.int64) * self.dim
+        flat = np.zeros(out.size, dtype=np.float64)
+        for k in range(self.nnz):
+            z = _mix64(h + np.uint64(k * 0xD1B54A32D192ED03 & _MASK64))
+            cols = (z % np.uint64(self.dim)).astype(np.int64)
+            signs = np.where(z >> np.uint64(63), -1.0, 1.0)
+            flat += np.bincount(base + cols, weights=signs, minlength=out.size)
+        out[:] = flat.reshape(out.shape)
+
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        out /= norms
+        return out
+
+    async def embed(self, texts) -> np.ndarray:
+        return self.embed_sync(texts)
+
+
+PROVIDERS = {
+    "openai": OpenAIEmbeddingProvider,
+    "local": HashingEmbeddingProvider,
+}
+
+_provider = None
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """The provider selected by EMBEDDING_PROVIDER (one instance per process)."""
+    global _provider
+    if _provider is None:
+        if EMBEDDING_PROVIDER not in PROVIDERS:
+            raise ValueError(f"Unknown EMBEDDING_PROVIDER {EMBEDDING_PROVIDER!r}; choose from {list(PROVIDERS)}")
+        _provider = PROVIDERS[EMBEDDING_PROVIDER]()
+    return _provider
+
+
+def set_embedding_provider(provider: EmbeddingProvider):
+    """Swap the process-wide provider (benchmarks, offline tools)."""
+    global _provider
+    _provider = provider
@@ -0,0 +1,234 @@
+"""
+Binary, memory-mappable embedding store.
+
+File layout (little-endian):
+    [0, 256)              header: magic, format version, dim, count, flags, model name
+    [256, 256 + 8*count)  int64 grocery item ids, row order of the matrix
+    [matrix_offset, ...)  float32 matrix, count x dim, C order (offset is 64-byte aligned)
+
+The server maps the file read-only with np.memmap, so opening it costs a header
+read and the vector pages are loaded lazily and shared through the OS page cache.
+
+Usage (run from backend/):
+    python -m vector.embedding_store convert [--src embeddings.sqlite] [--dst embeddings.bin] [--dims 512]
+    python -m vector.embedding_store info [path]
+"""
+import os
+import json
+import struct
+import sqlite3
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+
+MAGIC = b"GSAIEMB1"
+FORMAT_VERSION = 1
+HEADER_SIZE = 256
+ALIGNMENT = 64
+
+FLAG_NORMALIZED = 1
+
+# magic, version, dim, count, flags, model name length
+_HEADER_STRUCT = struct.Struct("<8sIIQII")
+MAX_MODEL_NAME = HEADER_SIZE - _HEADER_STRUCT.size
+
+# Rows converted per chunk; bounds peak memory independently of catalog size
+CONVERT_CHUNK_ROWS = 2048
+
+
+@dataclass
+class StoreHeader:
+    dim: int
+    count: int
+    model: str
+    normalized: bool
+    version: int = FORMAT_VERSION
+
+    @property
+    def ids_offset(self) -> int:
+        return HEADER_SIZE
+
+    @property
+    def matrix_offset(self) -> int:
+        end_of_ids = HEADER_SIZE + 8 * self.count
+        return (end_of_ids + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+    @property
+    def file_size(self) -> int:
+        return self.matrix_offset + 4 * self.count * self.dim
+
+    def pack(self) -> bytes:
+        model = self.model.encode("utf-8")
+        if len(model) > MAX_MODEL_NAME:
+            raise ValueError(f"Model name too long for store header: {self.model!r}")
+        flags = FLAG_NORMALIZED if self.normalized else 0
+        raw = _HEADER_STRUCT.pack(MAGIC, self.version, self.dim, self.count, flags, len(model)) + model
+        return raw.ljust(HEADER_SIZE, b"\0")
+
+    @classmethod
+    def unpack(cls, raw: bytes) -> "StoreHeader":
+        if len(raw) < HEADER_SIZE:
+            raise ValueError("Embedding store is truncated (incomplete header)")
+        magic, version, dim, count, flags, model_len = _HEADER_STRUCT.unpack_from(raw)
+        if magic != MAGIC:
+            raise ValueError("Not an embedding store file (bad magic)")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding store version {version}")
+        start = _HEADER_STRUCT.size
+        model = raw[start:start + model_len].decode("utf-8")
+        return cls(dim=dim, count=count, model=model, normalized=bool(flags & FLAG_NORMALIZED), version=version)
+
+
+def read_header(path: str) -> StoreHeader:
+    with open(path, "rb") as f:
+        return StoreHeader.unpack(f.read(HEADER_SIZE))
+
+
+def open_store(path: str):
+    """
+    Map an embedding store read-only.
+    Returns (header, ids, matrix); ids and matrix are np.memmap views, nothing is copied.
+    """
+    header = read_header(path)
+    actual = os.path.getsize(path)
+    if actual < header.file_size:
+        raise ValueError(f"Embedding store is truncated: {actual} bytes, expected {header.file_size}")
+
+    if header.count == 0:
+        return header, np.empty(0, dtype=np.int64), np.empty((0, header.dim), dtype=np.float32)
+
+    ids = np.memmap(path, dtype="<i8", mode="r", offset=header.ids_offset, shape=(header.count,))
+    matrix = np.memmap(path, dtype="<f4", mode="r", offset=header.matrix_offset, shape=(header.count, header.dim))
+    return header, ids, matrix
+
+
+def _normalize(block: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return block / norms
+
+
+def truncate_rows(block: np.ndarray, dims: int) -> np.ndarray:
+    """
+    Keep the leading `dims` components of each row and re-normalize.
+    Equivalent to requesting `dimensions=dims` from a text-embedding-3 model,
+    so full-width vectors can be shortened without re-embedding.
+    """
+    if block.shape[1] < dims:
+        raise ValueError(f"Cannot widen {block.shape[1]}-dim embeddings to {dims} dims; re-embed instead")
+    return _normalize(np.asarray(block[:, :dims], dtype=np.float32))
+
+
+def write_store(path: str, ids, matrix, model: str, normalize: bool = True) -> StoreHeader:
+    """Write an in-memory (ids, matrix) pair as a store. The file is replaced atomically."""
+    ids = np.asarray(ids, dtype="<i8")
+    matrix = np.asarray(matrix, dtype="<f4")
+    if matrix.ndim != 2 or matrix.shape[0] != ids.shape[0]:
+        raise ValueError("ids and matrix must describe the same number of rows")
+
+    header = StoreHeader(dim=int(matrix.shape[1]), count=int(ids.shape[0]), model=model, normalized=normalize)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.pack())
+        f.write(ids.tobytes())
+        f.write(b"\0" * (header.matrix_offset - HEADER_SIZE - ids.nbytes))
+        for start in range(0, header.count, CONVERT_CHUNK_ROWS):
+            block = matrix[start:start + CONVERT_CHUNK_ROWS]
+            if normalize:
+                block = _normalize(block)
+            f.write(np.ascontiguousarray(block, dtype="<f4").tobytes())
+    os.replace(tmp_path, path)
+    return header
+
+
+def convert_sqlite_to_store(sqlite_path: str, store_path: str, model: str, normalize: bool = True, dims: int = 0) -> StoreHeader:
+    """
+    One-shot conversion of the JSON-TEXT `grocery_item_embeddings` table into a store.
+    Rows are streamed in chunks straight into the output mapping, so the full
+    catalog is never held in memory twice.
+    With dims > 0 every row is truncated to that width and re-normalized; otherwise
+    all rows must share one width.
+    """
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        count = conn.execute("SELECT COUNT(*) FROM grocery_item_embeddings").fetchone()[0]
+        first = conn.execute("SELECT embedding FROM grocery_item_embeddings LIMIT 1").fetchone()
+        dim = dims or (len(json.loads(first[0])) if first else 0)
+
+        header = StoreHeader(dim=dim, count=count, model=model, normalized=normalize)
+        tmp_path = store_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header.pack())
+            f.truncate(header.file_size)
+
+        if count:
+            ids = np.memmap(tmp_path, dtype="<i8", mode="r+", offset=header.ids_offset, shape=(count,))
+            matrix = np.memmap(tmp_path, dtype="<f4", mode="r+", offset=header.matrix_offset, shape=(count, dim))
+
+            cursor = conn.execute(
+                "SELECT grocery_item_id, embedding FROM grocery_item_embeddings ORDER BY grocery_item_id"
+            )
+            row = 0
+            while True:
+                rows = cursor.fetchmany(CONVERT_CHUNK_ROWS)
+                if not rows:
+                    break
+                vectors = [json.loads(emb) for _, emb in rows]
+                if dims:
+                    if min(len(v) for v in vectors) < dims:
+                        raise ValueError(f"{sqlite_path} has embeddings narrower than {dims} dims; re-embed them")
+                    block = truncate_rows(np.array([v[:dims] for v in vectors], dtype=np.float32), dims)
+                else:
+                    widths = {len(v) for v in vectors}
+                    if widths != {dim}:
+                        raise ValueError(f"Mixed embedding dimensions in {sqlite_path}: {sorted(widths)} vs {dim}")
+                    block = np.array(vectors, dtype=np.float32)
+                    if normalize:
+                        block = _normalize(block)
+                ids[row:row + len(rows)] = [gid for gid, _ in rows]
+                matrix[row:row + len(rows)] = block
+                row += len(rows)
+
+            ids.flush()
+            matrix.flush()
+            del ids, matrix
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, store_path)
+    return header
+
+
+def main():
+    from llm import EMBEDDING_DIMENSIONS
+    from vector.embedding_provider import get_embedding_provider
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    convert = sub.add_parser("convert", help="Convert embeddings.sqlite into a binary store")
+    convert.add_argument("--src", default=os.path.join(os.path.dirname(__file__), "embeddings.sqlite"))
+    convert.add_argument("--dst", default=None, help="Defaults to the source path with a .bin suffix")
+    convert.add_argument("--model", default=get_embedding_provider().model_name)
+    convert.add_argument("--dims", type=int, default=EMBEDDING_DIMENSIONS,
+                         help="Truncate + re-normalize to this width (default: EMBEDDING_DIMENSIONS, 0 = keep)")
+
+    info = sub.add_parser("info", help="Print a store header")
+    info.add_argument("path", nargs="?", default=os.path.join(os.path.dirname(__file__), "embeddings.bin"))
+
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        dst = args.dst or os.path.splitext(args.src)[0] + ".bin"
+        print(f"Converting {args.src} -> {dst} ...")
+        header = convert_sqlite_to_store(args.src, dst, model=args.model, dims=args.dims)
+        print(f"Wrote {header.count} vectors (dim={header.dim}, model={header.model}), {header.file_size / 1e6:.1f} MB")
+    else:
+        header = read_header(args.path)
+        print(f"{args.path}: count={header.count} dim={header.dim} model={header.model} "
+              f"normalized={header.normalized} version={header.version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Hot reload of the search index while requests are being served.
+
+A reload builds a complete new snapshot off the event loop (embedding matrix,
+ANN / quantized sidecars, catalog columns, BM25 index) and then publishes it
+with one reference swap, so a search always sees one consistent snapshot:
+in-flight searches finish on the old one, new searches get the new one.
+
+The first snapshot is loaded the same way, in the background at startup
+(start_index_loading); until it is published require_index() raises
+IndexNotReady and /health/ready reports "loading" (or "failed" when the
+artifacts are missing or unreadable; the next search retries).
+
+Triggers:
+- watch_index_files(): polls the artifact files' mtime/size every
+  INDEX_RELOAD_INTERVAL seconds (0 disables the watcher)
+- POST /api/admin/reload-index (see app.py)
+
+Artifacts must be replaced atomically (write a temp file, then os.replace), as
+embedding_store / ann_index / quantization do, so the old snapshot's memory
+mappings keep pointing at the old file contents.
+"""
+import os
+import time
+import asyncio
+
+from db import SessionLocal
+from vector.vector_cache import build_index, swap_index, source_signature, peek_index, IndexNotReady
+from vector.catalog_columns import load_catalog_columns
+from vector.lexical_index import load_lexical_index
+
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "30"))
+
+_reload_lock = asyncio.Lock()
+_initial_load = None
+_prepare = None  # the startup `prepare`, reused when a failed first load is retried
+_last_reload = {"reason": None, "finished_at": None, "seconds": None, "error": None}
+
+
+async def reload_index(force: bool = False, reason: str = "manual") -> dict:
+    """
+    Build and publish a new snapshot. Without force, nothing happens when the
+    artifacts on disk are unchanged. Concurrent calls are serialized; a caller
+    that waited for another reload re-checks the signature and usually returns
+    immediately.
+    """
+    async with _reload_lock:
+        current = peek_index()
+        if not force and current is not None and current.signature == source_signature():
+            return {"reloaded": False, "version": current.version}
+
+        t0 = time.perf_counter()
+        try:
+            # Reading and mapping files blocks; keep it off the event loop
+            # strict: a missing or unreadable source fails the reload instead of publishing an empty index
+            index = await asyncio.to_thread(build_index, True)
+        except Exception as e:
+            _last_reload.update(reason=reason, finished_at=time.time(), seconds=None, error=repr(e))
+            serving = f"v{current.version}" if current is not None else "nothing"
+            print(f"[index_reloader] Reload ({reason}) failed, still serving {serving}: {e!r}")
+            raise
+
+        # Catalog-side structures are best effort: vector search works without them
+        # Both live on the snapshot, so a search never mixes catalog versions
+        error = None
+        try:
+            async with SessionLocal() as session:
+                index.columns = await load_catalog_columns(session, index.ids)
+                index.lexical = await load_lexical_index(session)
+        except Exception as e:
+            error = repr(e)
+            print(f"[index_reloader] Catalog metadata unavailable ({e!r}); serving vectors without filters")
+
+        swap_index(index)
+        seconds = round(time.perf_counter() - t0, 3)
+        _last_reload.update(reason=reason, finished_at=time.time(), seconds=seconds, error=error)
+        return {"reloaded": True, "version": index.version, "seconds": seconds}
+
+
+def start_index_loading(prepare=None) -> asyncio.Task:
+    """
+    Start loading the first snapshot in the background (single flight: every
+    caller gets the same task until it has succeeded or failed).
+    `prepare` is an optional coroutine function awaited first, e.g. the artifact
+    download, so nothing is loaded from a half-synced directory. It is remembered,
+    so retries triggered by require_index() sync the artifacts again too.
+    """
+    global _initial_load, _prepare
+    if prepare is not None:
+        _prepare = prepare
+    if _initial_load is None or (_initial_load.done() and peek_index() is None):
+        _initial_load = asyncio.create_task(_load_initial(_prepare))
+        _initial_load.add_done_callback(_report_initial_load)
+    return _initial_load
+
+
+async def _load_initial(prepare):
+    if prepare is not None:
+        await prepare()
+    return await reload_index(reason="startup")
+
+
+def _report_initial_load(task: asyncio.Task):
+    # Retrieve the exception so it is logged here rather than as "never retrieved"
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        print(f"[index_reloader] Initial index load failed (retried on the next search): {error!r}")
+
+
+def index_state() -> str:
+    """"ready", "loading", "failed" or "not_started"."""
+    if peek_index() is not None:
+        return "ready"
+    if _initial_load is None:
+        return "not_started"
+    if not _initial_load.done():
+        return "loading"
+    return "failed"
+
+
+def require_index():
+    """The live snapshot; raises IndexNotReady (and makes sure loading has started) if there is none yet."""
+    index = peek_index()
+    if index is None:
+        start_index_loading()
+        raise IndexNotReady("The product catalog index is still loading")
+    return index
+
+
+async def watch_index_files(interval: float = INDEX_RELOAD_INTERVAL):
+    """Reload whenever the artifact files change (run as a background task)."""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        current = peek_index()
+        try:
+            if current is not None and current.signature != source_signature():
+                print("[index_reloader] Index artifacts changed on disk; reloading")
+                await reload_index(reason="file change")
+        except Exception as e:
+            print(f"[index_reloader] Watcher error (retrying next tick): {e!r}")
+
+
+def reload_status() -> dict:
+    index = peek_index()
+    return {
+        "state": index_state(),
+        "version": index.version if index is not None else None,
+        "loaded_at": index.loaded_at if index is not None else None,
+        "load_seconds": index.load_seconds if index is not None else None,
+        "source": index.source if index is not None else None,
+        "last_reload": dict(_last_reload),
+    }
@@ -0,0 +1,122 @@
+"""
+In-memory BM25 inverted index over grocery item titles and sub-categories.
+
+Built from `grocery_items` with each index snapshot and stored on it
+(EmbeddingIndex.lexical), so BM25 and vector results always describe the same
+catalog version. Postings are stored CSR-style in
+numpy arrays (one slice of doc rows + term frequencies per term), so a query
+touches only the documents that contain its terms and answers in microseconds
+without any network call. Used on its own when the embedding provider is slow
+or down, and fused with vector results (reciprocal rank fusion) otherwise.
+"""
+import re
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+from db import GroceryItem
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str):
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class LexicalIndex:
+    def __init__(self, ids, vocab, offsets, doc_rows, term_freqs, doc_lengths):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vocab = vocab                  # term -> term number
+        self.offsets = offsets              # term t owns postings [offsets[t], offsets[t+1])
+        self.doc_rows = doc_rows            # row number (into ids) per posting
+        self.term_freqs = term_freqs        # term frequency per posting
+        self.doc_lengths = doc_lengths.astype(np.float32)
+        avg = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 1.0
+        # BM25 length normalization is per document, so precompute it once
+        self._length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / (avg or 1.0))
+        df = np.diff(offsets).astype(np.float32)
+        n = float(len(self.ids))
+        self.idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    @classmethod
+    def build(cls, ids, titles, sub_categories):
+        vocab = {}
+        postings = {}  # term number -> list of (row, tf)
+        doc_lengths = np.zeros(len(ids), dtype=np.int32)
+        for row, (title, sub_category) in enumerate(zip(titles, sub_categories)):
+            tokens = tokenize(f"{title} {sub_category}")
+            doc_lengths[row] = len(tokens)
+            counts = {}
+            for tok in tokens:
+                counts[tok] = counts.get(tok, 0) + 1
+            for tok, tf in counts.items():
+                term = vocab.setdefault(tok, len(vocab))
+                postings.setdefault(term, []).append((row, tf))
+
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for term in range(len(vocab)):
+            offsets[term + 1] = offsets[term] + len(postings[term])
+        doc_rows = np.empty(offsets[-1], dtype=np.int32)
+        term_freqs = np.empty(offsets[-1], dtype=np.float32)
+        for term in range(len(vocab)):
+            plist = postings[term]
+            doc_rows[offsets[term]:offsets[term + 1]] = [r for r, _ in plist]
+            term_freqs[offsets[term]:offsets[term + 1]] = [tf for _, tf in plist]
+        return cls(ids, vocab, offsets, doc_rows, term_freqs, doc_lengths)
+
+    def search(self, query: str, top_k: int = 10):
+        """BM25 top-k as [(grocery_item_id, score), ...] best first; empty if no term matches."""
+        terms = [self.vocab[t] for t in dict.fromkeys(tokenize(query)) if t in self.vocab]
+        if not terms or top_k <= 0:
+            return []
+
+        rows_parts, score_parts = [], []
+        for term in terms:
+            start, stop = self.offsets[term], self.offsets[term + 1]
+            rows = self.doc_rows[start:stop]
+            tf = self.term_freqs[start:stop]
+            rows_parts.append(rows)
+            score_parts.append(self.idf[term] * tf * (BM25_K1 + 1) / (tf + self._length_norm[rows]))
+
+        rows, inverse = np.unique(np.concatenate(rows_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+
+        k = min(top_k, rows.size)
+        if k < rows.size:
+            top = np.argpartition(scores, rows.size - k)[rows.size - k:]
+        else:
+            top = np.arange(rows.size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in top]
+
+
+def rrf_fuse(ranked_lists, top_k: int, k: int = 60):
+    """
+    Reciprocal rank fusion: score(id) = sum over lists of 1 / (k + rank).
+    Rank-based, so cosine and BM25 scores never need to share a scale.
+    """
+    fused = {}
+    for ranked in ranked_lists:
+        for rank, (gid, _) in enumerate(ranked, start=1):
+            fused[gid] = fused.get(gid, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+
+async def load_lexical_index(session) -> LexicalIndex:
+    """Build the BM25 index from grocery_items (for a new index snapshot, see index_reloader)."""
+    t0 = time.perf_counter()
+    res = await session.execute(select(GroceryItem.id, GroceryItem.title, GroceryItem.sub_category))
+    rows = res.all()
+    index = LexicalIndex.build(
+        [r.id for r in rows], [r.title for r in rows], [r.sub_category for r in rows]
+    )
+    print(f"[lexical_index] Indexed {len(index)} items, {len(index.vocab)} terms "
+          f"in {time.perf_counter() - t0:.2f}s")
+    return index
@@ -0,0 +1,132 @@
+"""
+Compact (int8 / float16) copies of the catalog matrix for first-pass scoring.
+
+With VECTOR_QUANTIZATION=int8 each row is stored as int8 codes plus one float32
+scale (max|x| / 127), about 1/4 of the float32 size; float16 halves it.
+Search scores the compact matrix, keeps the best top_k * RERANK_FACTOR rows and
+re-ranks only those with exact float32 vectors read from the memory-mapped
+store, so the full-precision matrix never has to be resident.
+
+The compact matrix is a .npz sidecar next to the store (embeddings.int8.npz);
+when it is missing it is computed at load time from the store in chunks.
+
+Usage (run from backend/):
+    python -m vector.quantization build [--store embeddings.bin] [--kind int8]
+"""
+import os
+import time
+import argparse
+
+import numpy as np
+
+from vector.ann_index import ids_fingerprint
+from vector.shared_files import load_npz_mmap
+
+# "none", "int8" or "float16"
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").strip().lower()
+# Candidates re-ranked exactly per query: max(top_k * RERANK_FACTOR, RERANK_MIN)
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+RERANK_MIN = int(os.getenv("RERANK_MIN", "50"))
+
+KINDS = ("int8", "float16")
+
+# Rows converted to float32 at a time while scoring/quantizing
+CHUNK_ROWS = 16384
+
+
+def quantized_path_for(store_path: str, kind: str) -> str:
+    """embeddings.bin -> embeddings.int8.npz (same directory)"""
+    return f"{os.path.splitext(store_path)[0]}.{kind}.npz"
+
+
+class QuantizedMatrix:
+    def __init__(self, kind: str, data: np.ndarray, scales: np.ndarray | None, fingerprint: int):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown quantization {kind!r}; choose from {KINDS}")
+        self.kind = kind
+        self.data = data
+        self.scales = scales
+        self.fingerprint = int(fingerprint)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, ids: np.ndarray, kind: str):
+        n, dim = matrix.shape
+        if kind == "float16":
+            data = np.empty((n, dim), dtype=np.float16)
+            scales = None
+        else:
+            data = np.empty((n, dim), dtype=np.int8)
+            scales = np.empty(n, dtype=np.float32)
+        for start in range(0, n, CHUNK_ROWS):
+            block = np.asarray(matrix[start:start + CHUNK_ROWS], dtype=np.float32)
+            if kind == "float16":
+                data[start:start + CHUNK_ROWS] = block
+                continue
+            row_scale = np.abs(block).max(axis=1) / 127.0
+            row_scale[row_scale == 0] = 1.0
+            data[start:start + CHUNK_ROWS] = np.rint(block / row_scale[:, None])
+            scales[start:start + CHUNK_ROWS] = row_scale
+        return cls(kind, data, scales, ids_fingerprint(ids))
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp.npz"
+        arrays = {"data": self.data, "fingerprint": np.int64(self.fingerprint), "kind": np.array(self.kind)}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        # Mapped rather than copied, so every worker process shares one copy of the matrix
+        f = load_npz_mmap(path)
+        return cls(str(f["kind"]), f["data"], f.get("scales"), int(f["fingerprint"]))
+
+    def matches(self, ids: np.ndarray, dim: int) -> bool:
+        return (
+            self.data.shape[0] == ids.shape[0]
+            and self.data.shape[1] == dim
+            and self.fingerprint == ids_fingerprint(ids)
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Approximate dot products of (b, dim) float32 queries against every row, as (b, n).
+        Chunks are widened to float32 so scoring stays on BLAS without a full-size copy.
+        """
+        n = self.data.shape[0]
+        out = np.empty((queries.shape[0], n), dtype=np.float32)
+        for start in range(0, n, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, n)
+            out[:, start:stop] = queries @ self.data[start:stop].astype(np.float32).T
+            if self.scales is not None:
+                out[:, start:stop] *= self.scales[start:stop]
+        return out
+
+
+def main():
+    from vector.embedding_store import open_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Build the compact matrix for an embedding store")
+    build.add_argument("--store", default=os.path.join(os.path.dirname(__file__), "embeddings.bin"))
+    build.add_argument("--kind", choices=KINDS, default="int8")
+    args = parser.parse_args()
+
+    header, ids, matrix = open_store(args.store)
+    out = quantized_path_for(args.store, args.kind)
+    t0 = time.perf_counter()
+    q = QuantizedMatrix.build(matrix, ids, args.kind)
+    q.save(out)
+    full = 4 * header.count * header.dim
+    print(f"Wrote {out} in {time.perf_counter() - t0:.1f}s: {q.nbytes / 1e6:.1f} MB "
+          f"vs {full / 1e6:.1f} MB float32 ({100 * (1 - q.nbytes / full):.0f}% saved)")
+
+
+if __name__ == "__main__":
+    main()
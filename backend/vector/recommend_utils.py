@@ -1,28 +1,61 @@
 from sqlalchemy import select
 
 from db import GroceryItem
-from vector.vector_search import search_similar_items
+from vector.vector_search import search_many
+from vector.index_reloader import require_index
 
-async def get_relevant_grocery_items(session, product_name: str, limit: int = 10):
+async def get_relevant_grocery_items(session, product_name: str, limit: int = 10, mode: str | None = None,
+                                     filters=None, rating_weight: float = 0.0):
     """
     embedding-based grocery item matcher
-    Returns SQLAlchemy GroceryItem objects
+    Returns CatalogItem records (GroceryItem objects for ids missing from the catalog cache)
     """
+    results = await get_relevant_grocery_items_many(
+        session, [product_name], limit=limit, mode=mode, filters=filters, rating_weight=rating_weight
+    )
+    return results[0]
 
-    scored = await search_similar_items(product_name, top_k=limit)
-
-    if not scored:
+async def get_relevant_grocery_items_many(session, product_names, limit: int = 10, mode: str | None = None,
+                                          filters=None, rating_weight: float = 0.0, with_scores: bool = False):
+    """
+    Batched matcher: one embeddings request and one scoring pass for all
+    product names. `mode` ("hybrid", "vector" or "lexical"), `filters`
+    (SearchFilters) and `rating_weight` are passed to search_many, so only rows
+    that pass the filters are ever returned.
+    Results are hydrated from the snapshot's in-memory catalog; the database is
+    only queried (one `IN` query) for ids the snapshot does not know.
+    Returns one list of items per name, in input order; with_scores=True gives
+    (item, score) pairs instead, best first.
+    """
+    product_names = list(product_names)
+    if not product_names:
         return []
 
-    ids = [gid for gid, _ in scored]
-
-    res = await session.execute(
-        select(GroceryItem).where(GroceryItem.id.in_(ids))
+    # One snapshot for both scoring and hydration, even if a reload lands in between
+    index = require_index()
+    scored_lists = await search_many(
+        product_names, top_k=limit, mode=mode, filters=filters, rating_weight=rating_weight, index=index
     )
-    items = res.scalars().all()
 
-    # Sort by embedding
-    id_to_item = {item.id: item for item in items}
-    sorted_items = [id_to_item[i] for i in ids if i in id_to_item]
+    all_ids = {gid for scored in scored_lists for gid, _ in scored}
+    if not all_ids:
+        return [[] for _ in product_names]
 
-    return sorted_items
\ No newline at end of file
+    id_to_item = index.columns.items(all_ids) if index.columns is not None else {}
+    missing = all_ids - id_to_item.keys()
+    if missing:
+        res = await session.execute(
+            select(GroceryItem).where(GroceryItem.id.in_(missing))
+        )
+        id_to_item.update({item.id: item for item in res.scalars().all()})
+
+    # Sort by embedding
+    if with_scores:
+        return [
+            [(id_to_item[gid], float(score)) for gid, score in scored if gid in id_to_item]
+            for scored in scored_lists
+        ]
+    return [
+        [id_to_item[gid] for gid, _ in scored if gid in id_to_item]
+        for scored in scored_lists
+    ]
@@ -0,0 +1,116 @@
+"""
+Runs CPU-bound scoring off the asyncio event loop.
+
+numpy releases the GIL inside matrix products, argpartition and the IVF
+gathers, so a small thread pool scores several searches in parallel while the
+event loop keeps serving WebSocket traffic. Admission is bounded: at most
+SCORING_QUEUE_LIMIT jobs may be running or waiting, and a job that cannot get a
+slot within SCORING_QUEUE_TIMEOUT seconds fails with ScoringOverloaded instead
+of piling up behind the others.
+
+SCORING_THREADS=0 scores inline on the event loop (the old behaviour, kept for
+comparison in `python -m vector.benchmark looplag`).
+"""
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCORING_THREADS = int(os.getenv("SCORING_THREADS", str(min(4, os.cpu_count() or 1))))
+SCORING_QUEUE_LIMIT = int(os.getenv("SCORING_QUEUE_LIMIT", "64"))
+SCORING_QUEUE_TIMEOUT = float(os.getenv("SCORING_QUEUE_TIMEOUT", "2"))
+# Query batches larger than this are split into chunks scored in parallel
+SCORING_SPLIT_ROWS = int(os.getenv("SCORING_SPLIT_ROWS", "32"))
+
+
+class ScoringOverloaded(RuntimeError):
+    """Raised when the scoring queue stays full for SCORING_QUEUE_TIMEOUT seconds."""
+
+
+class ScoringPool:
+    def __init__(self, threads: int = SCORING_THREADS, queue_limit: int = SCORING_QUEUE_LIMIT,
+                 queue_timeout: float = SCORING_QUEUE_TIMEOUT):
+        self.threads = threads
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="scoring") if threads > 0 else None
+        self._slots = None  # created lazily inside the running loop
+        self._lock = threading.Lock()  # guards the counters updated by worker threads
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on a worker thread (inline if the pool is disabled)."""
+        if self._executor is None:
+            return self._timed(fn, *args)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_limit)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ScoringOverloaded(f"Scoring queue full ({self.queue_limit} jobs) for {self.queue_timeout}s")
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def map_chunks(self, fn, items, chunk_rows: int = SCORING_SPLIT_ROWS):
+        """
+        fn(chunk) for consecutive chunks of `items` (a sequence or array), run in
+        parallel; the per-chunk result lists are concatenated in order.
+        """
+        if len(items) <= chunk_rows or self.threads <= 1:
+            return await self.run(fn, items)
+        chunks = [items[i:i + chunk_rows] for i in range(0, len(items), chunk_rows)]
+        parts = await asyncio.gather(*(self.run(fn, chunk) for chunk in chunks))
+        return [r for part in parts for r in part]
+
+    def _timed(self, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                self.busy_seconds += elapsed
+                self.completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed, busy_seconds = self.completed, self.busy_seconds
+        return {
+            "threads": self.threads,
+            "queue_limit": self.queue_limit,
+            "in_flight": self.in_flight,
+            "completed": completed,
+            "rejected": self.rejected,
+            "busy_seconds": round(busy_seconds, 3),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+
+
+def get_scoring_pool() -> ScoringPool:
+    global _pool
+    if _pool is None:
+        _pool = ScoringPool()
+    return _pool
+
+
+def set_scoring_pool(pool: ScoringPool):
+    """Replace the process-wide pool (benchmarks)."""
+    global _pool
+    if _pool is not None and _pool is not pool:
+        _pool.shutdown()
+    _pool = pool
@@ -0,0 +1,93 @@
+"""
+Helpers for sharing the search artifacts between uvicorn worker processes.
+
+Every worker maps the same read-only files, so the OS page cache holds one copy
+of the vectors no matter how many workers run (uvicorn --workers N, or
+WEB_CONCURRENCY). Two things make that work:
+
+- load_npz_mmap(): the .npz sidecars (IVF lists, int8/float16 matrix) are
+  written uncompressed by np.savez, so each member is a plain .npy blob at a
+  fixed offset inside the zip; it is mapped in place instead of read into
+  private memory.
+- file_lock(): artifacts that are derived at startup (downloads, SQLite ->
+  store conversion, a missing quantized sidecar) are produced by whichever
+  worker gets the lock first; the others wait and then map the result.
+"""
+import os
+import struct
+import zipfile
+import contextlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, each worker derives its own copy
+    fcntl = None
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")  # zip local file header, 30 bytes
+
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    """Exclusive advisory lock on `path` (created if missing) for the duration of the block."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def lock_path_for(artifact_path: str) -> str:
+    """One lock per artifact directory: embeddings.bin -> .embeddings.lock next to it."""
+    return os.path.join(os.path.dirname(os.path.abspath(artifact_path)), ".embeddings.lock")
+
+
+def load_npz_mmap(path: str) -> dict:
+    """
+    {name: array} for an .npz file, with every uncompressed numeric member
+    returned as a read-only np.memmap of the file. Compressed or object members
+    fall back to a regular (private) load.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as raw:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            mapped = None
+            if info.compress_type == zipfile.ZIP_STORED:
+                mapped = _map_member(path, raw, info)
+            if mapped is None:
+                with zf.open(info) as member:
+                    mapped = np.lib.format.read_array(member, allow_pickle=False)
+            arrays[name] = mapped
+    return arrays
+
+
+def _map_member(path: str, raw, info: zipfile.ZipInfo):
+    raw.seek(info.header_offset)
+    fields = _LOCAL_HEADER.unpack(raw.read(_LOCAL_HEADER.size))
+    if fields[0] != b"PK\x03\x04":
+        return None
+    name_len, extra_len = fields[-2], fields[-1]
+    start = info.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+
+    raw.seek(start)
+    version = np.lib.format.read_magic(raw)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(raw)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(raw)
+    if dtype.hasobject:
+        return None
+    offset = raw.tell()
+    if int(np.prod(shape)) == 0 or shape == ():
+        # Scalars and empty arrays: nothing worth sharing, and memmap rejects zero-size maps
+        raw.seek(start)
+        return np.lib.format.read_array(raw, allow_pickle=False)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
@@ -1,59 +1,387 @@
 import os
 import json
+import time
 import sqlite3
+import weakref
 import numpy as np
 
+from vector.embedding_provider import get_embedding_provider
+from vector.embedding_store import open_store, convert_sqlite_to_store
+from vector.ann_index import IVFIndex, ann_path_for
+from vector.quantization import QuantizedMatrix, VECTOR_QUANTIZATION, quantized_path_for
+from vector.shared_files import file_lock, lock_path_for
+
 # --- PATH CONFIGURATION ---
 # Cloud Run uses /tmp because it's the only writable directory.
 # Local development usually keeps the file in the project root.
 CLOUD_PATH = "/tmp/embeddings.sqlite"
 LOCAL_PATH = "./embeddings.sqlite"
 
-# Logic: Use /tmp if it exists (Cloud Run), otherwise fallback to local file.
-if os.path.exists(CLOUD_PATH):
-    EMBED_DB_PATH = CLOUD_PATH
-else:
-    EMBED_DB_PATH = LOCAL_PATH
+# Binary memory-mapped store (see vector/embedding_store.py); preferred over SQLite when present
+CLOUD_STORE_PATH = "/tmp/embeddings.bin"
+LOCAL_STORE_PATH = "./embeddings.bin"
+
+
+class IndexNotReady(RuntimeError):
+    """Raised by searches that arrive before the first index snapshot is loaded."""
+
+
+class IndexSourceError(RuntimeError):
+    """Raised by build_index(strict=True) when no embedding source could be loaded."""
+
+
+def _resolve_path(cloud_path: str, local_path: str) -> str:
+    # Use /tmp if it exists (Cloud Run), otherwise fallback to local file.
+    # Resolved at load time: app.py downloads into /tmp after this module is imported.
+    return cloud_path if os.path.exists(cloud_path) else local_path
+
+
+EMBED_DB_PATH = os.getenv("EMBED_DB_PATH") or None
+EMBED_STORE_PATH = os.getenv("EMBED_STORE_PATH") or None
+# With only the SQLite file available, convert it once to a mapped store next to it
+# (embeddings.sqlite.bin) so worker processes share the vectors instead of each
+# parsing its own float32 copy
+SQLITE_TO_STORE = os.getenv("SQLITE_TO_STORE", "1") == "1"
 # --------------------------
 
-_cached_vectors = None
 
+def normalize_rows(matrix: np.ndarray, copy: bool = True) -> np.ndarray:
+    """
+    Return `matrix` as C-contiguous float32 with every row scaled to unit length.
+    All-zero rows are left as zeros so they always score 0.
+    With copy=False a float32 C-contiguous input is normalized in place.
+    """
+    if copy:
+        matrix = np.array(matrix, dtype=np.float32, order="C")
+    else:
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if matrix.ndim != 2 or matrix.shape[0] == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
 
-def load_embeddings_into_memory():
-    global _cached_vectors
-    if _cached_vectors is not None:
-        return _cached_vectors
 
-    if not os.path.exists(EMBED_DB_PATH):
-        print(f"[vector_cache] ERROR: Database not found at {EMBED_DB_PATH}")
-        print(f"[vector_cache] Make sure app.py downloaded it to /tmp or it exists locally.")
-        _cached_vectors = []
-        return _cached_vectors
+def _is_mapped(array) -> bool:
+    return isinstance(array, np.memmap) or isinstance(getattr(array, "base", None), np.memmap)
+
+
+class EmbeddingIndex:
+    """
+    The grocery catalog embeddings, held as one contiguous, L2-normalized
+    float32 matrix plus a parallel id array (row i of `matrix` is item `ids[i]`).
+    Cosine similarity against a unit query is then a single matrix-vector product.
+    """
+
+    def __init__(self, ids, matrix, normalized: bool = False):
+        # Optional IVFIndex over the same rows (see vector/ann_index.py)
+        self.ann = None
+        # Optional int8/float16 copy for first-pass scoring (see vector/quantization.py)
+        self.quantized = None
+        # Optional CatalogColumns aligned with the rows (see vector/catalog_columns.py)
+        self.columns = None
+        # Optional BM25 index over the same catalog version (see vector/lexical_index.py)
+        self.lexical = None
+        # Snapshot bookkeeping, set by build_index / swap_index
+        self.version = 0
+        self.source = None
+        self.signature = None
+        self.loaded_at = None
+        self.load_seconds = None
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+        if normalized:
+            self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        else:
+            self.matrix = normalize_rows(matrix)
 
-    print(f"[vector_cache] Loading embeddings from {EMBED_DB_PATH} ...")
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), normalized=True)
 
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0
+
+    def describe(self) -> dict:
+        float32_bytes = 4 * len(self) * self.dim
+        return {
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "load_seconds": self.load_seconds,
+            "rows": len(self),
+            "dim": self.dim,
+            "memory_mapped": _is_mapped(self.matrix),
+            "float32_bytes": float32_bytes,
+            "ann_lists": self.ann.n_lists if self.ann is not None else None,
+            "quantization": self.quantized.kind if self.quantized is not None else None,
+            "quantized_bytes": self.quantized.nbytes if self.quantized is not None else None,
+            # Mapped arrays live in the page cache, shared by every worker process
+            "ann_mapped": _is_mapped(self.ann.order) if self.ann is not None else None,
+            "quantized_mapped": _is_mapped(self.quantized.data) if self.quantized is not None else None,
+            "columns": self.columns.describe() if self.columns is not None else None,
+            "lexical_items": len(self.lexical) if self.lexical is not None else None,
+        }
+
+
+_cached_index = None
+
+
+def _load_from_sqlite(path: str) -> EmbeddingIndex:
+    conn = sqlite3.connect(path)
     try:
-        conn = sqlite3.connect(EMBED_DB_PATH)
         cursor = conn.cursor()
         # Ensure the table name matches your actual DB schema
         cursor.execute("SELECT grocery_item_id, embedding FROM grocery_item_embeddings")
         rows = cursor.fetchall()
+    finally:
         conn.close()
 
-        vectors = []
-        for gid, emb in rows:
-            # Parse JSON string back to numpy array
-            arr = np.array(json.loads(emb), dtype=np.float32)
-            vectors.append((gid, arr))
+    if not rows:
+        return EmbeddingIndex.empty()
+
+    # Fill one preallocated matrix instead of keeping a list of per-item arrays
+    dim = len(json.loads(rows[0][1]))
+    _check_dimensions(dim, path)
+    ids = np.empty(len(rows), dtype=np.int64)
+    matrix = np.empty((len(rows), dim), dtype=np.float32)
+    for i, (gid, emb) in enumerate(rows):
+        ids[i] = gid
+        matrix[i] = json.loads(emb)
+
+    return EmbeddingIndex(ids, normalize_rows(matrix, copy=False), normalized=True)
+
+
+def _check_dimensions(dim: int, source: str):
+    """Refuse an index whose width differs from the embedding provider's query width."""
+    expected = get_embedding_provider().dim
+    if expected and dim and dim != expected:
+        raise ValueError(
+            f"{source} holds {dim}-dim embeddings but the {get_embedding_provider().name} provider "
+            f"produces {expected}; rebuild it (e.g. `python -m vector.embedding_store convert --dims {expected}`)"
+        )
+
+
+def _load_from_store(path: str) -> EmbeddingIndex:
+    header, ids, matrix = open_store(path)
+    _check_dimensions(header.dim, path)
+    model = get_embedding_provider().model_name
+    if header.model != model:
+        print(f"[vector_cache] WARNING: store was built with {header.model}, queries use {model}")
+    if not header.normalized:
+        # Rare (store written with normalize=False): materialize a normalized copy
+        return EmbeddingIndex(ids, matrix)
+    # Zero-copy: the matrix stays a read-only mapping of the file
+    return EmbeddingIndex(ids, matrix, normalized=True)
 
-        _cached_vectors = vectors
-        print(f"[vector_cache] Loaded {len(vectors)} vectors into memory")
+
+def _attach_ann(index: EmbeddingIndex, embeddings_path: str):
+    """Load the IVF sidecar (embeddings.ivf.npz) if present and built for these exact rows."""
+    path = ann_path_for(embeddings_path)
+    if not os.path.exists(path) or len(index) == 0:
+        return
+    try:
+        ann = IVFIndex.load(path)
     except Exception as e:
-        print(f"[vector_cache] Database error: {e}")
-        _cached_vectors = []
+        print(f"[vector_cache] Ignoring unreadable ANN index {path}: {e}")
+        return
+    if not ann.matches(index.ids, index.dim):
+        print(f"[vector_cache] Ignoring stale ANN index {path} (built for different rows); using exact search")
+        return
+    index.ann = ann
+    print(f"[vector_cache] Loaded ANN index {path} ({ann.n_lists} lists)")
+
+
+def _attach_quantized(index: EmbeddingIndex, store_path: str):
+    """
+    Load (or build in chunks) the compact matrix selected by VECTOR_QUANTIZATION.
+    Only used for store-backed indexes: re-ranking then reads float32 rows from the
+    mapping, so the full-precision matrix need not stay resident.
+    """
+    kind = VECTOR_QUANTIZATION
+    if kind in ("", "none") or len(index) == 0:
+        return
+    path = quantized_path_for(store_path, kind)
+    quantized = None
+    if os.path.exists(path):
+        try:
+            quantized = QuantizedMatrix.load(path)
+        except Exception as e:
+            print(f"[vector_cache] Ignoring unreadable quantized matrix {path}: {e}")
+        if quantized is not None and not quantized.matches(index.ids, index.dim):
+            print(f"[vector_cache] Ignoring stale quantized matrix {path} (built for different rows)")
+            quantized = None
+    if quantized is None:
+        quantized = _build_shared_quantized(index, path, kind)
+    index.quantized = quantized
+    print(f"[vector_cache] Using {kind} first-pass matrix ({quantized.nbytes / 1e6:.1f} MB)")
+
+
+def _build_shared_quantized(index: EmbeddingIndex, path: str, kind: str) -> QuantizedMatrix:
+    """
+    Quantize once and save the sidecar, so the other workers map the file instead
+    of each building a private copy. Whoever holds the lock builds; the rest
+    find a matching file when they get it.
+    """
+    with file_lock(lock_path_for(path)):
+        if os.path.exists(path):
+            try:
+                quantized = QuantizedMatrix.load(path)
+                if quantized.matches(index.ids, index.dim):
+                    return quantized
+            except Exception:
+                pass
+        print(f"[vector_cache] Quantizing {len(index)} vectors to {kind} ...")
+        quantized = QuantizedMatrix.build(index.matrix, index.ids, kind)
+        try:
+            quantized.save(path)
+            return QuantizedMatrix.load(path)
+        except OSError as e:
+            print(f"[vector_cache] Could not save {path} ({e}); keeping a private copy")
+            return quantized
+
+
+def _derived_store_path(db_path: str) -> str:
+    return db_path + ".bin"
+
+
+def _sqlite_as_store(db_path: str):
+    """
+    Path of a store converted from `db_path`, (re)converting it under the lock
+    when missing or older than the database. None if the conversion fails.
+    """
+    store_path = _derived_store_path(db_path)
+    with file_lock(lock_path_for(db_path)):
+        if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(db_path):
+            print(f"[vector_cache] Converting {db_path} to a shared store {store_path} ...")
+            try:
+                convert_sqlite_to_store(db_path, store_path, model=get_embedding_provider().model_name)
+            except Exception as e:
+                print(f"[vector_cache] Conversion failed ({e}); loading SQLite into private memory")
+                return None
+    return store_path
+
+
+def _source_paths():
+    store_path = EMBED_STORE_PATH or _resolve_path(CLOUD_STORE_PATH, LOCAL_STORE_PATH)
+    db_path = EMBED_DB_PATH or _resolve_path(CLOUD_PATH, LOCAL_PATH)
+    return store_path, db_path
+
+
+def source_signature():
+    """
+    (path, mtime_ns, size) of every file an index build would read, sidecars
+    included. A different signature means the artifacts on disk have changed.
+    """
+    store_path, db_path = _source_paths()
+    paths = [
+        store_path,
+        ann_path_for(store_path),
+        quantized_path_for(store_path, VECTOR_QUANTIZATION) if VECTOR_QUANTIZATION not in ("", "none") else None,
+        db_path,
+        ann_path_for(db_path),
+        _derived_store_path(db_path),
+    ]
+    signature = []
+    for path in paths:
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            signature.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+def build_index(strict: bool = False) -> EmbeddingIndex:
+    """
+    Load a fresh snapshot from disk without touching the live one.
+    Prefers the binary store, falls back to SQLite; an empty index if neither
+    loads, or IndexSourceError with strict=True (so it is never published).
+    """
+    t0 = time.perf_counter()
+    signature = source_signature()
+    store_path, db_path = _source_paths()
+    index = None
+
+    if os.path.exists(store_path):
+        print(f"[vector_cache] Mapping embedding store {store_path} ...")
+        try:
+            index = _load_from_store(store_path)
+            print(f"[vector_cache] Mapped {len(index)} vectors (dim={index.dim})")
+            _attach_ann(index, store_path)
+            _attach_quantized(index, store_path)
+            index.source = store_path
+        except Exception as e:
+            print(f"[vector_cache] Store error: {e}; falling back to SQLite")
+            index = None
+
+    if index is None and not os.path.exists(db_path):
+        print(f"[vector_cache] ERROR: Database not found at {db_path}")
+        print(f"[vector_cache] Make sure app.py downloaded it to /tmp or it exists locally.")
+        if strict:
+            raise IndexSourceError(f"No embedding store or database at {store_path} / {db_path}")
+        index = EmbeddingIndex.empty()
+    elif index is None:
+        derived = _sqlite_as_store(db_path) if SQLITE_TO_STORE else None
+        try:
+            if derived:
+                index = _load_from_store(derived)
+                print(f"[vector_cache] Mapped {len(index)} vectors converted from {db_path} (dim={index.dim})")
+                _attach_quantized(index, derived)
+            else:
+                print(f"[vector_cache] Loading embeddings from {db_path} ...")
+                index = _load_from_sqlite(db_path)
+                print(f"[vector_cache] Loaded {len(index)} vectors into memory (dim={index.dim})")
+            _attach_ann(index, db_path)
+            index.source = db_path
+        except Exception as e:
+            print(f"[vector_cache] Database error: {e}")
+            if strict:
+                raise IndexSourceError(f"Could not load embeddings from {db_path}: {e}") from e
+            index = EmbeddingIndex.empty()
+        # The conversion may have created or refreshed the derived store
+        signature = source_signature()
+
+    index.signature = signature
+    index.load_seconds = round(time.perf_counter() - t0, 3)
+    return index
+
+
+def swap_index(index: EmbeddingIndex) -> EmbeddingIndex:
+    """
+    Publish `index` as the live snapshot (a single reference assignment).
+    Searches already running keep the snapshot they started with; the old one
+    is freed, and its file mappings closed, once the last of them finishes.
+    """
+    global _cached_index
+    old = _cached_index
+    index.version = (old.version if old is not None else 0) + 1
+    index.loaded_at = time.time()
+    _cached_index = index
+    if old is not None:
+        weakref.finalize(old, print, f"[vector_cache] Released index snapshot v{old.version}")
+    print(f"[vector_cache] Serving index snapshot v{index.version}: {len(index)} vectors, "
+          f"loaded in {index.load_seconds}s")
+    return old
+
+
+def load_embeddings_into_memory() -> EmbeddingIndex:
+    """
+    Synchronous load on first use, for scripts. The server loads in the background
+    instead (index_reloader.start_index_loading) and never calls this on the event loop.
+    """
+    if _cached_index is not None:
+        return _cached_index
+    swap_index(build_index())
+    return _cached_index
+
 
-    return _cached_vectors
+def get_cached_embeddings() -> EmbeddingIndex:
+    return load_embeddings_into_memory()
 
 
-def get_cached_embeddings():
-    return load_embeddings_into_memory()
\ No newline at end of file
+def peek_index():
+    """The live snapshot, or None if none has been loaded yet (never triggers a load)."""
+    return _cached_index
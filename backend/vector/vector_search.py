@@ -1,28 +1,308 @@
+import os
+import asyncio
+
 import numpy as np
 
-from llm import get_embedding
-from vector.vector_cache import get_cached_embeddings
+from vector.vector_cache import EmbeddingIndex
+from vector.embedding_cache import get_embedding_cache
+from vector.embedding_provider import get_embedding_provider
+from vector.ann_index import IVF_NPROBE, ANN_MIN_ROWS
+from vector.quantization import RERANK_FACTOR, RERANK_MIN
+from vector.lexical_index import rrf_fuse
+from vector.catalog_columns import SearchFilters
+from vector.index_reloader import require_index
+from vector.scoring_pool import get_scoring_pool
+
+# Queries scored per matrix-matrix product; bounds the (queries x catalog) score buffer
+QUERY_BLOCK = 64
+
+SEARCH_MODES = ("hybrid", "vector", "lexical")  # see search_many
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid").strip().lower()
+if SEARCH_MODE not in SEARCH_MODES:
+    print(f"[vector_search] Unknown SEARCH_MODE {SEARCH_MODE!r} (expected one of {', '.join(SEARCH_MODES)}); using hybrid")
+    SEARCH_MODE = "hybrid"
+# Seconds to wait for the embedding provider before answering lexically
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "5"))
+# Each ranking contributes top_k * factor candidates to the fusion
+HYBRID_DEPTH_FACTOR = int(os.getenv("HYBRID_DEPTH_FACTOR", "4"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Floor for row weights when dividing negative scores (a zero rating weighs 0)
+_MIN_WEIGHT = 1e-3
 
 
 async def embed_query(text: str):
-    """LLM embedding for the search query"""
-    return np.array(await get_embedding(text), dtype=np.float32)
+    """Embedding for the search query (served from the query embedding cache when possible)"""
+    return (await embed_queries([text]))[0]
+
+async def embed_queries(texts):
+    """
+    Embeddings for many search queries as a (len(texts), dim) matrix, from the
+    EMBEDDING_PROVIDER. For a remote provider cached texts skip the network and
+    the rest go out in one embeddings request; local providers are called directly.
+    """
+    provider = get_embedding_provider()
+    if not provider.remote:
+        return await provider.embed(texts)
+    return await get_embedding_cache().get_many(texts, provider.cache_key, _fetch_embeddings)
+
+async def _fetch_embeddings(texts, model=None):
+    # `model` is the cache key; the provider knows its own model and width
+    return await get_embedding_provider().embed(texts)
+
+def _normalize_queries(q_embs: np.ndarray) -> np.ndarray:
+    q = np.atleast_2d(np.asarray(q_embs, dtype=np.float32))
+    norms = np.linalg.norm(q, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return q / norms
+
+def _select_top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Row-wise indices of the top_k scores, best first (argpartition + sort of the winners only)."""
+    n = scores.shape[1]
+    k = min(top_k, n)
+    if k < n:
+        top = np.argpartition(scores, n - k, axis=1)[:, n - k:]
+    else:
+        top = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+def _use_ann(index: EmbeddingIndex, exact: bool) -> bool:
+    return not exact and index.ann is not None and len(index) >= ANN_MIN_ROWS
+
+def _row_adjustments(index: EmbeddingIndex, filters: SearchFilters | None, rating_weight: float):
+    """(keep mask, score multipliers) over all rows; either is None when unused."""
+    if (filters is None or filters.is_empty()) and not rating_weight:
+        return None, None
+    if index.columns is None:
+        raise ValueError("Attribute filters need catalog columns; call load_catalog_columns at startup")
+    return index.columns.mask(filters), index.columns.row_weights(filters, rating_weight)
+
+def _adjust(scores: np.ndarray, keep, weights, rows=None) -> np.ndarray:
+    """
+    Apply the row weights and mask to scores (last axis = rows, or the given row subset).
+    A weight above 1 always raises a score and one below 1 always lowers it: negative
+    scores (common with low-dimensional or hashed embeddings) are divided instead of
+    multiplied, so a boost never pushes a negative-scoring row further down.
+    """
+    if weights is not None:
+        w = weights if rows is None else weights[rows]
+        scores = np.where(scores >= 0, scores * w, scores / np.maximum(w, _MIN_WEIGHT))
+    if keep is not None:
+        scores = np.where(keep if rows is None else keep[rows], scores, -np.inf)
+    return scores
+
+def _pairs(ids, rows, scores):
+    return [(int(ids[i]), float(s)) for i, s in zip(rows, scores) if s != -np.inf]
+
+def top_k_similar_many(index: EmbeddingIndex, q_embs: np.ndarray, top_k: int = 10, nprobe: int | None = None, exact: bool = False,
+                       filters: SearchFilters | None = None, rating_weight: float = 0.0):
+    """
+    Cosine top-k for a batch of queries.
+    Exact by default: each block of queries is scored with one matrix-matrix product
+    (against the compact matrix plus a float32 re-rank when the index is quantized).
+    If the index carries an IVF sidecar (and exact=False), only the `nprobe` closest
+    clusters are scored per query; a query whose probed clusters hold fewer than
+    top_k eligible rows falls back to the exact scan.
+    `filters` masks rows out and rating_weight > 0 ranks by
+    similarity * (rating / 5) ** rating_weight; both are applied to the score
+    arrays before top-k selection and need `index.columns`.
+    Returns one [(grocery_item_id, score), ...] list per query, best first.
+    Zero query vectors get an empty list.
+    """
+    keep, weights = _row_adjustments(index, filters, rating_weight)
+    return _top_k_adjusted(index, q_embs, top_k, nprobe, exact, keep, weights)
+
+def _top_k_adjusted(index: EmbeddingIndex, q_embs: np.ndarray, top_k: int, nprobe: int | None, exact: bool, keep, weights):
+    """top_k_similar_many with the row mask / weights already computed (safe to call from worker threads)."""
+    q = _normalize_queries(q_embs)
+    n = len(index)
+    if n == 0 or top_k <= 0:
+        return [[] for _ in range(q.shape[0])]
+    if q.shape[1] != index.dim:
+        raise ValueError(
+            f"Query embeddings have {q.shape[1]} dims but the catalog index has {index.dim}; "
+            f"the embedding provider's width (EMBEDDING_DIMENSIONS / LOCAL_EMBEDDING_DIM) must match the store"
+        )
+
+    eligible = n if keep is None else int(keep.sum())
+    if eligible == 0:
+        return [[] for _ in range(q.shape[0])]
+
+    ids = index.ids
+    results = [None] * q.shape[0]
+    exact_rows = []
+
+    if _use_ann(index, exact):
+        nprobe = nprobe or IVF_NPROBE
+        for row in range(q.shape[0]):
+            if not q[row].any():
+                results[row] = []
+                continue
+            if keep is None and weights is None:
+                rows, scores = index.ann.search(index.matrix, q[row], top_k, nprobe)
+            else:
+                rows = index.ann.candidates(q[row], nprobe)
+                if keep is not None:
+                    rows = rows[keep[rows]]
+                rows.sort()
+                scores = _adjust(index.matrix[rows] @ q[row], None, weights, rows)
+                top = _select_top_k(scores[None, :], top_k)[0] if rows.size else rows
+                rows, scores = rows[top], scores[top]
+            if rows.size < min(top_k, eligible):
+                exact_rows.append(row)
+                continue
+            results[row] = _pairs(ids, rows, scores)
+    else:
+        exact_rows = list(range(q.shape[0]))
+
+    for start in range(0, len(exact_rows), QUERY_BLOCK):
+        block_rows = exact_rows[start:start + QUERY_BLOCK]
+        block = q[block_rows]
+        top_rows, top_scores = _scan_block(index, block, top_k, exact, keep, weights)
+        for j, row in enumerate(block_rows):
+            if not block[j].any():
+                results[row] = []
+                continue
+            results[row] = _pairs(ids, top_rows[j], top_scores[j])
+    return results
+
+def _scan_block(index: EmbeddingIndex, block: np.ndarray, top_k: int, exact: bool, keep=None, weights=None):
+    """
+    Full scan for a block of normalized queries: (rows, scores) per query, best first.
+    With a quantized index (and exact=False) the compact matrix is scored first and
+    only the best max(top_k * RERANK_FACTOR, RERANK_MIN) rows are re-scored in float32.
+    Masked-out rows score -inf.
+    """
+    if exact or index.quantized is None:
+        scores = _adjust(block @ index.matrix.T, keep, weights)
+        top = _select_top_k(scores, top_k)
+        return top, np.take_along_axis(scores, top, axis=1)
+
+    n_candidates = max(top_k * RERANK_FACTOR, RERANK_MIN)
+    candidates = _select_top_k(_adjust(index.quantized.scores(block), keep, weights), n_candidates)
+    top_rows, top_scores = [], []
+    for j in range(block.shape[0]):
+        rows = np.sort(candidates[j])  # ascending gather from the mmapped float32 store
+        rescored = _adjust(np.asarray(index.matrix[rows]) @ block[j], keep, weights, rows)
+        top = _select_top_k(rescored[None, :], top_k)[0]
+        top_rows.append(rows[top])
+        top_scores.append(rescored[top])
+    return top_rows, top_scores
+
+def top_k_similar(index: EmbeddingIndex, q_emb: np.ndarray, top_k: int = 10, nprobe: int | None = None, exact: bool = False,
+                  filters: SearchFilters | None = None, rating_weight: float = 0.0):
+    """
+    Cosine top-k for one query (see top_k_similar_many).
+    The exact path scores every row with one matrix-vector product against the
+    normalized query, then uses argpartition so only the k winners get sorted.
+    Returns [(grocery_item_id, score), ...] best first.
+    """
+    q = np.asarray(q_emb, dtype=np.float32).reshape(1, -1)
+    return top_k_similar_many(index, q, top_k, nprobe, exact, filters, rating_weight)[0]
+
+async def search_similar_items(query: str, top_k: int = 10, nprobe: int | None = None, exact: bool = False, mode: str | None = None,
+                               filters: SearchFilters | None = None, rating_weight: float = 0.0):
+    """
+    Return top-k matched grocery items as [(grocery_item_id, score), ...].
+    nprobe trades recall for speed when an ANN index is loaded; exact=True forces a
+    full-precision scan (no ANN, no quantization). `filters` (price cap, minimum
+    rating, sub-category set) and `rating_weight` (similarity x rating) are applied
+    before top-k, e.g. "best-rated under $10 in Produce":
+        search_similar_items("apples", filters=SearchFilters(max_price=10, sub_categories={"Produce"}), rating_weight=1)
+    See search_many for `mode`.
+    """
+    return (await search_many([query], top_k, nprobe, exact, mode, filters, rating_weight))[0]
+
+def _lexical_search(lexical, index: EmbeddingIndex, query: str, top_k: int, keep, weights):
+    """BM25 top-k with the same row mask/weights as the vector side."""
+    if keep is None and weights is None:
+        return lexical.search(query, top_k)
+    # Every matching document, so filtering cannot starve the result
+    hits = lexical.search(query, len(lexical))
+    if not hits:
+        return []
+    gids = np.fromiter((gid for gid, _ in hits), dtype=np.int64, count=len(hits))
+    rows = index.columns.rows_of(gids)
+    scores = np.fromiter((score for _, score in hits), dtype=np.float32, count=len(hits))
+    known = rows >= 0
+    gids, rows, scores = gids[known], rows[known], scores[known]
+    scores = _adjust(scores, keep, weights, rows)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return _pairs(gids, order, scores[order])
+
+async def search_many(queries, top_k: int = 10, nprobe: int | None = None, exact: bool = False, mode: str | None = None,
+                      filters: SearchFilters | None = None, rating_weight: float = 0.0, index: EmbeddingIndex | None = None):
+    """
+    Batched search_similar_items: one embeddings request for all query texts,
+    one scoring pass for the whole batch. Duplicate texts are embedded once.
+
+    mode (default SEARCH_MODE):
+    - "vector":  cosine similarity only
+    - "hybrid":  vector and BM25 rankings fused with reciprocal rank fusion
+    - "lexical": BM25 only, no embedding call at all
+    Without a lexical index every mode behaves as "vector". With one, an
+    embedding call that fails or exceeds EMBEDDING_TIMEOUT degrades to lexical.
+    filters / rating_weight apply to every mode (see top_k_similar_many).
+    `index` pins the snapshot to search (default: the live one).
+    Scoring runs on the scoring pool, never on the event loop (see scoring_pool).
+    Raises ValueError for an unknown mode, IndexNotReady while the catalog
+    index is still loading, and ScoringOverloaded when the scoring queue stays full.
+    Returns one [(grocery_item_id, score), ...] list per query, in input order.
+    """
+    queries = list(queries)
+    if not queries:
+        return []
+
+    mode = (mode or SEARCH_MODE).lower()
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {mode!r}; expected one of {', '.join(SEARCH_MODES)}")
+    if index is None:
+        # Not `index or ...`: an empty pinned snapshot is falsy (len 0) but still the one to use
+        index = require_index()
+    # The snapshot's own BM25 index, built from the same catalog version as its vectors
+    lexical = index.lexical
+    if lexical is None:
+        mode = "vector"
+    pool = get_scoring_pool()
+    if (filters is None or filters.is_empty()) and not rating_weight:
+        keep, weights = None, None
+    else:
+        # The filter mask is O(catalog) work too, so it is computed on the pool as well
+        keep, weights = await pool.run(_row_adjustments, index, filters, rating_weight)
 
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    if np.linalg.norm(a) == 0 or np.linalg.norm(b) == 0:
-        return 0.0
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    def lexical_all(texts, depth):
+        return {q: _lexical_search(lexical, index, q, depth, keep, weights) for q in texts}
 
-async def search_similar_items(query: str, top_k: int = 10):
-    """Return top-k matched grocery items by cosine similarity."""
-    q_emb = await embed_query(query)
-    all_vectors = get_cached_embeddings()
+    unique = list(dict.fromkeys(queries))
+    if mode == "lexical":
+        by_text = await pool.run(lexical_all, unique, top_k)
+        return [by_text[q] for q in queries]
 
-    scored = []
-    for gid, vector in all_vectors:
-        score = cosine_similarity(q_emb, vector)
-        scored.append((gid, score))
+    try:
+        if lexical is None:
+            q_embs = await embed_queries(unique)
+        else:
+            q_embs = await asyncio.wait_for(embed_queries(unique), EMBEDDING_TIMEOUT)
+    except Exception as e:
+        if lexical is None:
+            raise
+        print(f"[vector_search] Embedding unavailable ({e!r}); answering with lexical search")
+        by_text = await pool.run(lexical_all, unique, top_k)
+        return [by_text[q] for q in queries]
 
-    scored.sort(key=lambda x: x[1], reverse=True)
+    depth = top_k if mode == "vector" else max(top_k * HYBRID_DEPTH_FACTOR, top_k)
+    # Scored on worker threads; a large batch is split so it spreads over the cores
+    vector_job = pool.map_chunks(
+        lambda chunk: _top_k_adjusted(index, chunk, depth, nprobe, exact, keep, weights), q_embs
+    )
 
-    return scored[:top_k]
\ No newline at end of file
+    if mode == "vector":
+        scored = await vector_job
+        by_text = dict(zip(unique, scored))
+    else:
+        scored, lexical_ranked = await asyncio.gather(vector_job, pool.run(lexical_all, unique, depth))
+        by_text = {
+            q: rrf_fuse([vector_ranked, lexical_ranked[q]], top_k, RRF_K)
+            for q, vector_ranked in zip(unique, scored)
+        }
+    return [by_text[q] for q in queries]
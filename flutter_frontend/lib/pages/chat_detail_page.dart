@@ -27,6 +27,8 @@ class _ChatDetailPageState extends State<ChatDetailPage> {
   final _messageController = TextEditingController();
   final _messages =
       <dynamic>[]; // Changed to dynamic to hold both Message and AIEvent
+  // stream_id -> index in _messages of the bot reply being streamed
+  final _streamingReplies = <String, int>{};
   late String _currentUsername;
   bool _isConnecting = true;
   bool _hasError = false;
@@ -47,6 +49,7 @@ class _ChatDetailPageState extends State<ChatDetailPage> {
     if (oldWidget.roomId != widget.roomId) {
       apiClient.disconnectWebSocket();
       _messages.clear();
+      _streamingReplies.clear();
       _hasError = false;
       _isConnecting = true;
       _initializeChat();
@@ -97,10 +100,49 @@ class _ChatDetailPageState extends State<ChatDetailPage> {
           }
         });
 
+        // Listen to streamed bot replies: grow one draft message per stream_id
+        apiClient.messageDeltaStream.listen((delta) {
+          if (mounted) {
+            final streamId = delta['stream_id'] as String;
+            final index = _streamingReplies[streamId];
+            setState(() {
+              if (index == null) {
+                _streamingReplies[streamId] = _messages.length;
+                _messages.add(Message(
+                  id: 'stream-$streamId',
+                  content: delta['delta'] ?? '',
+                  isBot: true,
+                  username: delta['username'] ?? 'LLM Bot',
+                  createdAt: DateTime.now(),
+                ));
+              } else {
+                final draft = _messages[index] as Message;
+                _messages[index] = Message(
+                  id: draft.id,
+                  content: draft.content + (delta['delta'] ?? ''),
+                  isBot: true,
+                  username: draft.username,
+                  createdAt: draft.createdAt,
+                );
+              }
+            });
+            _scrollToBottom();
+          }
+        });
+
         // Listen to Chat messages
         apiClient.messageStream.listen((msgData) {
           if (mounted) {
             final msg = Message.fromJson(msgData);
+            // The stored reply replaces its streamed draft
+            final draftIndex = _streamingReplies.remove(msgData['stream_id']);
+            if (draftIndex != null) {
+              setState(() {
+                _messages[draftIndex] = msg;
+              });
+              _scrollToBottom();
+              return;
+            }
             if (msg.content.startsWith('AI_EVENT_JSON:')) {
               try {
                 final jsonStr = msg.content.substring('AI_EVENT_JSON:'.length);
@@ -152,6 +194,7 @@ class _ChatDetailPageState extends State<ChatDetailPage> {
     try {
       final res = await apiClient.getRoomMessages(int.parse(widget.roomId));
       _messages.clear();
+      _streamingReplies.clear();
       for (var item in res) {
         final msg = Message.fromJson(item);
         if (msg.content.startsWith('AI_EVENT_JSON:')) {
@@ -259,9 +259,14 @@ class ApiClient {
   WebSocketChannel? _channel;
   final _aiEventController = StreamController<AIEvent>.broadcast();
   final _messageController = StreamController<Map<String, dynamic>>.broadcast();
+  final _messageDeltaController =
+      StreamController<Map<String, dynamic>>.broadcast();
 
   Stream<AIEvent> get aiEventStream => _aiEventController.stream;
   Stream<Map<String, dynamic>> get messageStream => _messageController.stream;
+  // Partial bot replies while they are generated; the final "message" carries the same stream_id
+  Stream<Map<String, dynamic>> get messageDeltaStream =>
+      _messageDeltaController.stream;
 
   void connectWebSocket(int roomId) {
     disconnectWebSocket(); // Ensure no existing connection
@@ -282,6 +287,8 @@ class ApiClient {
               _aiEventController.add(event);
             } else if (data['type'] == 'message') {
               _messageController.add(data['message']);
+            } else if (data['type'] == 'message_delta') {
+              _messageDeltaController.add(data);
             }
           } catch (e) {
             print('[ApiClient] WS Parse Error: $e');
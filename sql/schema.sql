@@ -92,6 +92,15 @@ CREATE TABLE IF NOT EXISTS grocery_items (
     INDEX idx_sub_category (sub_category)
 );
 
+-- Rolling summary of each room's older messages (see backend/chat_history.py)
+CREATE TABLE IF NOT EXISTS room_summaries (
+    room_id INT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    last_message_id INT NOT NULL DEFAULT 0 COMMENT 'Messages with id <= this are covered by the summary',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT fk_room_summary_room FOREIGN KEY (room_id) REFERENCES rooms(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='Rolling per-room chat summaries';
+
 -- ===========================================
 -- Migration: Add deleted_at to room_members
 -- ===========================================